@@ -1,55 +1,44 @@
+import json
 import uuid
 import time
-import json
-import hashlib
-import os
-
-from bokeh.embed import components
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-import requests
-from urllib.parse import quote
-from async_tasks import start_summarize_async_step, start_semantic_search_async_step
+
+from flask import Flask, render_template, request, redirect, url_for, jsonify, make_response, Response
+from werkzeug.middleware.proxy_fix import ProxyFix
+from async_tasks import start_workers, work_queue
+from cache import generate_cache_key, load_from_cache
 from config import *
-from graph import plot_entities_graph, build_entities_graph
-from sum_categories import prepare_entities_summary
+from graph import build_entities_graph
+from job_driver import JobDriver, job_status
+from metrics import registry, register_gauges, SEARCHES
+from pubtrends.broadcast import Broadcaster
+from pubtrends.jobs import create_job_store
+from pubtrends.metrics import CONTENT_TYPE
+from pubtrends.scheduler import JobScheduler
+from pubtrends.tracing import waterfall, to_chrome_trace
+from results_page import materialize_results, pubtrends_result_url, ENTITIES_CATEGORIES
+from tracing import tracer
 
 app = Flask(__name__)
+if TRUSTED_PROXIES:
+    # request.remote_addr is the client address seen by the outermost trusted proxy, it can't be spoofed by clients
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 
-# In-memory storage for job status and results
-# In a production environment, this should be replaced with a proper database
-search_queries = {}
+# Jobs status and results, persistent SQLite store by default, see pubtrends/jobs.py
+job_store = create_job_store(JOB_STORE, JOBS_DB)
 
-# Cache functions
-def generate_cache_key(search_query, search_type):
-    """Generate a unique cache key based on search query and type"""
-    key_string = f"{search_query}_{search_type}"
-    return hashlib.md5(key_string.encode()).hexdigest()
+# Jobs wait for admission in a queue shared by all processes
+scheduler = JobScheduler(SCHEDULER_DB, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS)
 
-def get_cache_path(cache_key):
-    """Get the full path to the cache file"""
-    return os.path.join(CACHE_DIR, f"{cache_key}.json")
+# Jobs are advanced in background, web handlers only read job state
+job_driver = JobDriver(job_store, scheduler)
 
-def save_to_cache(cache_key, data):
-    """Save search results to cache"""
-    try:
-        cache_path = get_cache_path(cache_key)
-        with open(cache_path, 'w') as f:
-            json.dump(data, f)
-        return True
-    except Exception as e:
-        print(f"Error saving to cache: {e}")
-        return False
-
-def load_from_cache(cache_key):
-    """Load search results from cache if available"""
-    cache_path = get_cache_path(cache_key)
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading from cache: {e}")
-    return None
+# Each web process consumes shared work queue and drives jobs, so steps can be started by any worker
+if PIPELINE_IN_WEB:
+    engine = start_workers(job_store)
+    job_driver.start()
+    register_gauges(job_store, work_queue, scheduler, engine, job_driver)
+else:
+    register_gauges(job_store, work_queue, scheduler)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -77,202 +66,286 @@ def search():
         # Restore the job from cache
         job_id = cached_data.get('job_id')
         if job_id:
-            search_queries[job_id] = cached_data
+            SEARCHES.inc(type=search_type, outcome='cached')
+            job_store.create(job_id, cached_data, JOB_TTL)
+            job_driver.notify()
             # If the job is complete, go directly to results
             if all(step == STEP_COMPLETE for step in cached_data.get('progress', {}).values()):
                 return redirect(url_for('results', job_id=job_id))
             # Otherwise, show progress
             return redirect(url_for('progress', job_id=job_id))
 
-    if search_type == 'text':
-        job_id = make_pubtrends_search_api_call(search_query)
-        if job_id:
-            search_queries[job_id] = dict(search_query=search_query,
-                                          job_id=job_id,
-                                          progress=create_text_steps(),
-                                          timestamp=time.time(),
-                                          cache_key=cache_key)  # Store cache key for later use
-            return redirect(url_for('progress', job_id=job_id))
-        else:
-            return render_template('error.html',
-                                   message="Failed to make API call to PubTrends")
-    else:
-        # For semantic search, use the existing placeholder
-        job_id = str(uuid.uuid4())
-        search_queries[job_id] = dict(search_query=search_query,
-                                      job_id=job_id,
-                                      progress=create_semantic_steps(),
-                                      timestamp=time.time(),
-                                      cache_key=cache_key)  # Store cache key for later use
+    # Identical searches in progress share a single job, see JobStore.join_flight
+    leader, leader_job_id = job_store.join_flight(cache_key, FLIGHT_TIMEOUT, exclude=[STEP_ERROR])
+    if leader_job_id:
+        print(f"Attached to in-flight job {leader_job_id} for query: {search_query}")
+        SEARCHES.inc(type=search_type, outcome='joined')
+        return redirect(url_for('progress', job_id=leader_job_id))
+
+    # PubTrends search is started by job driver once the job is admitted
+    job_id = str(uuid.uuid4())
+    job_store.create(job_id, dict(search_query=search_query,
+                                  job_id=job_id,
+                                  progress=create_text_steps() if search_type == 'text' else create_semantic_steps(),
+                                  timestamp=time.time(),
+                                  cache_key=cache_key,  # Store cache key for later use
+                                  search_type=search_type,
+                                  # Clients can lower priority of their searches, i.e. for cache warm up
+                                  priority=PRIORITY_BACKGROUND if request.form.get('priority') == 'background'
+                                  else PRIORITY_INTERACTIVE,
+                                  **({} if leader else {FLIGHT_FOLLOWER: True})), JOB_TTL)
+    if not leader:
+        # Leader didn't start its job yet, follower waits on the progress page, see attach_follower
         return redirect(url_for('progress', job_id=job_id))
-
-
-
-
-def make_pubtrends_search_api_call(search_query):
-    # TODO: add better error processing
-    try:
-        api_url = f"{PUBTRENDS_API}/search_terms_api"
-        response = requests.post(api_url, data={
-            'query': search_query,
-        })
-        if response.status_code == 200:
-            # Store the response data
-            data = response.json()
-            if data['success']:
-                return data['jobid']
-        return None
-    except Exception as e:
-        print(e)
-        return None
-
-def make_pubtrends_analyse_api_call(job_id, ids):
-    # TODO: add better error processing
-    try:
-        api_url = f"{PUBTRENDS_API}/analyse_ids_api"
-        response = requests.post(api_url, data={
-            'query': search_queries[job_id]['search_query'],
-            'job_id': job_id,
-            'ids': ','.join(str(idx) for idx in ids),
-        })
-        if response.status_code == 200:
-            # Store the response data
-            data = response.json()
-            if data['success']:
-                return data['jobid']
-        return None
-    except Exception as e:
-        print(e)
-        return None
+    return start_search(job_id)
+
+
+def start_search(job_id):
+    """
+    Queue job for admission and register it as the leader of its flight, redirects to the progress page.
+    """
+    job = job_store.get(job_id)
+    if not scheduler.enqueue(job_id, request.remote_addr or '', job['priority']):
+        # Failed job is not driven, let others start the search
+        job_store.set_step(job_id, START_STEP, STEP_ERROR)
+        job_store.end_flight(job['cache_key'])
+        SEARCHES.inc(type=job['search_type'], outcome='rejected')
+        return render_template('error.html', message="Too many searches in progress, please try again later"), 503
+    SEARCHES.inc(type=job['search_type'], outcome='started')
+    job_store.start_flight(job['cache_key'], job_id)
+    job_driver.notify()
+    return redirect(url_for('progress', job_id=job_id))
+
+
+def attach_follower(job_id):
+    """
+    Redirect follower to the leader's job once it is started, or start the follower's own job
+    if the leader gave up or didn't start its job within FLIGHT_WAIT. None while the leader is starting.
+    """
+    job = job_store.get(job_id)
+    leader, leader_job_id = job_store.join_flight(job['cache_key'], FLIGHT_TIMEOUT, exclude=[STEP_ERROR])
+    if leader_job_id:
+        print(f"Attached to in-flight job {leader_job_id} for query: {job['search_query']}")
+        SEARCHES.inc(type=job['search_type'], outcome='joined')
+        # Follower job is never admitted, it is removed once expired
+        job_store.update(job_id, {FLIGHT_FOLLOWER: leader_job_id})
+        return redirect(url_for('progress', job_id=leader_job_id))
+    if leader or time.time() - job['timestamp'] > FLIGHT_WAIT:
+        job_store.update(job_id, {FLIGHT_FOLLOWER: False})
+        return start_search(job_id)
+    return None
 
 
 @app.route('/progress/<job_id>')
 def progress(job_id):
     cleanup_old_jobs()
-    if job_id not in search_queries:
+    search_query = job_store.get_field(job_id, 'search_query')
+    if search_query is None:
         return redirect(url_for('index'))
-    return render_template('progress.html',
-                           job_id=job_id,
-                           search_query=search_queries[job_id]['search_query'])
+    follower = job_store.get_field(job_id, FLIGHT_FOLLOWER)
+    if isinstance(follower, str):
+        return redirect(url_for('progress', job_id=follower))
+    if follower:
+        attached = attach_follower(job_id)
+        if attached is not None:
+            return attached
+    response = make_response(render_template('progress.html',
+                                             job_id=job_id,
+                                             search_query=search_query,
+                                             progressive=PROGRESSIVE_RESULTS,
+                                             categories=[(key, render_key.split('_')[0].capitalize())
+                                                         for key, render_key in ENTITIES_CATEGORIES]))
+    if job_store.get_field(job_id, FLIGHT_FOLLOWER):
+        # Page is reloaded without holding a request thread, until the leader starts its job
+        response.headers['Refresh'] = str(FLIGHT_RELOAD)
+    return response
+
+
+def current_status(job_id):
+    """
+    Job status with position in the queue while the job waits for admission.
+    """
+    status = job_status(job_store.progress(job_id))
+    if status['status'] == STEP_PENDING:
+        position = scheduler.position(job_id)
+        if position is not None:
+            status['queue_position'] = position
+    return status
+
+
+def ready_parts(job_id, status, since=0):
+    """
+    Parts of results published after since: PubTrends link, topics keywords, topics summaries and entities tables.
+    Client passes back cursor to get only parts published later.
+    """
+    fields = job_store.get_fields(job_id, PARTIAL_RESULTS_PREFIX)
+    result = dict(parts={name[len(PARTIAL_RESULTS_PREFIX):]: part['value']
+                         for name, part in fields.items() if part['published'] > since},
+                  # Parts published concurrently by other processes may have a bit earlier timestamps
+                  cursor=max([since, *(part['published'] - 5 for part in fields.values())]))
+    if dict(status.get('progress', [])).get(PUBTRENDS_STEP) == STEP_COMPLETE:
+        result['pubtrends_result'] = pubtrends_result_url({
+            'job_id': job_id,
+            'search_query': job_store.get_field(job_id, 'search_query'),
+            PUBTRENDS_JOB_ID: job_store.get_field(job_id, PUBTRENDS_JOB_ID)
+        })
+    return result
+
+
+def progress_state(job_id):
+    """
+    Job status and parts of results ready so far, pushed to progress streams.
+    """
+    status = current_status(job_id)
+    parts = ready_parts(job_id, status) if PROGRESSIVE_RESULTS and status['status'] == STEP_PENDING else None
+    return dict(status=status, parts=parts)
 
 
+# Status and parts of each watched job are polled once per process and pushed to all its progress streams
+status_broadcaster = Broadcaster(progress_state, PROGRESS_EVENTS_INTERVAL)
+
 
 @app.route('/check_status/<job_id>')
 def check_status(job_id):
-    # TODO: add better error processing
-
-    if job_id not in search_queries:
-        return {'status': 'not_found'}
-    progress = search_queries[job_id]['progress']
-    for v in progress.values():
-        if v == STEP_ERROR:
-            return {'status': 'failed'}
-    if SEMANTIC_SEARCH_STEP in progress and STEP_SEMANTIC_SEARCH_PASSED_FURTHER not in search_queries[job_id]:
-        if progress[SEMANTIC_SEARCH_STEP] == STEP_NOT_STARTED:
-            progress[START_STEP] = STEP_COMPLETE
-            progress[SEMANTIC_SEARCH_STEP] = STEP_PENDING
-            # Submit task async and wait till it will eventually becomes STEP_COMPLETE STATUS
-            start_semantic_search_async_step(search_queries, job_id)
-        if progress[SEMANTIC_SEARCH_STEP] == STEP_COMPLETE:
-            ids = search_queries[job_id][SEMANTIC_SEARCH_STEP + "_RESULT"]
-            make_pubtrends_analyse_api_call(job_id, ids)
-            search_queries[job_id][STEP_SEMANTIC_SEARCH_PASSED_FURTHER] = True
-            progress[PUBTRENDS_STEP] = STEP_PENDING
-        return {'status': 'pending', 'progress': list(progress.items())}
-    try:
-        api_url = f"{PUBTRENDS_API}/check_status_api/{job_id}"
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
-            progress[START_STEP] = STEP_COMPLETE
-            if progress[PUBTRENDS_STEP] == STEP_NOT_STARTED:
-                progress[PUBTRENDS_STEP] = STEP_PENDING
-            if data['status'] == 'success':
-                progress[PUBTRENDS_STEP] = STEP_COMPLETE
-                if progress[SUMMARIZE_STEP] == STEP_NOT_STARTED:
-                    progress[SUMMARIZE_STEP] = STEP_PENDING
-                    # Submit task async and wait till it will eventually becomes STEP_COMPLETE STATUS
-                    start_summarize_async_step(search_queries, job_id)
-                elif progress[SUMMARIZE_STEP] == STEP_COMPLETE:
-                    return {'status': 'success', 'progress': list(progress.items())}
-            elif data['status'] == 'failed':
-                return {'status': 'failed'}
-        return {'status': STEP_PENDING, 'progress': list(progress.items())}
-    except Exception as e:
-        print(e)
-        return {'status': 'failed'}
+    return current_status(job_id)
+
+
+@app.route('/partial_results/<job_id>')
+def partial_results(job_id):
+    """
+    Job status with parts of results published after since, see ready_parts.
+    Progress page gets parts from progress events stream, this is used by browsers without Server-Sent Events.
+    Parts have unique names, so that parts returned twice are rendered once.
+    """
+    status = current_status(job_id)
+    if status['status'] == 'not_found':
+        return jsonify(status), 404
+    status.update(ready_parts(job_id, status, request.args.get('since', 0, type=float)))
+    return jsonify(status)
+
+
+@app.route('/progress_events/<job_id>')
+def progress_events(job_id):
+    """
+    Server-Sent Events stream of job status, event is sent only when progress changes.
+    Parts of results are sent as 'parts' events once they are published, each part is sent once per stream.
+    Job status and parts are polled by status_broadcaster, not by each stream.
+    Stream is closed after PROGRESS_EVENTS_MAX_DURATION, browser reconnects automatically.
+    """
+    def events():
+        # Ask browser to reconnect quickly when stream is closed
+        yield f"retry: {int(PROGRESS_EVENTS_INTERVAL * 1000)}\n\n"
+        sent_parts = set()
+        last_status = None
+        for state in status_broadcaster.watch(job_id, PROGRESS_EVENTS_MAX_DURATION,
+                                              keepalive=PROGRESS_EVENTS_KEEPALIVE):
+            if state is None:
+                # Comment line keeps connection alive through proxies
+                yield ": keep-alive\n\n"
+                continue
+            if state['parts'] is not None:
+                ready = dict(state['parts']['parts'])
+                if 'pubtrends_result' in state['parts']:
+                    # PubTrends link is sent once as well as other parts
+                    ready['pubtrends_result'] = state['parts']['pubtrends_result']
+                parts = {name: value for name, value in ready.items() if name not in sent_parts}
+                if parts:
+                    sent_parts.update(parts)
+                    pubtrends_result = parts.pop('pubtrends_result', None)
+                    yield f"event: parts\ndata: {json.dumps(dict(parts=parts, pubtrends_result=pubtrends_result))}\n\n"
+            status = state['status']
+            if status != last_status:
+                last_status = status
+                yield f"data: {json.dumps(status)}\n\n"
+            if status['status'] != STEP_PENDING:
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 @app.route('/results/<job_id>')
 def results(job_id):
-    if job_id not in search_queries:
+    page = job_store.get_field(job_id, RESULTS_PAGE)
+    if page is None and job_id not in job_store:
         return render_template('error.html', message="Result not found")
     try:
-        query = search_queries[job_id]['search_query']
-        pubtrends_url = f"{PUBTRENDS_API}/result?query={quote(query)}" \
-              f"&source=Pubmed&limit=1000&sort=Most+Cited&noreviews=on&min_year=&max_year=&jobid={job_id}"
-        summaries_storage = search_queries[job_id][SUMMARIZE_STEP + "_RESULT"]
-        summaries = {}
-
-        for key, render_key in [
-            (GOOGLE_SUMMARIZE_CATEGORY_GENES, "genes_summaries"),
-            (GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES, "substances_summaries"),
-            (GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS, "conditions_summaries"),
-            (GOOGLE_SUMMARIZE_CATEGORY_PROTEINS, "proteins_summaries"),
-        ]:
-            if key in summaries_storage:
-                summary = summaries_storage[key]
-                if summary is None:
-                    continue
-                connections_by_pid, summarized_data = summary
-                for entity in summarized_data:
-                    entity["total_connections"] = sum(
-                        connections_by_pid.get(pid, 0) for pid in entity.get("cited_in", [])
-                    )
-                summaries[render_key] = prepare_entities_summary(summarized_data)
-
-                g = build_entities_graph(connections_by_pid, summarized_data)
-                summaries[f"{render_key}_graph"] = components(plot_entities_graph(g))
-
-        if SUMMARY_TOPICS in summaries_storage:
-            # SUMMARY_TOPICS is already a list of tuples, no need to unpack
-            summary = summaries_storage[SUMMARY_TOPICS]
-            if summary is not None:
-                summaries["topics_summaries"] = summary
-
-        # Mark all steps as complete in the progress
-        for step in search_queries[job_id]['progress']:
-            search_queries[job_id]['progress'][step] = STEP_COMPLETE
-
-        # Save results to cache if we have a cache key
-        if 'cache_key' in search_queries[job_id]:
-            cache_key = search_queries[job_id]['cache_key']
-            save_to_cache(cache_key, search_queries[job_id])
-            print(f"Saved results to cache for query: {query}")
-
-        return render_template(
-            "results.html",
-            search_query=query,
-            pubtrends_result=pubtrends_url,
-            **summaries
-        )
+        if page is None:
+            # Jobs completed before results were materialized
+            page = materialize_results(job_store.get(job_id))
+            job_store.update(job_id, {RESULTS_PAGE: page})
+        if request.if_none_match.contains(page['etag']):
+            return Response(status=304, headers={'ETag': f'"{page["etag"]}"'})
+        response = make_response(render_template("results.html", **page['context']))
+        response.set_etag(page['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         print(e)
         return render_template('error.html', message="Exception occurred")
 
 
+@app.route('/entities_graph/<job_id>')
+def entities_graph_neighbourhood(job_id):
+    """
+    Full neighbourhood of the entity in the unpruned graph, used to expand nodes on demand.
+    """
+    category = request.args.get('category', '')
+    entity = request.args.get('entity', '')
+    summary = job_store.get_field(job_id, SUMMARIZE_STEP + "_RESULT", {}).get(category)
+    if summary is None:
+        return jsonify({'status': 'not_found'}), 404
+    connections_by_pid, summarized_data = summary
+    g = build_entities_graph(connections_by_pid, summarized_data)
+    return jsonify({
+        'status': 'success',
+        'entity': entity,
+        'neighbours': [dict(name=name, weight=weight) for name, weight in g.neighbourhood(entity)]
+    })
+
+
+@app.route('/trace/<job_id>')
+def trace(job_id):
+    """
+    Waterfall of job spans: steps, pipeline stages and upstream calls.
+    """
+    spans = tracer.spans(job_id)
+    search_query = job_store.get_field(job_id, 'search_query')
+    if not spans and search_query is None:
+        return render_template('error.html', message="Trace not found")
+    rows = waterfall(spans)
+    total = max(s['end'] for s in spans) - min(s['start'] for s in spans) if spans else 0
+    return render_template('trace.html', job_id=job_id, search_query=search_query, spans=rows, total=total)
+
+
+@app.route('/trace/<job_id>/chrome')
+def trace_chrome(job_id):
+    """
+    Job trace in Chrome trace event format, open with chrome://tracing or ui.perfetto.dev.
+    """
+    response = jsonify(to_chrome_trace(tracer.spans(job_id)))
+    response.headers['Content-Disposition'] = f'attachment; filename=trace-{job_id}.json'
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/error')
 def error():
     return render_template('error.html', message="Something went wrong")
 
 
-# Clean up old jobs periodically (in a production environment, this would be a scheduled task)
 def cleanup_old_jobs():
-    current_time = time.time()
-    for job_id in list(search_queries.keys()):
-        # Remove jobs older than 24 hours
-        if current_time - search_queries[job_id]['timestamp'] > 24 * 3600:
-            if job_id in search_queries:
-                del search_queries[job_id]
+    # Expired jobs are found by index, so it is cheap to call on every request
+    removed = job_store.cleanup()
+    tracer.store.cleanup(JOB_TTL)
+    work_queue.cleanup(JOB_TTL)
+    if removed:
+        print(f"Removed {removed} expired jobs")
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True, extra_files=['templates/'], port=5003)
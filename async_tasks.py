@@ -1,71 +1,329 @@
-from urllib.parse import quote
+"""
+Asyncio pipeline engine executing background steps of search jobs.
 
-import requests
+Steps are taken from the shared work queue and run as coroutines in a single event loop per process:
+upstream calls are asynchronous, CPU bound work (decoding, keywords, layouts) runs in a bounded executor.
+"""
+import asyncio
+import os
+import socket
+import tempfile
 import threading
+import time
+import traceback
+from urllib.parse import quote
 
+from cache import save_to_cache
 from config import *
-from pubtrends.data import AnalysisData
+from metrics import finish_step, observe_decode
+from pubtrends.binary import BINARY_MIME_TYPE, JSON_MIME_TYPE
+from pubtrends.stream import read_analysis_data
+from pubtrends.tracing import ContextExecutor
+from pubtrends.work_queue import WorkQueue, TASK_DONE, TASK_FAILED
+from results_page import materialize_results
+from upstream import async_http_client
 from sum_categories import summarize_categories
 from sum_topics import summarize_topics
+from tracing import tracer
+
+# Steps are executed by pipeline engines of any of the worker processes
+work_queue = WorkQueue(WORK_QUEUE_DB)
+engine = None
+
+
+class PipelineEngine:
+    def __init__(self, job_store, queue, max_jobs=PIPELINE_MAX_JOBS, cpu_threads=PIPELINE_CPU_THREADS,
+                 poll_interval=0.5, expiry_interval=60):
+        self.job_store = job_store
+        self.queue = queue
+        self.max_jobs = max_jobs
+        self.cpu_threads = cpu_threads
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stages = {
+            'summarize': summarize_stage,
+            'semantic_search': semantic_search_stage,
+        }
+        # Job steps failed when a task runs out of attempts
+        self.steps = {
+            'summarize': SUMMARIZE_STEP,
+            'semantic_search': SEMANTIC_SEARCH_STEP,
+        }
+        self.expiry_interval = expiry_interval
+        self.loop = None
+        self.executor = None
+        self.running = 0
+        self._wakeup = None
+        self._started = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        self._started.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        # Executor for CPU bound and blocking calls, see loop.run_in_executor(None, ...)
+        # Calls are traced as a part of the job which submitted them
+        self.executor = ContextExecutor(max_workers=self.cpu_threads)
+        self.loop.set_default_executor(self.executor)
+        asyncio.set_event_loop(self.loop)
+        self._wakeup = asyncio.Event()
+        self._started.set()
+        self.loop.run_until_complete(self._consume())
+
+    def notify(self):
+        """
+        Wake up engine after enqueue, other processes will pick task up on the next poll.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _consume(self):
+        slots = asyncio.Semaphore(self.max_jobs)
+        expiry_checked = 0
+        while True:
+            if time.time() - expiry_checked > self.expiry_interval:
+                await self._fail_expired()
+                expiry_checked = time.time()
+            await slots.acquire()
+            task = await self.blocking(self.queue.claim, self.worker_id)
+            if task is None:
+                slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            self.loop.create_task(self._execute(task, slots))
+
+    async def _fail_expired(self):
+        """
+        Fail steps of tasks which consumers crashed on every attempt, so that jobs don't stay pending forever.
+        """
+        try:
+            for task_id, kind, job_id in await self.blocking(self.queue.fail_expired):
+                print(f"❌ Task {kind} for job {job_id} expired with no attempts left")
+                await self.blocking(finish_step, self.job_store, job_id, self.steps[kind], STEP_ERROR)
+        except Exception as e:
+            print(f"❌ Error failing expired tasks: {e}")
+
+    async def _execute(self, task, slots):
+        task_id, kind, job_id, payload = task
+        self.running += 1
+        try:
+            with tracer.job(job_id), tracer.span(kind, worker=self.worker_id):
+                await self.stages[kind](self, job_id, **payload)
+            status = TASK_DONE
+        except Exception as e:
+            print(f"❌ Task {kind} for job {job_id} failed: {e}")
+            traceback.print_exc()
+            status = TASK_FAILED
+        finally:
+            self.running -= 1
+            slots.release()
+        await self.blocking(self.queue.finish, task_id, status)
+
+    async def blocking(self, fn, *args):
+        """
+        Run blocking call (SQLite, CPU bound work) in the executor.
+        """
+        return await self.loop.run_in_executor(None, fn, *args)
+
+
+def start_workers(job_store):
+    """
+    Start pipeline engine consuming the work queue in this process.
+    """
+    global engine
+    engine = PipelineEngine(job_store, work_queue)
+    resume_steps(job_store, engine.worker_id)
+    engine.start()
+    return engine
+
+
+def _orphaned(worker_id):
+    """
+    Whether the consumer is gone, i.e. a previous process of this host.
+    Consumers of other hosts are assumed alive, their tasks are reclaimed after lease timeout.
+    """
+    def orphaned(claimed_by):
+        host, _, pid = (claimed_by or '').rpartition(':')
+        if claimed_by == worker_id:
+            # Restarted container gets the same pid, nothing is claimed by this engine yet
+            return True
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    return orphaned
+
+
+def resume_steps(job_store, worker_id, grace=60):
+    """
+    Resume pipeline steps left pending by a restart: tasks claimed by gone processes of this host
+    are returned to the queue, steps without open task are submitted again.
+    Steps started less than grace seconds ago are left to the process which started them.
+    Runs in every web worker process, the queue doesn't enqueue a task twice, see WorkQueue.enqueue.
+    """
+    released = work_queue.release(_orphaned(worker_id))
+    submitted = 0
+    for job_id in job_store.active_jobs([STEP_PENDING], exclude=[STEP_ERROR]):
+        progress = job_store.progress(job_id) or {}
+        for step, kind, start in ((SUMMARIZE_STEP, 'summarize', start_summarize_async_step),
+                                  (SEMANTIC_SEARCH_STEP, 'semantic_search', start_semantic_search_async_step)):
+            started = job_store.get_field(job_id, step + '_STARTED_AT')
+            if progress.get(step) == STEP_PENDING and started is not None and time.time() - started > grace \
+                    and start(job_store, job_id):
+                submitted += 1
+    if released or submitted:
+        print(f"✅ Resumed pipeline steps: {released} released, {submitted} submitted")
+
+
+def submit(kind, job_id, **payload):
+    """
+    :return: False if the job already has an open task of this kind
+    """
+    if work_queue.enqueue(kind, job_id, payload) is None:
+        return False
+    if engine is not None:
+        engine.notify()
+    return True
 
 
-def start_summarize_async_step(search_queries, job_id):
+def start_summarize_async_step(job_store, job_id):
     print("Starting summarize step")
-    query = search_queries[job_id]['search_query']
-    api_url = f"{PUBTRENDS_API}/get_result_api?jobid={job_id}&query={quote(query)}"
+    # Fetch and summarize in a pipeline engine
+    return submit('summarize', job_id)
+
+
+# Fields used by summarize_categories and summarize_topics, others are skipped without buffering
+KEEP_FIELDS = ['df', 'papers_graph', 'corpus', 'corpus_tokens', 'corpus_counts']
+
+
+class SpooledResponse:
+    """
+    Response body spooled to a temporary file, requests-like interface for read_analysis_data.
+    """
+
+    def __init__(self, headers, file):
+        self.headers = headers
+        self.file = file
+
+    def iter_content(self, chunk_size):
+        self.file.seek(0)
+        while chunk := self.file.read(chunk_size):
+            yield chunk
+
+
+def observe_field_decode(data_format, field, seconds):
+    observe_decode(data_format, field, seconds)
+    tracer.record(f'decode {field}', seconds, format=data_format)
+
+
+async def fetch_analysis_data(engine, query, pubtrends_job_id):
+    """
+    Stream get_result_api response into LazyAnalysisData, None if request failed.
+    """
+    api_url = f"{PUBTRENDS_API}/get_result_api?jobid={pubtrends_job_id}&query={quote(query)}"
+    with tempfile.TemporaryFile() as file:
+        # Prefer binary columnar format, PubTrends falls back to JSON if not supported
+        response = await async_http_client.get(
+            api_url, endpoint='pubtrends_get_result', streaming_callback=file.write,
+            headers={'Accept': f'{BINARY_MIME_TYPE}, {JSON_MIME_TYPE};q=0.9'}
+        )
+        if response.status_code != 200:
+            print(f"❌ Error: {response.status_code}")
+            return None
+        return await engine.blocking(
+            lambda: read_analysis_data(SpooledResponse(response.headers, file),
+                                       keep=KEEP_FIELDS, observe=observe_field_decode)
+        )
+
+
+async def summarize_stage(engine, job_id):
+    job_store = engine.job_store
+    job = await engine.blocking(job_store.get, job_id)
+    query = job['search_query']
+    summaries_storage = {}
     try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
-            # Make API call in a separate thread
-            thread = threading.Thread(target=make_summarize_model_sync_call,
-                                      args=(search_queries, job_id, data))
-            thread.daemon = True
-            thread.start()
+        with tracer.span('fetch analysis data'):
+            ex = await fetch_analysis_data(engine, query, job.get(PUBTRENDS_JOB_ID) or job_id)
+        if ex is None:
+            await engine.blocking(finish_step, job_store, job_id, SUMMARIZE_STEP, STEP_ERROR)
             return
+        publish = partial_results_publisher(engine, job_id) if PROGRESSIVE_RESULTS else None
+        # Categories and topics fail independently, step fails only if nothing was summarized
+        errors = [e for e in await asyncio.gather(summarize_categories(ex, summaries_storage, publish),
+                                                  summarize_topics(ex, summaries_storage, publish),
+                                                  return_exceptions=True) if isinstance(e, Exception)]
+        for e in errors:
+            print(f"❌ Error summarizing {job_id}: {e}")
+        if len(errors) == 2:
+            raise errors[0]
     except Exception as e:
         print(e)
-    # Else mark as error
-    search_queries[job_id]['progress'][SUMMARIZE_STEP] = STEP_ERROR
+        await engine.blocking(finish_step, job_store, job_id, SUMMARIZE_STEP, STEP_ERROR)
+        return
+    job[SUMMARIZE_STEP + "_RESULT"] = summaries_storage
+    with tracer.span('complete'):
+        await engine.blocking(complete_summarize_step, job_store, job_id, job)
 
 
-def make_summarize_model_sync_call(
-        search_queries, job_id,
-        summarized_data
-):
-    ex = AnalysisData.from_json(summarized_data)
-    summaries_storage = {}
+def partial_results_publisher(engine, job_id):
+    """
+    Store parts of results as separate job fields as soon as they are ready, see /partial_results.
+    """
+    async def publish(name, value):
+        await engine.blocking(engine.job_store.update, job_id,
+                              {PARTIAL_RESULTS_PREFIX + name: dict(published=time.time(), value=value)})
+
+    return publish
+
+
+def complete_summarize_step(job_store, job_id, job):
     try:
-        summarize_categories(ex, summaries_storage)
-        summarize_topics(ex, summaries_storage)
+        job[RESULTS_PAGE] = materialize_results(job)
     except Exception as e:
-        print(e)
-        search_queries[job_id]['progress'][SUMMARIZE_STEP] = STEP_ERROR
-        return
-    search_queries[job_id][SUMMARIZE_STEP + "_RESULT"] = summaries_storage
-    search_queries[job_id]['progress'][SUMMARIZE_STEP] = STEP_COMPLETE
+        # Results page will be built on the first view
+        print(f"❌ Error materializing results: {e}")
+    job_store.update(job_id, {key: job[key] for key in (SUMMARIZE_STEP + "_RESULT", RESULTS_PAGE) if key in job})
+    finish_step(job_store, job_id, SUMMARIZE_STEP, STEP_COMPLETE)
+    # Mark all steps as complete in the progress
+    for step in job['progress']:
+        job['progress'][step] = STEP_COMPLETE
+        job_store.set_step(job_id, step, STEP_COMPLETE)
+    # Save results to cache once, views are served from materialized page
+    if 'cache_key' in job:
+        save_to_cache(job['cache_key'], job)
+        print(f"Saved results to cache for query: {job['search_query']}")
 
 
-def start_semantic_search_async_step(search_queries, job_id):
+def start_semantic_search_async_step(job_store, job_id):
     print("Starting semantic search step")
-    query = search_queries[job_id]['search_query']
-    # Make API call in a separate thread
-    thread = threading.Thread(target=make_semantic_search_sync_call,
-                              args=(query, search_queries, job_id))
-    thread.daemon = True
-    thread.start()
+    query = job_store.get_field(job_id, 'search_query')
+    # Make API call in a pipeline engine
+    return submit('semantic_search', job_id, query=query)
 
 
-def make_semantic_search_sync_call(query, search_queries, job_id):
+async def semantic_search_stage(engine, job_id, query):
+    job_store = engine.job_store
     try:
-        # Make the POST request with abstracts and si_mode
-        response = requests.get(f"{GOOGLE_SEMANTIC_SEARCH_ENDPOINT}?user_input={query}")
+        response = await async_http_client.get(GOOGLE_SEMANTIC_SEARCH_ENDPOINT, endpoint='semantic_search',
+                                               params={'user_input': query})
         # Handle response
         if response.status_code == 200:
             response = response.json()
-            search_queries[job_id][SEMANTIC_SEARCH_STEP + "_RESULT"] = response
-            search_queries[job_id]['progress'][SEMANTIC_SEARCH_STEP] = STEP_COMPLETE
+            await engine.blocking(job_store.update, job_id, {SEMANTIC_SEARCH_STEP + "_RESULT": response})
+            await engine.blocking(finish_step, job_store, job_id, SEMANTIC_SEARCH_STEP, STEP_COMPLETE)
             return
     except Exception as e:
         print(e)
-    search_queries[job_id]['progress'][SEMANTIC_SEARCH_STEP] = STEP_ERROR
+    await engine.blocking(finish_step, job_store, job_id, SEMANTIC_SEARCH_STEP, STEP_ERROR)
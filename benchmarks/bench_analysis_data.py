@@ -0,0 +1,100 @@
+"""
+Compare JSON and binary AnalysisData serialization on synthetic datasets.
+
+Usage: python -m benchmarks.bench_analysis_data [--sizes 1000 10000 50000]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+
+from pubtrends.data import AnalysisData
+
+
+def synthetic_analysis_data(n_papers, n_tokens=5000, n_comps=20, embeddings_dim=128, degree=10, seed=42):
+    rng = np.random.default_rng(seed)
+    ids = [str(i) for i in range(10_000_000, 10_000_000 + n_papers)]
+    years = rng.integers(1990, 2025, size=n_papers)
+    df = pd.DataFrame(dict(
+        id=ids,
+        title=[f'Title of paper {i}' for i in ids],
+        abstract=[f'Abstract of paper {i} ' * 20 for i in ids],
+        year=years,
+        authors=[f'Author {i % 1000}, Author {i % 777}' for i in range(n_papers)],
+        journal=[f'Journal {i % 300}' for i in range(n_papers)],
+        comp=rng.integers(0, n_comps, size=n_papers),
+        total=rng.integers(0, 1000, size=n_papers),
+    ))
+    for year in range(2000, 2025):
+        df[year] = rng.integers(0, 50, size=n_papers)
+
+    n_edges = n_papers * degree // 2
+    sources = rng.integers(0, n_papers, size=n_edges)
+    targets = rng.integers(0, n_papers, size=n_edges)
+    graph = nx.Graph()
+    graph.add_nodes_from(ids)
+    graph.add_edges_from(
+        (ids[u], ids[v], dict(cocitation=float(w), similarity=float(s)))
+        for u, v, w, s in zip(sources, targets, rng.random(n_edges), rng.random(n_edges)) if u != v
+    )
+
+    def pairs_df(c1, c2, n):
+        return pd.DataFrame({c1: rng.choice(ids, n), c2: rng.choice(ids, n), 'total': rng.integers(1, 10, n)})
+
+    cit_df = pd.DataFrame(dict(id_in=rng.choice(ids, n_edges), id_out=rng.choice(ids, n_edges)))
+    top_cited_df = df[['id', 'title', 'total']].head(50)
+    corpus_tokens = [f'token{i}' for i in range(n_tokens)]
+    corpus_counts = sparse_random(n_papers, n_tokens, density=50 / n_tokens, format='csr', random_state=seed,
+                                  data_rvs=lambda n: rng.integers(1, 10, size=n)).astype(np.int64)
+    corpus = [[[corpus_tokens[j] for j in row.indices[:30]]] for row in corpus_counts]
+    embeddings = rng.standard_normal((n_papers, embeddings_dim))
+    dendrogram = rng.random((n_comps - 1, 4))
+    stats = pd.DataFrame(dict(name=[f'Author {i}' for i in range(100)], papers=rng.integers(1, 100, 100)))
+    return AnalysisData(
+        search_query='synthetic', search_ids=None,
+        source='Pubmed', sort='most_cited', limit=n_papers, noreviews=True, min_year=None, max_year=None,
+        df=df, cit_df=cit_df,
+        cocit_grouped_df=pairs_df('cited_1', 'cited_2', n_edges),
+        bibliographic_coupling_df=pairs_df('citing_1', 'citing_2', n_edges),
+        top_cited_df=top_cited_df, max_gain_df=top_cited_df, max_rel_gain_df=top_cited_df,
+        corpus=corpus, corpus_tokens=corpus_tokens, corpus_counts=corpus_counts,
+        papers_graph=graph, papers_embeddings=embeddings, dendrogram=dendrogram,
+        author_stats=stats, journal_stats=stats, numbers_df=stats,
+    )
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench(n_papers):
+    data = synthetic_analysis_data(n_papers)
+    payload_json, encode_json, _ = measure(lambda: json.dumps(data.to_json()).encode('utf-8'))
+    _, decode_json, peak_json = measure(lambda: AnalysisData.from_json(json.loads(payload_json)))
+    payload_binary, encode_binary, _ = measure(data.to_binary)
+    _, decode_binary, peak_binary = measure(lambda: AnalysisData.from_binary(payload_binary))
+    mb = 1024 * 1024
+    print(f'{n_papers:>7} papers | json:   {len(payload_json) / mb:8.1f} MB, '
+          f'encode {encode_json:6.2f}s, decode {decode_json:6.2f}s, decode peak {peak_json / mb:8.1f} MB')
+    print(f'{"":>7}        | binary: {len(payload_binary) / mb:8.1f} MB, '
+          f'encode {encode_binary:6.2f}s, decode {decode_binary:6.2f}s, decode peak {peak_binary / mb:8.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        bench(size)
@@ -0,0 +1,80 @@
+"""
+Benchmark topics description on synthetic corpora, compares with the previous
+implementation which materialized tokens x tokens matrix (only for small vocabularies).
+
+Usage: python -m benchmarks.bench_topics_description [--tokens 10000 50000 100000] [--comps 100]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from pubtrends.topics import _get_topics_description_cosine
+
+# Previous implementation needs tokens^2 * 4 bytes, skip it for bigger vocabularies
+REFERENCE_MAX_TOKENS = 10_000
+
+
+def reference_topics_description(comps, corpus_tokens, corpus_counts, n_words):
+    comp_idx = {c: i for i, c in enumerate(comps)}
+    tokens_freqs_per_comp = np.zeros(shape=(len(comp_idx), corpus_counts.shape[1]), dtype=np.float32)
+    for comp, comp_ids in comps.items():
+        tokens_freqs_per_comp[comp_idx[comp], :] = np.sum(corpus_counts[comp_ids, :], axis=0)
+    tokens_freqs_total = np.sum(tokens_freqs_per_comp, axis=0)
+    tokens_freqs_norm = np.sqrt(np.diag(tokens_freqs_per_comp.T @ tokens_freqs_per_comp))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tokens_freqs_per_comp = tokens_freqs_per_comp / tokens_freqs_norm
+    distance = tokens_freqs_per_comp.T @ np.eye(len(comp_idx))
+    adjusted_distance = distance.T * np.log1p(tokens_freqs_total)
+    return {comp: [adjusted_distance[comp_idx[comp], i]
+                   for i in np.argsort(-adjusted_distance[comp_idx[comp], :])[:n_words]]
+            for comp in comps}
+
+
+def synthetic_corpus(n_papers, n_tokens, n_comps, seed=42):
+    rng = np.random.default_rng(seed)
+    tokens_per_paper = min(100, n_tokens)
+    # Zipf-like tokens distribution, duplicates are summed up by csr_matrix
+    cols = (rng.pareto(1.0, size=n_papers * tokens_per_paper) * n_tokens / 100).astype(np.int64) % n_tokens
+    rows = np.repeat(np.arange(n_papers), tokens_per_paper)
+    corpus_counts = csr_matrix((rng.integers(1, 10, size=len(rows)), (rows, cols)), shape=(n_papers, n_tokens))
+    comp = rng.integers(0, n_comps, size=n_papers)
+    comps = {c: np.flatnonzero(comp == c) for c in range(n_comps)}
+    return comps, [f'token{i}' for i in range(n_tokens)], corpus_counts
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench(n_papers, n_tokens, n_comps, n_words=10):
+    comps, tokens, counts = synthetic_corpus(n_papers, n_tokens, n_comps)
+    result, elapsed, peak = measure(lambda: _get_topics_description_cosine(comps, tokens, counts, n_words))
+    line = f'{n_tokens:>7} tokens, {n_comps:>4} comps | new: {elapsed:6.2f}s, peak {peak / 2 ** 20:8.1f} MB'
+    if n_tokens <= REFERENCE_MAX_TOKENS:
+        reference, elapsed, peak = measure(lambda: reference_topics_description(comps, tokens, counts, n_words))
+        # Compare scores, tokens with equal scores may be ordered differently
+        same = all(np.allclose([v for _, v in result[c]], reference[c]) for c in comps)
+        line += f' | old: {elapsed:6.2f}s, peak {peak / 2 ** 20:8.1f} MB, same scores: {same}'
+    else:
+        line += f' | old: skipped, needs {n_tokens ** 2 * 4 / 2 ** 30:.1f} GB'
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--papers', type=int, default=10_000)
+    parser.add_argument('--tokens', type=int, nargs='+', default=[1_000, 10_000, 50_000, 100_000])
+    parser.add_argument('--comps', type=int, default=100)
+    args = parser.parse_args()
+    for tokens in args.tokens:
+        bench(args.papers, tokens, args.comps)
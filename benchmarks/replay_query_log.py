@@ -0,0 +1,88 @@
+"""
+Replay a query log and compare results cache hit rate of raw and canonical cache keys.
+
+Log is a text file with one query per line, optionally prefixed with search type and tab,
+i.e. "text<TAB>aging mtor". Cache is assumed unbounded, every repeated key is a hit.
+Without log a synthetic one is generated: popular queries with Zipf distribution
+typed with random variations of case, whitespace, punctuation, Unicode forms and words order.
+
+Usage: python -m benchmarks.replay_query_log [queries.log] [--synthetic 10000]
+"""
+
+import argparse
+import random
+
+from pubtrends.query import canonicalize_query
+
+SYNTHETIC_QUERIES = [
+    'aging mTOR', 'breast cancer BRCA1', 'Alzheimer disease amyloid', 'CRISPR Cas9 off-target',
+    'COVID-19 vaccine efficacy', 'IL-6 inflammation', 'gut microbiome obesity', 'CD4+ T cells HIV',
+    'deep learning protein structure', 'p53 apoptosis', 'insulin resistance diabetes', 'autophagy neurodegeneration',
+    'single cell RNA-seq', 'tau phosphorylation', 'long COVID fatigue', 'statins cardiovascular risk',
+]
+
+
+def typo_variant(query, rng):
+    words = query.split()
+    if rng.random() < 0.3:
+        rng.shuffle(words)
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(['and', 'of', 'the', 'in']))
+    query = rng.choice([' ', '  ', ' , ']).join(words)
+    variant = rng.random()
+    if variant < 0.3:
+        query = query.lower()
+    elif variant < 0.4:
+        query = query.upper()
+    elif variant < 0.5:
+        query = query.replace('-', '‐')
+    if rng.random() < 0.2:
+        query = query + rng.choice([' ', '?', '.'])
+    return query
+
+
+def synthetic_log(n, seed=42):
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(SYNTHETIC_QUERIES))]
+    return [('text', typo_variant(rng.choices(SYNTHETIC_QUERIES, weights)[0], rng)) for _ in range(n)]
+
+
+def read_log(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            search_type, _, query = line.rpartition('\t')
+            yield search_type or 'text', query
+
+
+def hit_rate(log, key):
+    seen = set()
+    hits = 0
+    for search_type, query in log:
+        k = (key(query, search_type), search_type)
+        hits += k in seen
+        seen.add(k)
+    return hits / len(log) if log else 0.0, len(seen)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log', nargs='?', help='queries log, synthetic log is used if not given')
+    parser.add_argument('--synthetic', type=int, default=10_000, help='number of synthetic queries')
+    args = parser.parse_args()
+    log = list(read_log(args.log)) if args.log else synthetic_log(args.synthetic)
+    print(f'Queries: {len(log)}')
+    print(f'{"keys":<24}{"unique":>10}{"hit rate":>10}')
+    for name, key in [
+        ('raw', lambda query, _: query),
+        ('canonical', lambda query, _: canonicalize_query(query)),
+        ('canonical, reordered', lambda query, search_type: canonicalize_query(query, reorder=search_type == 'text')),
+    ]:
+        rate, unique = hit_rate(log, key)
+        print(f'{name:<24}{unique:>10}{rate:>10.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+On-disk cache of search results.
+
+Entries are JSON documents compressed with zstd (if zstandard is installed) or gzip,
+written atomically via temporary file and rename. SQLite index keeps sizes and access times,
+so lookups and eviction do not touch payloads. Cache is bounded by total size (LRU eviction)
+and entries age, hit / miss / eviction counters are shared between processes.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE, QUERY_REORDER
+from pubtrends.query import canonicalize_query
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_ZSTD = 'zstd'
+CODEC_GZIP = 'gzip'
+
+COUNTERS = ['hits', 'misses', 'evictions']
+
+
+def _compress(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes, max_age):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.codec = CODEC_ZSTD if zstandard is not None else CODEC_GZIP
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(key TEXT PRIMARY KEY, file TEXT NOT NULL, codec TEXT NOT NULL, size INTEGER NOT NULL, '
+                       'created REAL NOT NULL, accessed REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_created ON entries (created)')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            db.executemany('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', [(c,) for c in COUNTERS])
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=30)
+            self._local.db = db
+        return db
+
+    def _count(self, db, name, value=1):
+        db.execute('UPDATE counters SET value = value + ? WHERE name = ?', (value, name))
+
+    def get(self, key):
+        """
+        Cached JSON value, None if entry is missing, expired or corrupted.
+        """
+        db = self._connection()
+        row = db.execute('SELECT file, codec, created FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[2] < time.time() - self.max_age:
+            self._evict(db, [key])
+            row = None
+        if row is None:
+            with db:
+                self._count(db, 'misses')
+            return None
+        file, codec, _ = row
+        try:
+            with open(os.path.join(self.path, file), 'rb') as f:
+                value = json.loads(_decompress(f.read(), codec))
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Error loading from cache: {e}")
+            self._evict(db, [key])
+            with db:
+                self._count(db, 'misses')
+            return None
+        with db:
+            db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._count(db, 'hits')
+        return value
+
+    def put(self, key, value):
+        payload = _compress(json.dumps(value).encode('utf-8'), self.codec)
+        file = f'{key}.json.{"zst" if self.codec == CODEC_ZSTD else "gz"}'
+        # Readers see either old or new file, never a partially written one
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, os.path.join(self.path, file))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        now = time.time()
+        db = self._connection()
+        with db:
+            db.execute('INSERT OR REPLACE INTO entries (key, file, codec, size, created, accessed) '
+                       'VALUES (?, ?, ?, ?, ?, ?)', (key, file, self.codec, len(payload), now, now))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries and least recently used ones while total size exceeds the limit.
+        """
+        db = self._connection()
+        expired = [k for k, in db.execute('SELECT key FROM entries WHERE created < ?',
+                                          (time.time() - self.max_age,))]
+        self._evict(db, expired)
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            victims.append(key)
+            total -= size
+        self._evict(db, victims)
+
+    def _evict(self, db, keys):
+        if not keys:
+            return
+        with db:
+            for key in keys:
+                row = db.execute('SELECT file FROM entries WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    continue
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._count(db, 'evictions')
+                try:
+                    os.remove(os.path.join(self.path, row[0]))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        db = self._connection()
+        stats = dict(db.execute('SELECT name, value FROM counters'))
+        stats['entries'], stats['bytes'] = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return stats
+
+
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE)
+
+
+def canonical_search_query(search_query, search_type):
+    """Canonical form of the query, equal for searches sharing results"""
+    return canonicalize_query(search_query, reorder=QUERY_REORDER and search_type == 'text')
+
+
+def generate_cache_key(search_query, search_type):
+    """Generate a unique cache key based on canonical search query and type"""
+    key_string = f"{canonical_search_query(search_query, search_type)}_{search_type}"
+    return hashlib.md5(key_string.encode()).hexdigest()
+
+
+def save_to_cache(cache_key, data):
+    """Save search results to cache"""
+    try:
+        result_cache.put(cache_key, data)
+        return True
+    except Exception as e:
+        print(f"Error saving to cache: {e}")
+        return False
+
+
+def load_from_cache(cache_key):
+    """Load search results from cache if available"""
+    return result_cache.get(cache_key)
@@ -4,6 +4,80 @@ import os
 CACHE_DIR = os.path.expanduser("~/aipubtrends")
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# Compressed results cache bounded by total size and entries age, see cache.py
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(CACHE_DIR, "results"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# Jobs storage backend: 'sqlite' (persistent, shared between processes) or 'memory'
+JOB_STORE = os.getenv("JOB_STORE", "sqlite")
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(CACHE_DIR, "jobs.sqlite"))
+# Jobs are removed after this number of seconds
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 3600)))
+# Text queries with the same words in different order share results, stop words are ignored
+QUERY_REORDER = os.getenv("QUERY_REORDER", "0") == "1"
+# Spans of jobs steps and upstream calls, see /trace/<job_id>
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACES_DB = os.getenv("TRACES_DB", os.path.join(CACHE_DIR, "traces.sqlite"))
+# Admission control of jobs, see pubtrends/scheduler.py
+SCHEDULER_DB = os.getenv("SCHEDULER_DB", os.path.join(CACHE_DIR, "scheduler.sqlite"))
+# Jobs running at the same time in all processes, others wait in the queue
+MAX_RUNNING_JOBS = int(os.getenv("MAX_RUNNING_JOBS", "8"))
+# Searches are rejected when this number of jobs is waiting
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "100"))
+# Number of reverse proxies in front of the app, client address for fair admission is taken
+# from X-Forwarded-For set by them, 0 if clients connect directly, other X-Forwarded-For values are ignored
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+# Lower value is admitted first, background work i.e. cache refresh waits for interactive searches
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+# Progress page shows topics and entities tables as soon as they are ready
+PROGRESSIVE_RESULTS = os.getenv("PROGRESSIVE_RESULTS", "1") == "1"
+# Identical concurrent searches attach to a single job, leader should start the job within this timeout
+FLIGHT_TIMEOUT = int(os.getenv("FLIGHT_TIMEOUT", "30"))
+# Followers wait for leader's job for this number of seconds before starting their own
+FLIGHT_WAIT = float(os.getenv("FLIGHT_WAIT", "10"))
+# Progress page of a follower is reloaded with this interval until it is attached to the leader's job
+FLIGHT_RELOAD = int(os.getenv("FLIGHT_RELOAD", "1"))
+
+# Shared work queue for background steps, see pubtrends/work_queue.py
+WORK_QUEUE_DB = os.getenv("WORK_QUEUE_DB", os.path.join(CACHE_DIR, "queue.sqlite"))
+# Web processes run pipeline engine, set to 0 if steps are executed by separate worker.py processes
+PIPELINE_IN_WEB = os.getenv("PIPELINE_IN_WEB", "1") == "1"
+# Counters and histograms of all processes are summed through this file, so any process can be scraped
+METRICS_DB = os.getenv("METRICS_DB", os.path.join(CACHE_DIR, "metrics.sqlite"))
+# Port to expose /metrics of worker.py processes, 0 to disable, web processes serve /metrics themselves
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+# Jobs steps executed concurrently by a single process event loop
+PIPELINE_MAX_JOBS = int(os.getenv("PIPELINE_MAX_JOBS", "200"))
+# Threads for CPU bound and blocking work of pipeline steps
+PIPELINE_CPU_THREADS = int(os.getenv("PIPELINE_CPU_THREADS", "4"))
+
+# Jobs are advanced by job_driver.py with adaptive backoff between these intervals, seconds
+DRIVER_MIN_INTERVAL = float(os.getenv("DRIVER_MIN_INTERVAL", "1"))
+DRIVER_MAX_INTERVAL = float(os.getenv("DRIVER_MAX_INTERVAL", "5"))
+# Job fails after this number of failed upstream status checks in a row, errors in between are retried
+DRIVER_MAX_ERRORS = int(os.getenv("DRIVER_MAX_ERRORS", "10"))
+# Concurrent upstream status checks in a single sweep
+DRIVER_THREADS = int(os.getenv("DRIVER_THREADS", "8"))
+# Job state of open progress events streams is checked with this interval, once per job in a process, seconds
+PROGRESS_EVENTS_INTERVAL = float(os.getenv("PROGRESS_EVENTS_INTERVAL", "0.5"))
+# Keep-alive comment is sent to progress events stream when status doesn't change, seconds
+PROGRESS_EVENTS_KEEPALIVE = float(os.getenv("PROGRESS_EVENTS_KEEPALIVE", "15"))
+# Progress events stream is closed after this time and reopened by browser, seconds
+PROGRESS_EVENTS_MAX_DURATION = int(os.getenv("PROGRESS_EVENTS_MAX_DURATION", "60"))
+
+# Upstream HTTP client, see pubtrends/http.py
+# Connections kept per host, should cover concurrent calls of executors
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# LLM calls may take minutes
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+# Retries with jittered exponential backoff on connection errors, 429 and 5xx
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# Limit of upstream response bodies, analysis data of big searches is hundreds of megabytes
+HTTP_MAX_BODY_SIZE = int(os.getenv("HTTP_MAX_BODY_SIZE", str(4 * 1024 * 1024 * 1024)))
+
 # TODO fix me!!!!
 PUBTRENDS_API = os.getenv(
     "PUBTRENDS_API",
@@ -30,6 +104,17 @@ GOOGLE_MODEL_SUMMARIZE_TOPIC_ENDPOINT = os.getenv(
     ""
 )
 
+# Number of memoized topics descriptions, see pubtrends/topics.py
+TOPICS_DESCRIPTION_CACHE_SIZE = int(os.getenv("TOPICS_DESCRIPTION_CACHE_SIZE", "128"))
+
+# Level-of-detail pruning of entities graphs, see graph.prune_entities_graph
+# Keep edges among top-k heaviest for at least one of its nodes, 0 to disable
+ENTITIES_GRAPH_TOP_K = int(os.getenv("ENTITIES_GRAPH_TOP_K", "5"))
+# Drop edges lighter than this weight
+ENTITIES_GRAPH_MIN_WEIGHT = float(os.getenv("ENTITIES_GRAPH_MIN_WEIGHT", "0"))
+# Disparity filter significance level for backbone extraction, empty to disable
+ENTITIES_GRAPH_DISPARITY_ALPHA = os.getenv("ENTITIES_GRAPH_DISPARITY_ALPHA", "")
+
 GOOGLE_SUMMARIZE_CATEGORY_GENES = "GENES_EXTRACTION"
 GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES = "SUBSTANCES_EXTRACTION"
 GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS = "CONDITIONS_EXTRACTION"
@@ -48,6 +133,15 @@ SUMMARIZE_STEP = 'Building summaries'
 
 SEMANTIC_SEARCH_STEP = 'Semantic search'
 STEP_SEMANTIC_SEARCH_PASSED_FURTHER = 'semantic_search_ids_passed_further'
+# Job id of PubTrends analysis, differs from job id for text searches
+PUBTRENDS_JOB_ID = 'pubtrends_job_id'
+
+# Results page artifacts built once summarization is complete, see results_page.py
+RESULTS_PAGE = 'results_page'
+# Job fields with parts of results published as soon as they are ready, see /partial_results
+PARTIAL_RESULTS_PREFIX = 'partial:'
+# Job field of a follower waiting for the leader of identical search to start its job, then leader's job id
+FLIGHT_FOLLOWER = 'flight_follower'
 
 def create_text_steps():
     return {
@@ -1,51 +1,159 @@
-from collections import Counter
-from collections import defaultdict
-from itertools import combinations
-
 import networkx as nx
+import numpy as np
 from bokeh.models import GraphRenderer, ColumnDataSource, LabelSet, NodesAndLinkedEdges, MultiLine, \
-    StaticLayoutProvider, Circle
+    StaticLayoutProvider, Circle, CustomJS
 from bokeh.plotting import figure, from_networkx
+from scipy.sparse import csr_matrix, triu
 from sklearn.preprocessing import minmax_scale
 
+from graph_layout import layout_entities_graph
+
+
+class EntitiesGraph:
+    """
+    Weighted entities co-occurrence graph stored as arrays,
+    sources and targets are positions in nodes, networkx graph is built on demand.
+    """
+
+    def __init__(self, nodes, sources, targets, weights):
+        self.nodes = nodes
+        self.sources = sources
+        self.targets = targets
+        self.weights = weights
+
+    @property
+    def edges(self):
+        return [(self.nodes[u], self.nodes[v]) for u, v in zip(self.sources.tolist(), self.targets.tolist())]
+
+    def edges_subgraph(self, mask):
+        """
+        Graph with edges selected by mask, nodes left without edges are dropped.
+        """
+        sources, targets = self.sources[mask], self.targets[mask]
+        used, positions = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+        sources, targets = np.split(positions.astype(np.int32), 2)
+        return EntitiesGraph([self.nodes[i] for i in used], sources, targets, self.weights[mask])
+
+    def neighbourhood(self, name):
+        """
+        All neighbours of the entity with edge weights, sorted by weight descending.
+        """
+        if name not in self.nodes:
+            return []
+        i = self.nodes.index(name)
+        mask = (self.sources == i) | (self.targets == i)
+        others = np.where(self.sources[mask] == i, self.targets[mask], self.sources[mask])
+        weights = self.weights[mask]
+        order = np.argsort(-weights, kind='stable')
+        return [(self.nodes[j], float(w)) for j, w in zip(others[order].tolist(), weights[order].tolist())]
+
+    def to_networkx(self):
+        g = nx.Graph()
+        g.add_nodes_from(self.nodes)
+        g.add_weighted_edges_from(
+            (self.nodes[u], self.nodes[v], w)
+            for u, v, w in zip(self.sources.tolist(), self.targets.tolist(), self.weights.tolist())
+        )
+        return g
+
+
+def empty_entities_graph():
+    return EntitiesGraph([], np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0))
 
-def build_entities_graph(connections_by_pid, summarized_data):
-    # Reverse mapping: paper → set of entities
-    paper_to_entities = defaultdict(set)
-    for entity in summarized_data:
-        for pid in entity["cited_in"]:
-            paper_to_entities[pid].add(entity["name"])
 
+def build_entities_graph(connections_by_pid, summarized_data):
+    # Entities x papers incidence matrix, entity is counted once per paper
+    entities = sorted({entity["name"] for entity in summarized_data if entity["cited_in"]})
     # If we have less than 2 entities, we can't build a graph
-    if len(set().union(*paper_to_entities.values())) < 2:
+    if len(entities) < 2:
         # Return an empty graph
-        return nx.Graph()
-
-    entities_pair_weights = Counter()
-    # Loop through each paper and count co-occurrences
-    for entities_set in paper_to_entities.values():
-        for g1, g2 in combinations(sorted(entities_set), 2):
-            entities_pair_weights[(g1, g2)] += 1
-
-    weighted_entities_pairs = defaultdict(float)
-    for pid, entities_set in paper_to_entities.items():
-        weight = connections_by_pid.get(pid, 1)  # fallback to 1
-        for g1, g2 in combinations(sorted(entities_set), 2):
-            weighted_entities_pairs[(g1, g2)] += weight
-
-    # Build the graph from your weighted_entity_pairs
-    g = nx.Graph()
-    for (g1, g2), weight in weighted_entities_pairs.items():
-        g.add_edge(g1, g2, weight=weight)
-
-    return g
-
-
-def plot_entities_graph(g):
-    print(f"Plotting graph with {len(g.nodes)} nodes and {len(g.edges)} edges")
+        return empty_entities_graph()
+    entities_idx = {name: i for i, name in enumerate(entities)}
+    papers_idx = {}
+    rows, cols = [], []
+    for entity in summarized_data:
+        for pid in entity["cited_in"]:
+            rows.append(entities_idx[entity["name"]])
+            cols.append(papers_idx.setdefault(pid, len(papers_idx)))
+    incidence = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(entities), len(papers_idx)))
+    incidence.data[:] = 1  # Drop duplicates summed by constructor
+    papers_weights = np.array([connections_by_pid.get(pid, 1) for pid in papers_idx], dtype=float)  # fallback to 1
+
+    # Pairs co-occurring in at least one paper, weighted co-occurrence is A * diag(w) * A^T
+    cooccurrence = triu(incidence @ incidence.T, k=1).tocoo()
+    weighted = incidence.multiply(papers_weights).tocsr() @ incidence.T
+    weights = np.asarray(weighted[cooccurrence.row, cooccurrence.col]).ravel()
+
+    # Keep only entities connected to others
+    used, positions = np.unique(np.concatenate([cooccurrence.row, cooccurrence.col]), return_inverse=True)
+    sources, targets = np.split(positions.astype(np.int32), 2)
+    return EntitiesGraph([entities[i] for i in used], sources, targets, weights)
+
+
+def prune_entities_graph(g, top_k=None, min_weight=None, alpha=None):
+    """
+    Level-of-detail pruning, applied in order:
+    :param min_weight: drop edges lighter than threshold
+    :param alpha: disparity filter significance level, keeps the multiscale backbone
+    :param top_k: keep edge only if it is among top_k heaviest edges of at least one of its nodes
+    """
+    mask = np.ones(len(g.weights), dtype=bool)
+    if min_weight is not None:
+        mask &= g.weights >= min_weight
+    if alpha is not None:
+        mask &= _disparity_significant(g, mask, alpha)
+    if top_k is not None:
+        mask &= _top_k_edges(g, mask, top_k)
+    if mask.all():
+        return g
+    pruned = g.edges_subgraph(mask)
+    print(f"Pruned graph {len(g.nodes)}/{len(g.weights)} -> {len(pruned.nodes)}/{len(pruned.weights)} nodes/edges")
+    return pruned
+
+
+def _disparity_significant(g, mask, alpha):
+    """
+    Disparity filter (Serrano et al., 2009): edge is significant for node i if
+    (1 - w_ij / s_i) ^ (k_i - 1) < alpha, where s_i is node strength and k_i is degree.
+    Edge is kept if it is significant for any of its nodes, edges of degree 1 nodes are always kept.
+    """
+    n = len(g.nodes)
+    sources, targets, weights = g.sources[mask], g.targets[mask], g.weights[mask]
+    strength = np.bincount(sources, weights, minlength=n) + np.bincount(targets, weights, minlength=n)
+    degree = np.bincount(sources, minlength=n) + np.bincount(targets, minlength=n)
+    significant = np.zeros(len(weights), dtype=bool)
+    for nodes in (sources, targets):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.nan_to_num(weights / strength[nodes])
+        significant |= (degree[nodes] <= 1) | ((1 - p) ** (degree[nodes] - 1) < alpha)
+    result = np.zeros(len(g.weights), dtype=bool)
+    result[mask] = significant
+    return result
+
+
+def _top_k_edges(g, mask, top_k):
+    """
+    Edges ranked within top_k by weight for at least one of their nodes.
+    """
+    edges = np.flatnonzero(mask)
+    # Each edge is seen from both of its nodes
+    nodes = np.concatenate([g.sources[edges], g.targets[edges]])
+    edges = np.concatenate([edges, edges])
+    order = np.lexsort((-g.weights[edges], nodes))
+    nodes, edges = nodes[order], edges[order]
+    # Rank of edge within its node group
+    group_starts = np.flatnonzero(np.r_[True, nodes[1:] != nodes[:-1]])
+    ranks = np.arange(len(nodes)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(nodes)]))
+    result = np.zeros(len(g.weights), dtype=bool)
+    result[edges[ranks < top_k]] = True
+    return result
+
+
+def plot_entities_graph(g, category=None):
+    print(f"Plotting graph with {len(g.nodes)} nodes and {len(g.weights)} edges")
 
     # Check if the graph has any nodes or edges
-    if len(g.nodes) == 0 or len(g.edges) == 0:
+    if len(g.nodes) == 0 or len(g.weights) == 0:
         # Create a simple figure with a message if the graph is empty
         p = create_plot()
         p.text(x=50, y=50,
@@ -55,26 +163,24 @@ def plot_entities_graph(g):
         return p
 
     # Normalize weights to have reasonable line widths
-    weights = [d['weight'] for (_, _, d) in (list(g.edges(data=True)))]
-    line_widths = minmax_scale(weights) * 6 + 1
+    line_widths = minmax_scale(g.weights) * 6 + 1
 
     # create Graph
-    nodes = list(g.nodes)
-    edges = list(g.edges)
-    nodes_to_idx = {v: i for i, v in enumerate(nodes)}
+    nodes = g.nodes
 
     graph = GraphRenderer()
     # Graph API requires id to be integer
-    ids = list(range(len(nodes_to_idx)))
+    ids = list(range(len(nodes)))
     graph.node_renderer.data_source.data = dict(
         index=ids,
+        name=nodes,
     )
     # Set node glyph
     graph.node_renderer.glyph = Circle(radius=1, fill_color="skyblue")
 
     graph.edge_renderer.data_source.data = dict(
-        start=[nodes_to_idx[u] for u, v in edges],
-        end=[nodes_to_idx[v] for u, v in edges],
+        start=g.sources.tolist(),
+        end=g.targets.tolist(),
         line_widths=line_widths
     )
     # Set edge glyph
@@ -84,11 +190,18 @@ def plot_entities_graph(g):
     graph.selection_policy = NodesAndLinkedEdges()
     graph.inspection_policy = NodesAndLinkedEdges()
 
+    if category is not None:
+        # Graph may be pruned, full neighbourhood of the selected node is requested on demand
+        source = graph.node_renderer.data_source
+        source.selected.js_on_change('indices', CustomJS(args=dict(source=source, category=category), code="""
+            const indices = source.selected.indices;
+            if (indices.length > 0 && typeof expandEntity === 'function') {
+                expandEntity(category, source.data['name'][indices[0]]);
+            }
+        """))
+
     # start of layout code
-    pos = nx.spring_layout(g, k=13, iterations=300, seed=42)
-    xs = [pos[v][0] for v in nodes]
-    ys = [pos[v][1] for v in nodes]
-    xs, ys = minmax_scale(xs) * 100, minmax_scale(ys) * 100
+    xs, ys = layout_entities_graph(g)
     graph_layout = dict(zip(ids, zip(xs, ys)))
     graph.layout_provider = StaticLayoutProvider(graph_layout=graph_layout)
 
@@ -0,0 +1,142 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, identity
+from scipy.sparse.linalg import eigsh, ArpackError
+from sklearn.preprocessing import minmax_scale
+
+# Exact all-pairs repulsion up to this number of nodes, sampled repulsion for bigger graphs
+DENSE_LAYOUT_MAX_NODES = 500
+# Number of nodes to compute repulsion against for big graphs
+REPULSION_SAMPLE_SIZE = 300
+# Dense eigendecomposition for spectral seeding up to this number of nodes
+DENSE_SPECTRAL_MAX_NODES = 500
+
+
+def layout_cache_key(g, iterations, seed):
+    """
+    Digest of the graph edge set, weights and layout parameters.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((iterations, seed)).encode('utf-8'))
+    h.update('\0'.join(map(str, g.nodes)).encode('utf-8'))
+    for array in (g.sources, g.targets):
+        h.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(g.weights, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class LayoutCache:
+    """
+    Bounded LRU cache of graph layouts keyed by layout_cache_key.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+
+layout_cache = LayoutCache()
+
+
+def layout_entities_graph(g, iterations=50, seed=42, cache=layout_cache):
+    """
+    Compute positions of EntitiesGraph nodes scaled to [0, 100] range.
+    Spectral seeding followed by a few force-directed refinement steps.
+    :return: xs, ys arrays aligned with g.nodes
+    """
+    key = layout_cache_key(g, iterations, seed)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    n = len(g.nodes)
+    weights = np.asarray(g.weights, dtype=np.float64)
+    # Normalize weights, so that attraction does not depend on the absolute number of connections
+    weights = weights / weights.max() if len(weights) and weights.max() > 0 else np.ones(len(weights))
+    adjacency = csr_matrix((np.concatenate([weights, weights]),
+                            (np.concatenate([g.sources, g.targets]), np.concatenate([g.targets, g.sources]))),
+                           shape=(n, n))
+    rng = np.random.default_rng(seed)
+    pos = _spectral_positions(adjacency, rng)
+    pos = _force_directed(adjacency, pos, iterations, rng)
+    xs, ys = minmax_scale(pos[:, 0]) * 100, minmax_scale(pos[:, 1]) * 100
+    if cache is not None:
+        cache.put(key, (xs, ys))
+    return xs, ys
+
+
+def _spectral_positions(adjacency, rng):
+    """
+    Eigenvectors of the graph Laplacian for the 2 smallest non-zero eigenvalues, random for degenerate cases.
+    """
+    n = adjacency.shape[0]
+    jitter = rng.uniform(-1e-3, 1e-3, size=(n, 2))
+    if n <= 2:
+        return rng.uniform(0, 1, size=(n, 2))
+    laplacian = diags(np.asarray(adjacency.sum(axis=1)).ravel()) - adjacency
+    try:
+        if n <= DENSE_SPECTRAL_MAX_NODES:
+            _, vectors = np.linalg.eigh(laplacian.toarray())
+        else:
+            # Shift-invert around zero finds the smallest eigenvalues quickly
+            values, vectors = eigsh(laplacian + 1e-6 * identity(n), k=3, sigma=0, which='LM')
+            vectors = vectors[:, np.argsort(values)]
+        pos = vectors[:, 1:3]
+    except (np.linalg.LinAlgError, ArpackError, RuntimeError) as e:
+        print(f'Spectral layout failed, fallback to random: {e}')
+        return rng.uniform(0, 1, size=(n, 2))
+    scale = np.abs(pos).max()
+    return (pos / scale if scale > 0 else pos) + jitter
+
+
+def _force_directed(adjacency, pos, iterations, rng):
+    """
+    Fruchterman-Reingold refinement, all-pairs repulsion for small graphs and sampled repulsion for big ones.
+    """
+    n = len(pos)
+    if n <= 1:
+        return pos
+    k = np.sqrt(1.0 / n)
+    temperature = 0.1 * max(np.ptp(pos[:, 0]), np.ptp(pos[:, 1]), 1e-2)
+    dt = temperature / (iterations + 1)
+    sources, targets = adjacency.nonzero()
+    weights = np.asarray(adjacency[sources, targets]).ravel()
+    for _ in range(iterations):
+        if n <= DENSE_LAYOUT_MAX_NODES:
+            others, scale = np.arange(n), 1.0
+        else:
+            others = rng.choice(n, size=REPULSION_SAMPLE_SIZE, replace=False)
+            scale = n / REPULSION_SAMPLE_SIZE
+        # Repulsion k^2 / d between all (sampled) pairs, sum of (x_i - x_j) * k^2 / d_ij^2 via matrix products
+        other = pos[others]
+        squares = np.einsum('ij,ij->i', pos, pos)
+        distance2 = np.maximum(squares[:, None] + squares[others][None, :] - 2 * pos @ other.T, 1e-4)
+        repulsion = k * k / distance2
+        displacement = scale * (pos * repulsion.sum(axis=1)[:, None] - repulsion @ other)
+        # Attraction d^2 / k along edges
+        delta = pos[sources] - pos[targets]
+        distance = np.maximum(np.sqrt(np.einsum('ij,ij->i', delta, delta)), 0.01)
+        np.add.at(displacement, sources, -delta * (weights * distance / k)[:, None])
+        # Limit movement by temperature
+        length = np.maximum(np.sqrt(np.einsum('ij,ij->i', displacement, displacement)), 0.01)
+        pos = pos + displacement * (temperature / length)[:, None]
+        temperature -= dt
+    return pos
@@ -0,0 +1,12 @@
+# gunicorn -c gunicorn.conf.py app:app
+# Job state and work queue are shared through SQLite, see config.py, so any number of workers can be used
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5003")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Long running steps are executed by queue consumers, web threads serve requests
+# and progress events streams, each open progress page holds a thread
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "32"))
+timeout = 120
@@ -0,0 +1,219 @@
+"""
+Server-side driver advancing search jobs independently of browsers.
+
+One loop per process admits queued jobs (see pubtrends/scheduler.py) and sweeps admitted ones,
+every job is checked by a single process at a time with adaptive backoff:
+interval grows while job progress does not change and resets on change.
+Web handlers only read job state.
+"""
+import threading
+import time
+
+from tornado import concurrent
+
+from async_tasks import start_summarize_async_step, start_semantic_search_async_step
+from config import *
+from metrics import start_step, finish_step
+from tracing import tracer
+from upstream import http_client
+
+
+# Job field with the number of failed upstream status checks in a row
+STATUS_CHECK_ERRORS = 'status_check_errors'
+
+
+def job_status(progress):
+    if progress is None:
+        return {'status': 'not_found'}
+    if any(v == STEP_ERROR for v in progress.values()):
+        return {'status': 'failed'}
+    if progress.get(SUMMARIZE_STEP) == STEP_COMPLETE:
+        return {'status': 'success', 'progress': list(progress.items())}
+    return {'status': STEP_PENDING, 'progress': list(progress.items())}
+
+
+def make_pubtrends_search_api_call(search_query):
+    # TODO: add better error processing
+    try:
+        api_url = f"{PUBTRENDS_API}/search_terms_api"
+        # Retried only if the job was not created
+        response = http_client.post(api_url, endpoint='pubtrends_search_terms', idempotent=False, data={
+            'query': search_query,
+        })
+        if response.status_code == 200:
+            # Store the response data
+            data = response.json()
+            if data['success']:
+                return data['jobid']
+        return None
+    except Exception as e:
+        print(e)
+        return None
+
+
+def make_pubtrends_analyse_api_call(job_store, job_id, ids):
+    # TODO: add better error processing
+    try:
+        api_url = f"{PUBTRENDS_API}/analyse_ids_api"
+        # Retried only if the job was not created
+        response = http_client.post(api_url, endpoint='pubtrends_analyse_ids', idempotent=False, data={
+            'query': job_store.get_field(job_id, 'search_query'),
+            'job_id': job_id,
+            'ids': ','.join(str(idx) for idx in ids),
+        })
+        if response.status_code == 200:
+            # Store the response data
+            data = response.json()
+            if data['success']:
+                return data['jobid']
+        return None
+    except Exception as e:
+        print(e)
+        return None
+
+
+def advance_job(job_store, job_id):
+    """
+    Start pending steps of the job and check PubTrends status, returns job status.
+    """
+    # TODO: add better error processing
+    progress = job_store.progress(job_id)
+    status = job_status(progress)
+    if status['status'] != STEP_PENDING:
+        return status
+    if SEMANTIC_SEARCH_STEP in progress and \
+            not job_store.get_field(job_id, STEP_SEMANTIC_SEARCH_PASSED_FURTHER, False):
+        # Steps are switched with expected status, so that each step is started once
+        if start_step(job_store, job_id, SEMANTIC_SEARCH_STEP):
+            job_store.set_step(job_id, START_STEP, STEP_COMPLETE)
+            # Submit task async and wait till it will eventually becomes STEP_COMPLETE STATUS
+            start_semantic_search_async_step(job_store, job_id)
+        elif progress[SEMANTIC_SEARCH_STEP] == STEP_COMPLETE and \
+                start_step(job_store, job_id, PUBTRENDS_STEP):
+            ids = job_store.get_field(job_id, SEMANTIC_SEARCH_STEP + "_RESULT")
+            pubtrends_job_id = make_pubtrends_analyse_api_call(job_store, job_id, ids)
+            job_store.update(job_id, {PUBTRENDS_JOB_ID: pubtrends_job_id, STEP_SEMANTIC_SEARCH_PASSED_FURTHER: True})
+        return job_status(job_store.progress(job_id))
+    if SEMANTIC_SEARCH_STEP not in progress and progress[START_STEP] != STEP_COMPLETE:
+        # PubTrends search is started once the job is admitted
+        if start_step(job_store, job_id, START_STEP):
+            pubtrends_job_id = make_pubtrends_search_api_call(job_store.get_field(job_id, 'search_query'))
+            if pubtrends_job_id is None:
+                finish_step(job_store, job_id, START_STEP, STEP_ERROR)
+            else:
+                job_store.update(job_id, {PUBTRENDS_JOB_ID: pubtrends_job_id})
+                finish_step(job_store, job_id, START_STEP, STEP_COMPLETE)
+        return job_status(job_store.progress(job_id))
+    if progress[PUBTRENDS_STEP] == STEP_COMPLETE:
+        # Summarization is in progress, nothing to check upstream
+        return status
+    try:
+        pubtrends_job_id = job_store.get_field(job_id, PUBTRENDS_JOB_ID) or job_id
+        api_url = f"{PUBTRENDS_API}/check_status_api/{pubtrends_job_id}"
+        response = http_client.get(api_url, endpoint='pubtrends_check_status')
+        if response.status_code == 200:
+            data = response.json()
+            if job_store.get_field(job_id, STATUS_CHECK_ERRORS):
+                job_store.update(job_id, {STATUS_CHECK_ERRORS: 0})
+            job_store.set_step(job_id, START_STEP, STEP_COMPLETE)
+            start_step(job_store, job_id, PUBTRENDS_STEP)
+            if data['status'] == 'success':
+                finish_step(job_store, job_id, PUBTRENDS_STEP, STEP_COMPLETE)
+                if start_step(job_store, job_id, SUMMARIZE_STEP):
+                    # Submit task async and wait till it will eventually becomes STEP_COMPLETE STATUS
+                    start_summarize_async_step(job_store, job_id)
+            elif data['status'] == 'failed':
+                finish_step(job_store, job_id, PUBTRENDS_STEP, STEP_ERROR)
+            return job_status(job_store.progress(job_id))
+        print(f"❌ Status check of job {job_id} failed: {response.status_code}")
+    except Exception as e:
+        print(f"❌ Status check of job {job_id} failed: {e}")
+    # Transient errors are retried with driver backoff, job fails after DRIVER_MAX_ERRORS checks in a row
+    errors = job_store.get_field(job_id, STATUS_CHECK_ERRORS, 0) + 1
+    job_store.update(job_id, {STATUS_CHECK_ERRORS: errors})
+    if errors >= DRIVER_MAX_ERRORS:
+        finish_step(job_store, job_id, PUBTRENDS_STEP, STEP_ERROR)
+    return job_status(job_store.progress(job_id))
+
+
+class JobDriver:
+    """
+    Background loop advancing all active jobs, see advance_job.
+    """
+
+    def __init__(self, job_store, scheduler, threads=DRIVER_THREADS,
+                 min_interval=DRIVER_MIN_INTERVAL, max_interval=DRIVER_MAX_INTERVAL, backoff=1.5):
+        self.job_store = job_store
+        self.scheduler = scheduler
+        self.threads = threads
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        # Local backoff state: job_id -> (interval, next check time, last status)
+        self._schedule = {}
+        self.executor = None
+        self._wakeup = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def notify(self):
+        """
+        Wake up the loop, i.e. after a new job is queued.
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            self.executor = executor
+            while True:
+                try:
+                    self.tick(executor)
+                except Exception as e:
+                    print(f"❌ Job driver error: {e}")
+                self._wakeup.wait(self._sleep_time())
+                self._wakeup.clear()
+
+    def _sleep_time(self):
+        now = time.time()
+        due = [next_check for _, next_check, _ in self._schedule.values()]
+        return min([self.min_interval, *(max(d - now, 0.05) for d in due)])
+
+    def tick(self, executor):
+        """
+        Admit queued jobs and advance all due admitted jobs, upstream checks of different jobs are done concurrently.
+        """
+        now = time.time()
+        active = self.job_store.active_jobs([STEP_NOT_STARTED, STEP_PENDING], exclude=[STEP_ERROR])
+        # Slots of finished and failed jobs are released
+        self.scheduler.retain(active, before=now)
+        for job_id, waited in self.scheduler.admit():
+            tracer.record('queued', waited, job_id=job_id)
+        running = self.scheduler.running_jobs()
+        active = [job_id for job_id in active if job_id in running]
+        for job_id in set(self._schedule) - set(active):
+            del self._schedule[job_id]
+        due = [job_id for job_id in active if self._schedule.get(job_id, (None, 0, None))[1] <= now]
+        for _ in executor.map(self._drive, due):
+            pass
+
+    def _drive(self, job_id):
+        interval, _, last = self._schedule.get(job_id, (self.min_interval, 0, None))
+        # Job is driven by a single process at a time
+        if self.job_store.touch(job_id, 'driver_checked_at', interval * 0.9):
+            # Upstream calls are traced as a part of the job
+            with tracer.job(job_id):
+                status = advance_job(self.job_store, job_id)
+            if status['status'] != STEP_PENDING:
+                self._schedule.pop(job_id, None)
+                return
+            interval = self.min_interval if status != last else min(interval * self.backoff, self.max_interval)
+            last = status
+        self._schedule[job_id] = (interval, time.time() + interval, last)
@@ -0,0 +1,99 @@
+"""
+Application metrics exposed at /metrics, see pubtrends/metrics.py.
+
+Histograms and counters of all processes are summed through METRICS_DB, so any process can be scraped,
+metrics of shared state (jobs, work queue, results cache) are the same for all processes.
+Gauges of engine and driver executors are values of the scraped process.
+"""
+import time
+
+from cache import result_cache
+from config import *
+from pubtrends.metrics import Registry, SharedSamples
+from tracing import tracer
+
+registry = Registry()
+registry.share(SharedSamples(METRICS_DB))
+
+STEP_SECONDS = registry.histogram(
+    'pipeline_step_duration_seconds', 'Time from pipeline step start till completion or failure', ['step', 'status'])
+UPSTREAM_SECONDS = registry.histogram(
+    'upstream_request_duration_seconds', 'Upstream request attempts latency', ['endpoint'])
+UPSTREAM_RESPONSES = registry.counter(
+    'upstream_responses_total', 'Upstream request attempts by response status, "error" for connection errors',
+    ['endpoint', 'status'])
+DECODE_SECONDS = registry.histogram(
+    'analysis_data_decode_seconds', 'Decode time of PubTrends analysis data fields', ['format', 'field'])
+SEARCHES = registry.counter(
+    'searches_total', 'Searches by outcome: served from cache, joined in-flight job, started or rejected',
+    ['type', 'outcome'])
+
+
+def _cache_stat(name):
+    return lambda: result_cache.stats().get(name, 0)
+
+
+def _cache_hit_ratio():
+    stats = result_cache.stats()
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    return stats.get('hits', 0) / lookups if lookups else 0.0
+
+
+# Cache counters are shared between processes, see cache.py
+registry.counter('result_cache_hits_total', 'Results cache hits', fn=_cache_stat('hits'))
+registry.counter('result_cache_misses_total', 'Results cache misses', fn=_cache_stat('misses'))
+registry.counter('result_cache_evictions_total', 'Results cache evictions', fn=_cache_stat('evictions'))
+registry.gauge('result_cache_hit_ratio', 'Results cache hits to lookups ratio', fn=_cache_hit_ratio)
+registry.gauge('result_cache_bytes', 'Results cache size on disk', fn=_cache_stat('bytes'))
+
+
+def register_gauges(job_store, work_queue, scheduler, engine=None, driver=None):
+    """
+    Gauges of jobs and work queue, engine and driver are registered if they run in this process.
+    """
+    registry.gauge('jobs_in_flight', 'Not finished and not failed jobs',
+                   fn=lambda: len(job_store.active_jobs([STEP_NOT_STARTED, STEP_PENDING], exclude=[STEP_ERROR])))
+    registry.gauge('jobs_scheduled', 'Jobs admitted to run and waiting in the queue', ['state'],
+                   fn=lambda: [({'state': state}, count) for state, count in scheduler.counts().items()])
+    registry.gauge('work_queue_depth', 'Queued pipeline tasks', fn=work_queue.size)
+    if engine is not None:
+        registry.gauge('pipeline_tasks_running', 'Pipeline tasks running in this process event loop',
+                       fn=lambda: engine.running)
+        registry.gauge('pipeline_executor_queue_depth', 'CPU bound calls waiting for pipeline executor',
+                       fn=lambda: engine.executor._work_queue.qsize() if engine.executor is not None else 0)
+    if driver is not None:
+        registry.gauge('job_driver_executor_queue_depth', 'Job checks waiting for job driver executor',
+                       fn=lambda: driver.executor._work_queue.qsize() if driver.executor is not None else 0)
+
+
+def observe_upstream_call(endpoint, status, seconds):
+    UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint)
+    UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status if status is not None else 'error')
+
+
+def observe_decode(data_format, field, seconds):
+    DECODE_SECONDS.observe(seconds, format=data_format, field=field)
+
+
+def start_step(job_store, job_id, step):
+    """
+    Switch step from not started to pending, start time is kept for step duration metrics.
+    :return: True if step was switched, so that each step is started once
+    """
+    if not job_store.set_step(job_id, step, STEP_PENDING, expected=STEP_NOT_STARTED):
+        return False
+    job_store.update(job_id, {step + '_STARTED_AT': time.time()})
+    return True
+
+
+def finish_step(job_store, job_id, step, status):
+    """
+    Set step status, duration is observed and traced when pending step is finished.
+    """
+    if job_store.set_step(job_id, step, status, expected=STEP_PENDING):
+        started = job_store.get_field(job_id, step + '_STARTED_AT')
+        if started is not None:
+            STEP_SECONDS.observe(time.time() - started, step=step, status=status)
+            tracer.record(step, time.time() - started, job_id=job_id, status=status)
+    else:
+        job_store.set_step(job_id, step, status)
@@ -0,0 +1,271 @@
+"""
+Binary columnar serialization of AnalysisData fields.
+
+Layout: MAGIC | uint32 header length | header JSON | 8-byte aligned blobs.
+DataFrames are stored as Arrow IPC streams, numeric arrays as raw buffers,
+sparse matrices and graphs as CSR arrays. Header entries describe how to decode each blob.
+"""
+
+import json
+import struct
+from io import StringIO
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from networkx.readwrite import json_graph
+from scipy.sparse import csr_matrix
+
+from pubtrends.csr_graph import CSRGraph
+from pubtrends.sparse import index_dtype
+
+# Media type used for format negotiation with the PubTrends get_result_api
+BINARY_MIME_TYPE = 'application/vnd.pubtrends.analysis+binary'
+JSON_MIME_TYPE = 'application/json'
+
+MAGIC = b'PTAD\x01'
+ALIGN = 8
+
+
+def is_binary(buf):
+    return bytes(buf[:len(MAGIC)]) == MAGIC
+
+
+class _Writer:
+    def __init__(self):
+        self.blobs = []
+        self.size = 0
+
+    def add(self, buf):
+        buf = memoryview(buf).cast('B')
+        entry = dict(offset=self.size, length=len(buf))
+        self.blobs.append(buf)
+        self.size += len(buf)
+        padding = -self.size % ALIGN
+        if padding:
+            self.blobs.append(b'\0' * padding)
+            self.size += padding
+        return entry
+
+    def add_array(self, array, dtype=None):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        return dict(self.add(array.data if array.size else b''), dtype=array.dtype.str, shape=list(array.shape))
+
+
+def _read_array(payload, entry):
+    dtype = np.dtype(entry['dtype'])
+    count = int(np.prod(entry['shape'], dtype=np.int64))
+    return np.frombuffer(payload, dtype=dtype, count=count, offset=entry['offset']).reshape(entry['shape'])
+
+
+def _encode_frame(writer, df):
+    try:
+        df = df.rename(columns=str)
+        table = pa.Table.from_pandas(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as stream:
+            stream.write_table(table)
+        return dict(writer.add(sink.getvalue()), kind='arrow')
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        # Mixed-type object columns cannot be stored in Arrow, fallback to JSON
+        print(f'Arrow encoding failed, fallback to JSON: {e}')
+        return dict(writer.add(df.to_json().encode('utf-8')), kind='json')
+
+
+def _decode_frame(payload, entry):
+    buf = payload[entry['offset']:entry['offset'] + entry['length']]
+    if entry['kind'] == 'json':
+        return pd.read_json(StringIO(bytes(buf).decode('utf-8')))
+    table = pa.ipc.open_stream(pa.py_buffer(buf)).read_all()
+    df = table.to_pandas()
+    # Arrow returns numpy arrays for list columns, JSON path returns lists
+    for field in table.schema:
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            df[field.name] = [v.tolist() if v is not None else None for v in df[field.name]]
+    return df
+
+
+def _encode_csr(writer, matrix):
+    matrix = csr_matrix(matrix)
+    # Decoded matrix is read-only, indices can't be sorted in place later
+    matrix.sort_indices()
+    # Scipy keeps indices and indptr of the same dtype, indptr values go up to nnz
+    indices_dtype = index_dtype(max(*matrix.shape, matrix.nnz))
+    return dict(
+        kind='csr',
+        shape=list(matrix.shape),
+        data=writer.add_array(matrix.data),
+        indices=writer.add_array(matrix.indices, dtype=indices_dtype),
+        indptr=writer.add_array(matrix.indptr, dtype=indices_dtype),
+    )
+
+
+def _decode_csr(payload, entry):
+    """
+    CSR matrix over read-only views of the payload, i.e. memory mapped response, nothing is copied.
+    """
+    return csr_matrix((_read_array(payload, entry['data']),
+                       _read_array(payload, entry['indices']),
+                       _read_array(payload, entry['indptr'])), shape=tuple(entry['shape']), copy=False)
+
+
+def _encode_graph(writer, graph):
+    """
+    Store graph as CSR adjacency over node positions, numeric edge attributes as float64 columns.
+    Falls back to node-link JSON when attributes are not numeric.
+    """
+    nodes = list(graph.nodes)
+    node_idx = {v: i for i, v in enumerate(nodes)}
+    edges = list(graph.edges(data=True))
+    attrs = sorted({k for _, _, d in edges for k in d})
+    sources = np.fromiter((node_idx[u] for u, _, _ in edges), dtype=np.int32, count=len(edges))
+    targets = np.fromiter((node_idx[v] for _, v, _ in edges), dtype=np.int32, count=len(edges))
+    try:
+        values = {k: np.array([d.get(k, np.nan) for _, _, d in edges], dtype=np.float64) for k in attrs}
+        header = json.dumps(dict(
+            nodes=nodes,
+            nodes_data=[d for _, d in graph.nodes(data=True)] if any(d for _, d in graph.nodes(data=True)) else None,
+            graph=graph.graph,
+        )).encode('utf-8')
+    except (TypeError, ValueError):
+        print('Graph attributes are not numeric, fallback to node-link JSON')
+        return dict(writer.add(json.dumps(json_graph.node_link_data(graph, edges='links')).encode('utf-8')),
+                    kind='node_link')
+    order = np.argsort(sources, kind='stable')
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(nodes)))])
+    return dict(
+        kind='graph_csr',
+        directed=graph.is_directed(),
+        meta=writer.add(header),
+        indptr=writer.add_array(indptr, dtype=np.int64),
+        indices=writer.add_array(targets[order]),
+        attrs={k: writer.add_array(v[order]) for k, v in values.items()},
+    )
+
+
+def _decode_graph(payload, entry):
+    if entry['kind'] == 'node_link':
+        buf = payload[entry['offset']:entry['offset'] + entry['length']]
+        return json_graph.node_link_graph(json.loads(bytes(buf)), edges='links')
+    meta = entry['meta']
+    meta = json.loads(bytes(payload[meta['offset']:meta['offset'] + meta['length']]))
+    nodes = meta['nodes']
+    graph = nx.DiGraph() if entry['directed'] else nx.Graph()
+    graph.graph.update(meta['graph'])
+    if meta['nodes_data'] is not None:
+        graph.add_nodes_from(zip(nodes, meta['nodes_data']))
+    else:
+        graph.add_nodes_from(nodes)
+    indptr = _read_array(payload, entry['indptr'])
+    indices = _read_array(payload, entry['indices'])
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    names = list(entry['attrs'])
+    columns = [_read_array(payload, entry['attrs'][k]).tolist() for k in names]
+    rows = zip(*columns) if columns else [()] * len(indices)
+    graph.add_edges_from(
+        (nodes[u], nodes[v], {k: x for k, x in zip(names, row) if x == x})  # Skip NaN, i.e. missing attribute
+        for u, v, row in zip(sources.tolist(), indices.tolist(), rows)
+    )
+    return graph
+
+
+def decode_adjacency(entry, payload, weight='weight'):
+    """
+    Decode papers graph entry directly to CSRGraph, without networkx.
+    """
+    if entry['kind'] == 'node_link':
+        return CSRGraph.from_node_link(json.loads(bytes(payload[entry['offset']:entry['offset'] + entry['length']])))
+    meta = entry['meta']
+    nodes = json.loads(bytes(payload[meta['offset']:meta['offset'] + meta['length']]))['nodes']
+    indptr = _read_array(payload, entry['indptr'])
+    targets = _read_array(payload, entry['indices'])
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    weights = None
+    if weight in entry['attrs']:
+        weights = np.nan_to_num(_read_array(payload, entry['attrs'][weight]), nan=1.0)
+    return CSRGraph.from_edges(nodes, sources, targets, weights, directed=entry['directed'])
+
+
+def _encode_dense(writer, array, dtype):
+    if array is None:
+        return None
+    array = np.asarray(array)
+    if array.dtype.kind not in 'biuf':
+        # Ragged or object arrays are kept as JSON
+        return dict(writer.add(json.dumps(array.tolist()).encode('utf-8')), kind='json')
+    return dict(writer.add_array(array, dtype=dtype), kind='array')
+
+
+def _decode_dense(payload, entry):
+    if entry is None:
+        return None
+    if entry['kind'] == 'json':
+        return np.array(json.loads(bytes(payload[entry['offset']:entry['offset'] + entry['length']])))
+    # Copy to detach from the payload buffer, so it can be released
+    return _read_array(payload, entry).copy()
+
+
+FRAME_FIELDS = ['df', 'cit_df', 'cocit_grouped_df', 'bibliographic_coupling_df', 'top_cited_df',
+                'max_gain_df', 'max_rel_gain_df', 'author_stats', 'journal_stats', 'numbers_df']
+JSON_FIELDS = ['search_query', 'search_ids', 'source', 'sort', 'limit', 'noreviews', 'min_year', 'max_year',
+               'corpus', 'corpus_tokens']
+
+
+def encode_fields(fields):
+    """
+    Encode AnalysisData fields dict to binary buffer.
+    """
+    writer = _Writer()
+    entries = {}
+    for name in FRAME_FIELDS:
+        entries[name] = _encode_frame(writer, fields[name]) if fields[name] is not None else None
+    for name in JSON_FIELDS:
+        entries[name] = dict(writer.add(json.dumps(fields[name]).encode('utf-8')), kind='json')
+    entries['corpus_counts'] = _encode_csr(writer, fields['corpus_counts'])
+    entries['papers_graph'] = _encode_graph(writer, fields['papers_graph'])
+    entries['papers_embeddings'] = _encode_dense(writer, fields['papers_embeddings'], np.float32)
+    entries['dendrogram'] = _encode_dense(writer, fields['dendrogram'], np.float32)
+
+    header = json.dumps(entries).encode('utf-8')
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    prefix += b'\0' * (-len(prefix) % ALIGN)
+    return b''.join([prefix, *writer.blobs])
+
+
+def decode_header(buf):
+    """
+    Parse header of binary buffer, returns header entries and payload memoryview.
+    """
+    buf = memoryview(buf)
+    if not is_binary(buf):
+        raise ValueError('Not a binary AnalysisData buffer')
+    (header_length,) = struct.unpack_from('<I', buf, len(MAGIC))
+    start = len(MAGIC) + 4
+    entries = json.loads(bytes(buf[start:start + header_length]))
+    payload_start = start + header_length
+    payload_start += -payload_start % ALIGN
+    return entries, buf[payload_start:]
+
+
+def decode_field(name, entries, payload):
+    entry = entries[name]
+    if name in FRAME_FIELDS:
+        return _decode_frame(payload, entry) if entry is not None else None
+    if name in JSON_FIELDS:
+        return json.loads(bytes(payload[entry['offset']:entry['offset'] + entry['length']]))
+    if name == 'corpus_counts':
+        return _decode_csr(payload, entry)
+    if name == 'papers_graph':
+        return _decode_graph(payload, entry)
+    if name in ('papers_embeddings', 'dendrogram'):
+        return _decode_dense(payload, entry)
+    raise KeyError(f'Unknown field {name}')
+
+
+def decode_fields(buf):
+    """
+    Decode binary buffer to AnalysisData fields dict.
+    """
+    entries, payload = decode_header(buf)
+    return {name: decode_field(name, entries, payload) for name in entries}
@@ -0,0 +1,87 @@
+"""
+Fan-out of polled state to many watchers, i.e. job status to open progress streams.
+
+A single thread polls each watched key once per interval, no matter how many watchers it has,
+and wakes watchers up only when the value changes. Keys are polled while they have watchers.
+"""
+
+import threading
+import time
+
+
+class Broadcaster:
+    def __init__(self, fn, interval):
+        """
+        :param fn: called with key in the polling thread, returns JSON-like value to compare and publish
+        """
+        self.fn = fn
+        self.interval = interval
+        self._watchers = {}  # key -> number of watchers
+        self._values = {}  # key -> (version, value)
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, key, duration, keepalive):
+        """
+        Generator of changed values of the key during duration seconds,
+        None is generated if value didn't change for keepalive seconds.
+        """
+        self._add(key)
+        try:
+            version = 0
+            deadline = time.time() + duration
+            while time.time() < deadline:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._values.get(key, (0, None))[0] > version,
+                                             timeout=min(keepalive, max(deadline - time.time(), 0)))
+                    current, value = self._values.get(key, (0, None))
+                if current > version:
+                    version = current
+                    yield value
+                else:
+                    yield None
+        finally:
+            self._remove(key)
+
+    def watchers(self):
+        with self._condition:
+            return sum(self._watchers.values())
+
+    def _add(self, key):
+        with self._condition:
+            self._watchers[key] = self._watchers.get(key, 0) + 1
+            new = self._watchers[key] == 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if new:
+            # Poll new key right away
+            self._wakeup.set()
+
+    def _remove(self, key):
+        with self._condition:
+            self._watchers[key] -= 1
+            if not self._watchers[key]:
+                del self._watchers[key]
+                self._values.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                keys = list(self._watchers)
+            for key in keys:
+                try:
+                    value = self.fn(key)
+                except Exception as e:
+                    print(f"❌ Error polling {key}: {e}")
+                    continue
+                with self._condition:
+                    if key not in self._watchers:
+                        continue
+                    version, last = self._values.get(key, (0, None))
+                    if version == 0 or value != last:
+                        self._values[key] = (version + 1, value)
+                        self._condition.notify_all()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
@@ -0,0 +1,115 @@
+"""
+Compact array-backed graph for connectivity queries in the summarization path.
+"""
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+
+class CSRGraph:
+    """
+    Adjacency in CSR form: id -> int index map, int32 offsets / neighbors and float32 weights.
+    Undirected graphs store each edge in both directions.
+    """
+
+    def __init__(self, ids, offsets, neighbors, weights, directed=False):
+        self.ids = pd.Index(ids)
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+        self.directed = directed
+        self._degrees = np.diff(offsets).astype(np.int32)
+        self._weighted_degrees = np.bincount(
+            np.repeat(np.arange(len(ids)), self._degrees), weights=weights, minlength=len(ids)
+        ).astype(np.float32)
+
+    @staticmethod
+    def from_edges(ids, sources, targets, weights=None, directed=False):
+        """
+        Build from edges given as positions in ids.
+        """
+        n = len(ids)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = np.ones(len(sources), dtype=np.float32) if weights is None \
+            else np.asarray(weights, dtype=np.float32)
+        if not directed:
+            # Self-loops are stored once, same as graph.neighbors
+            mask = sources != targets
+            sources, targets = np.concatenate([sources, targets[mask]]), np.concatenate([targets, sources[mask]])
+            weights = np.concatenate([weights, weights[mask]])
+        order = np.lexsort((targets, sources))
+        index_dtype = np.int32 if len(sources) < np.iinfo(np.int32).max else np.int64
+        offsets = np.zeros(n + 1, dtype=index_dtype)
+        np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+        return CSRGraph(ids, offsets, targets[order].astype(np.int32), weights[order], directed=directed)
+
+    @staticmethod
+    def from_networkx(graph, weight='weight'):
+        ids = list(graph.nodes)
+        index = {v: i for i, v in enumerate(ids)}
+        edges = graph.edges(data=weight, default=1.0)
+        count = graph.number_of_edges()
+        sources = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=count)
+        targets = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=count)
+        weights = np.fromiter((w for _, _, w in edges), dtype=np.float32, count=count)
+        return CSRGraph.from_edges(ids, sources, targets, weights, directed=graph.is_directed())
+
+    @staticmethod
+    def from_node_link(data, weight='weight'):
+        """
+        Build from networkx node-link dict without creating networkx graph.
+        """
+        ids = pd.Index([node['id'] for node in data['nodes']])
+        links = data['links'] if 'links' in data else data['edges']
+        sources = ids.get_indexer([link['source'] for link in links])
+        targets = ids.get_indexer([link['target'] for link in links])
+        weights = [link.get(weight, 1.0) for link in links]
+        return CSRGraph.from_edges(ids, sources, targets, weights, directed=data.get('directed', False))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.neighbors.nbytes + self.weights.nbytes + \
+            self._degrees.nbytes + self._weighted_degrees.nbytes
+
+    def index_of(self, ids):
+        """
+        Positions of ids, -1 for unknown ids.
+        """
+        return self.ids.get_indexer(ids)
+
+    def degree(self, ids=None):
+        """
+        Number of neighbors for each of ids (all nodes if None), 0 for unknown ids.
+        """
+        return self._lookup(self._degrees, ids)
+
+    def weighted_degree(self, ids=None):
+        """
+        Sum of edge weights for each of ids (all nodes if None), 0 for unknown ids.
+        """
+        return self._lookup(self._weighted_degrees, ids)
+
+    def _lookup(self, values, ids):
+        if ids is None:
+            return values
+        idx = self.index_of(ids)
+        return np.where(idx >= 0, values[idx], 0).astype(values.dtype)
+
+    def neighbors_of(self, pid):
+        i = self.ids.get_loc(pid)
+        return self.ids[self.neighbors[self.offsets[i]:self.offsets[i + 1]]]
+
+    def to_networkx(self):
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_nodes_from(self.ids)
+        sources = np.repeat(np.arange(len(self.ids)), self._degrees)
+        ids = self.ids.tolist()
+        graph.add_weighted_edges_from(
+            (ids[u], ids[v], w) for u, v, w in zip(sources.tolist(), self.neighbors.tolist(), self.weights.tolist())
+        )
+        return graph
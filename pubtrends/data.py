@@ -1,12 +1,39 @@
 # A copy of https://github.com/JetBrains-Research/pubtrends/blob/master/pysrc/papers/data.py
 
 import json
+import threading
+import time
 from io import StringIO
 
 import numpy as np
 import pandas as pd
 from networkx.readwrite import json_graph
-from scipy.sparse import csr_matrix
+
+from pubtrends.binary import encode_fields, decode_fields, decode_header, decode_field, decode_adjacency
+from pubtrends.csr_graph import CSRGraph
+from pubtrends.sparse import csr_to_json, csr_from_json
+
+FIELDS = ['search_query', 'search_ids', 'source', 'sort', 'limit', 'noreviews', 'min_year', 'max_year',
+          'df', 'cit_df', 'cocit_grouped_df', 'bibliographic_coupling_df',
+          'top_cited_df', 'max_gain_df', 'max_rel_gain_df',
+          'corpus', 'corpus_tokens', 'corpus_counts',
+          'papers_graph', 'papers_embeddings',
+          'dendrogram',
+          'author_stats', 'journal_stats', 'numbers_df']
+
+
+def restore_int_columns(df):
+    """
+    JSON and Arrow store column names as strings, restore integer (e.g. year) columns.
+    """
+    mapping = {}
+    for col in df.columns:
+        try:
+            mapping[col] = int(col)
+        except ValueError:
+            mapping[col] = col
+    return df.rename(columns=mapping)
+
 
 class AnalysisData:
     def __init__(self, search_query, search_ids,
@@ -42,15 +69,12 @@ class AnalysisData:
         self.journal_stats = journal_stats
         self.numbers_df = numbers_df
 
-    def to_json(self):
+    def to_json(self, compress_counts=False):
         """
         Dump valuable fields to JSON-serializable dict.
+        :param compress_counts: delta+varint encode corpus_counts, see pubtrends.sparse
         """
-        csm_json = json.dumps(dict(
-            data=self.corpus_counts.data.tolist(),
-            indices=self.corpus_counts.nonzero()[0].tolist(),
-            indptr=self.corpus_counts.nonzero()[1].tolist())
-        )
+        csm_json = json.dumps(csr_to_json(self.corpus_counts, compress=compress_counts))
 
         return dict(
             search_query=self.search_query,
@@ -84,90 +108,163 @@ class AnalysisData:
         """
         Load from JSON-serializable dict.
         """
-        search_ids = fields['search_ids']
-        search_query = fields['search_query']
-        source = fields['source']
-        sort = fields['sort']
-        limit = fields['limit']
-        noreviews = fields['noreviews']
-        min_year = fields['min_year']
-        max_year = fields['max_year']
-        # Restore main dataframe
-        df = pd.read_json(StringIO(fields['df']))
-        df['id'] = df['id'].apply(str)
-        mapping = {}
-        for col in df.columns:
-            try:
-                mapping[col] = int(col)
-            except ValueError:
-                mapping[col] = col
-        df = df.rename(columns=mapping)
-
-        cit_df = pd.read_json(StringIO(fields['cit_df']))
-        cit_df['id_in'] = cit_df['id_in'].astype(str)
-        cit_df['id_out'] = cit_df['id_out'].astype(str)
-
-        cocit_grouped_df = pd.read_json(StringIO(fields['cocit_grouped_df']))
-        cocit_grouped_df['cited_1'] = cocit_grouped_df['cited_1'].astype(str)
-        cocit_grouped_df['cited_2'] = cocit_grouped_df['cited_2'].astype(str)
-
-        bibliographic_coupling_df = pd.read_json(StringIO(fields['bibliographic_coupling_df']))
-        bibliographic_coupling_df['citing_1'] = bibliographic_coupling_df['citing_1'].astype(str)
-        bibliographic_coupling_df['citing_2'] = bibliographic_coupling_df['citing_2'].astype(str)
-
-        top_cited_df = pd.read_json(StringIO(fields['top_cited_df']))
-        top_cited_df['id'] = top_cited_df['id'].apply(str)
-        max_gain_df = pd.read_json(StringIO(fields['max_gain_df']))
-        max_gain_df['id'] = max_gain_df['id'].apply(str)
-        max_rel_gain_df = pd.read_json(StringIO(fields['max_rel_gain_df']))
-        max_rel_gain_df['id'] = max_rel_gain_df['id'].apply(str)
-
-        # Corpus information
-        corpus = fields['corpus']
-        corpus_tokens = fields['corpus_tokens']
-        corpus_counts = json.loads(fields['corpus_counts'])
-        corpus_counts = csr_matrix((corpus_counts['data'], (corpus_counts['indices'], corpus_counts['indptr'])))
-
-
-        # Restore citation and structure graphs
-        papers_graph = json_graph.node_link_graph(fields['papers_graph'])
-
-        # Restore original embeddings
-        papers_embeddings = np.array(fields['papers_embeddings'])
-
-        # Restore dendrogram
-        dendrogram = fields['dendrogram']
-        if dendrogram is not None:
-            dendrogram = np.array(dendrogram)
-
-        # Restore additional analysis
-        author_stats = pd.read_json(StringIO(fields['author_stats'])) if fields['author_stats'] is not None else None
-        journal_stats = pd.read_json(StringIO(fields['journal_stats'])) if fields['journal_stats'] is not None else None
-        numbers_df = pd.read_json(StringIO(fields['numbers_df'])) if fields['numbers_df'] is not None else None
-
-        return AnalysisData(
-            search_query=search_query,
-            search_ids=search_ids,
-            source=source,
-            sort=sort,
-            limit=limit,
-            noreviews=noreviews,
-            min_year=min_year,
-            max_year=max_year,
-            df=df,
-            cit_df=cit_df,
-            cocit_grouped_df=cocit_grouped_df,
-            bibliographic_coupling_df=bibliographic_coupling_df,
-            top_cited_df=top_cited_df,
-            max_gain_df=max_gain_df,
-            max_rel_gain_df=max_rel_gain_df,
-            corpus=corpus,
-            corpus_tokens=corpus_tokens,
-            corpus_counts=corpus_counts,
-            papers_embeddings=papers_embeddings,
-            papers_graph=papers_graph,
-            dendrogram=dendrogram,
-            author_stats=author_stats,
-            journal_stats=journal_stats,
-            numbers_df=numbers_df,
-        )
+        return AnalysisData(**{name: decode_json_field(name, fields[name]) for name in FIELDS})
+
+    @property
+    def papers_adjacency(self) -> CSRGraph:
+        """
+        Compact array-backed adjacency of papers_graph, built once.
+        """
+        adjacency = self.__dict__.get('_papers_adjacency')
+        if adjacency is None:
+            adjacency = self._build_papers_adjacency()
+            self.__dict__['_papers_adjacency'] = adjacency
+        return adjacency
+
+    def _build_papers_adjacency(self):
+        return CSRGraph.from_networkx(self.papers_graph)
+
+    def to_binary(self):
+        """
+        Dump valuable fields to binary columnar buffer, see pubtrends.binary.
+        """
+        return encode_fields({name: getattr(self, name) for name in FIELDS})
+
+    @staticmethod
+    def from_binary(buf) -> 'AnalysisData':
+        """
+        Load from binary columnar buffer.
+        """
+        fields = decode_fields(buf)
+        fields['df'] = restore_int_columns(fields['df'])
+        return AnalysisData(**fields)
+
+
+class LazyAnalysisData(AnalysisData):
+    """
+    AnalysisData which decodes fields on first access.
+    Decoded fields can be dropped to free memory, and are decoded again on the next access.
+    Released fields are not available anymore, their raw representation is freed as well.
+    """
+
+    def __init__(self, raw, decode, decode_adjacency=None, observe=None):
+        """
+        :param observe: called with field name and decode time in seconds
+        """
+        # Fields are not assigned here, see __getattr__
+        self._raw = raw
+        self._decode = decode
+        self._decode_adjacency = decode_adjacency
+        self._observe = observe
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Called only if attribute is not decoded yet
+        if name not in FIELDS:
+            raise AttributeError(name)
+        with self._lock:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            if name not in self._raw:
+                raise AttributeError(f'Field {name} was released')
+            start = time.perf_counter()
+            value = self._decode(name, self._raw[name])
+            if self._observe is not None:
+                self._observe(name, time.perf_counter() - start)
+            self.__dict__[name] = value
+            return value
+
+    def _build_papers_adjacency(self):
+        with self._lock:
+            if self.is_decoded('papers_graph') or self._decode_adjacency is None:
+                return super()._build_papers_adjacency()
+            if 'papers_graph' not in self._raw:
+                raise AttributeError('Field papers_graph was released')
+            # Skip networkx graph construction
+            return self._decode_adjacency(self._raw['papers_graph'])
+
+    def is_decoded(self, name):
+        return name in self.__dict__
+
+    def drop(self, *names):
+        """
+        Drop decoded fields, raw representation is kept.
+        """
+        with self._lock:
+            for name in names:
+                self.__dict__.pop(name, None)
+
+    def release(self, *names):
+        """
+        Drop both decoded and raw representation of fields.
+        """
+        with self._lock:
+            for name in names:
+                self.__dict__.pop(name, None)
+                self._raw.pop(name, None)
+
+    @staticmethod
+    def from_json(fields) -> 'LazyAnalysisData':
+        """
+        Lazy load from JSON-serializable dict.
+        """
+        return LazyAnalysisData({name: fields[name] for name in FIELDS}, decode_json_field, CSRGraph.from_node_link)
+
+    @staticmethod
+    def from_binary(buf, observe=None) -> 'LazyAnalysisData':
+        """
+        Lazy load from binary columnar buffer.
+        :param observe: called with field name and decode time in seconds
+        """
+        entries, payload = decode_header(buf)
+
+        def decode(name, entry):
+            value = decode_field(name, {name: entry}, payload)
+            return restore_int_columns(value) if name == 'df' else value
+
+        return LazyAnalysisData(entries, decode, lambda entry: decode_adjacency(entry, payload), observe)
+
+
+def _read_json_df(value, str_columns=()):
+    if value is None:
+        return None
+    df = pd.read_json(StringIO(value))
+    for column in str_columns:
+        df[column] = df[column].apply(str)
+    return df
+
+
+def _read_json_corpus_counts(value):
+    return csr_from_json(json.loads(value))
+
+
+JSON_DECODERS = dict(
+    # Restore main dataframe
+    df=lambda v: restore_int_columns(_read_json_df(v, ['id'])),
+    cit_df=lambda v: _read_json_df(v, ['id_in', 'id_out']),
+    cocit_grouped_df=lambda v: _read_json_df(v, ['cited_1', 'cited_2']),
+    bibliographic_coupling_df=lambda v: _read_json_df(v, ['citing_1', 'citing_2']),
+    top_cited_df=lambda v: _read_json_df(v, ['id']),
+    max_gain_df=lambda v: _read_json_df(v, ['id']),
+    max_rel_gain_df=lambda v: _read_json_df(v, ['id']),
+    # Corpus information
+    corpus_counts=_read_json_corpus_counts,
+    # Restore citation and structure graphs
+    papers_graph=json_graph.node_link_graph,
+    # Restore original embeddings
+    papers_embeddings=np.array,
+    # Restore dendrogram
+    dendrogram=lambda v: np.array(v) if v is not None else None,
+    # Restore additional analysis
+    author_stats=_read_json_df,
+    journal_stats=_read_json_df,
+    numbers_df=_read_json_df,
+)
+
+
+def decode_json_field(name, value):
+    """
+    Decode single field of JSON-serializable dict, see AnalysisData.to_json.
+    """
+    decoder = JSON_DECODERS.get(name)
+    return decoder(value) if decoder is not None else value
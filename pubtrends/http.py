@@ -0,0 +1,239 @@
+"""
+Shared HTTP client for upstream services.
+
+Keep-alive sessions per host with connection pools, default connect / read timeouts,
+retries with jittered exponential backoff on 429 and 5xx (only 429 for calls creating upstream jobs),
+and per-endpoint latency stats.
+AsyncHttpClient provides the same for asyncio code on top of tornado AsyncHTTPClient.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from urllib3.util.retry import Retry
+
+try:
+    # Curl client keeps connections alive, simple client opens a connection per request
+    import pycurl  # noqa: F401
+
+    AsyncHTTPClient.configure('tornado.curl_httpclient.CurlAsyncHTTPClient')
+except ImportError:
+    pass
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.statuses = defaultdict(int)
+
+    def to_dict(self):
+        return dict(count=self.count, errors=self.errors, statuses=dict(self.statuses),
+                    mean_time=self.total_time / self.count if self.count else 0.0, max_time=self.max_time)
+
+
+class HttpClient:
+    def __init__(self, pool_size=16, connect_timeout=10, read_timeout=300, retries=3, backoff_factor=0.5,
+                 backoff_jitter=0.5, on_record=None):
+        """
+        :param on_record: called with endpoint, status (None on connection error) and seconds of every attempt
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.retry = Retry(
+            total=retries, connect=retries, read=0,
+            status_forcelist=RETRY_STATUSES, allowed_methods=None,  # LLM and PubTrends calls are POST
+            backoff_factor=backoff_factor, backoff_jitter=backoff_jitter,
+            respect_retry_after_header=True, raise_on_status=False
+        )
+        # Request may have been processed on 5xx, i.e. upstream job created, retry only when it was not
+        self.create_retry = self.retry.new(status_forcelist=(429,))
+        self._sessions = {}
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+        self.on_record = on_record
+
+    def session(self, url, idempotent=True):
+        """
+        Keep-alive session for the url host, connections are reused between calls and threads.
+        """
+        parts = urlsplit(url)
+        key = (f'{parts.scheme}://{parts.netloc}', idempotent)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                      max_retries=self.retry if idempotent else self.create_retry, pool_block=False)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[key] = session
+            return session
+
+    def request(self, method, url, endpoint=None, idempotent=True, **kwargs):
+        """
+        Same as requests.request, endpoint is a name for stats, url path by default.
+        :param idempotent: False for calls creating upstream state, i.e. jobs,
+        they are retried only on connection errors and 429
+        """
+        endpoint = endpoint or urlsplit(url).path
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.session(url, idempotent).request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            # Streamed responses are measured up to headers
+            self.record(endpoint, status, time.perf_counter() - start)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.count += 1
+            stats.total_time += seconds
+            stats.max_time = max(stats.max_time, seconds)
+            if status is None:
+                stats.errors += 1
+            else:
+                stats.statuses[status] += 1
+        if self.on_record is not None:
+            self.on_record(endpoint, status, seconds)
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self._stats.items()}
+
+
+class AsyncResponse:
+    """
+    Minimal requests-like view of tornado HTTPResponse.
+    """
+
+    def __init__(self, response):
+        self.status_code = response.code
+        self.headers = response.headers
+        self.content = response.body or b''
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHttpClient:
+    """
+    Asyncio HTTP client sharing timeouts, retry policy and stats with HttpClient.
+    At most pool_size requests are sent at a time, others wait for a free slot without timeout:
+    tornado fails requests waiting in its own queue longer than connect timeout.
+    """
+
+    def __init__(self, client, max_body_size=None):
+        """
+        :param max_body_size: limit of response body, streamed ones included, curl client has no limit
+        """
+        self.client = client
+        self.max_body_size = max_body_size
+        self._loop = None
+        self._http = None
+        self._slots = None
+
+    def _connection(self):
+        """
+        Tornado client and concurrency slots of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            kwargs = dict(max_clients=self.client.pool_size)
+            if self.max_body_size is not None and issubclass(AsyncHTTPClient.configured_class(),
+                                                             SimpleAsyncHTTPClient):
+                kwargs['max_body_size'] = self.max_body_size
+            self._http = AsyncHTTPClient(force_instance=True, **kwargs)
+            self._slots = asyncio.Semaphore(self.client.pool_size)
+            self._loop = loop
+        return self._http, self._slots
+
+    async def request(self, method, url, endpoint=None, params=None, json_body=None, data=None, headers=None,
+                      streaming_callback=None):
+        """
+        :param streaming_callback: called with body chunks, response content is empty in this case
+        """
+        endpoint = endpoint or urlsplit(url).path
+        if params:
+            url = f'{url}{"&" if "?" in url else "?"}{urlencode(params)}'
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers.setdefault('Content-Type', 'application/json')
+        elif data is not None:
+            body = urlencode(data)
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        connect_timeout, read_timeout = self.client.timeout
+        http, slots = self._connection()
+        streamed = False
+        if streaming_callback is not None:
+            callback = streaming_callback
+
+            def streaming_callback(chunk):
+                nonlocal streamed
+                streamed = True
+                callback(chunk)
+
+        for attempt in range(self.client.retries + 1):
+            start = time.perf_counter()
+            request = HTTPRequest(url, method=method, headers=headers, body=body,
+                                  connect_timeout=connect_timeout, request_timeout=connect_timeout + read_timeout,
+                                  streaming_callback=streaming_callback)
+            status = None
+            response = error = None
+            try:
+                async with slots:
+                    response = AsyncResponse(await http.fetch(request, raise_error=False))
+                status = response.status_code if response.status_code != 599 else None
+            except (HTTPClientError, OSError) as e:
+                # Connection errors, timeouts and closed streams are raised even with raise_error=False
+                error = e
+            finally:
+                self.client.record(endpoint, status, time.perf_counter() - start)
+            retry = status is None or status in RETRY_STATUSES
+            # Partially streamed body is already consumed, it can't be retried
+            if not retry or attempt == self.client.retries or streamed:
+                if response is None:
+                    raise error
+                return response
+            await asyncio.sleep(self._backoff(attempt, response))
+        return response
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None and response.headers else None
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.client.backoff_factor * 2 ** attempt + random.uniform(0, self.client.backoff_jitter)
+
+    async def get(self, url, endpoint=None, **kwargs):
+        return await self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    async def post(self, url, endpoint=None, **kwargs):
+        return await self.request('POST', url, endpoint=endpoint, **kwargs)
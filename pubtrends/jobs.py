@@ -0,0 +1,401 @@
+"""
+Job store for search jobs: fields, per-step progress and expiry.
+
+SQLiteJobStore is the default backend, it keeps jobs across restarts and is shared
+between worker processes. Each job field and each progress step is a separate row,
+so concurrent writers update them atomically without read-modify-write of the whole job.
+Expired jobs are found by index, cleanup cost does not depend on the number of live jobs.
+Flights register the job serving a key (i.e. normalized search query), so that identical
+concurrent searches attach to a single job instead of starting their own.
+MemoryJobStore keeps the same interface in process memory.
+"""
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Job keys stored outside of fields table
+PROGRESS = 'progress'
+TIMESTAMP = 'timestamp'
+
+
+class JobStore(ABC):
+    """
+    Interface of job stores, jobs are dicts with JSON serializable values and 'progress' dict of steps.
+    """
+
+    @abstractmethod
+    def create(self, job_id, job, ttl):
+        pass
+
+    @abstractmethod
+    def get(self, job_id):
+        """
+        Job dict assembled from fields and progress, None if job is not found or expired.
+        """
+
+    @abstractmethod
+    def get_field(self, job_id, name, default=None):
+        pass
+
+    @abstractmethod
+    def update(self, job_id, fields):
+        """
+        Set job fields, other fields are not affected.
+        """
+
+    @abstractmethod
+    def get_fields(self, job_id, prefix):
+        """
+        Dict of job fields with names starting with prefix, empty if job is not found.
+        """
+
+    @abstractmethod
+    def set_step(self, job_id, step, status, expected=None):
+        """
+        Atomically set step status, if expected is given only when current status equals expected.
+        :return: True if status was updated
+        """
+
+    @abstractmethod
+    def progress(self, job_id):
+        """
+        Ordered dict of steps statuses, None if job is not found.
+        """
+
+    @abstractmethod
+    def touch(self, job_id, name, interval):
+        """
+        Atomically set field to current time if it is older than interval seconds.
+        Used to throttle actions shared by all processes, i.e. upstream status checks.
+        :return: True if field was updated
+        """
+
+    @abstractmethod
+    def active_jobs(self, statuses, exclude=()):
+        """
+        Ids of not expired jobs having steps with any of statuses and no steps with exclude statuses.
+        """
+
+    @abstractmethod
+    def join_flight(self, key, timeout, exclude=()):
+        """
+        Atomically join the flight of key or become its leader if there is no live flight.
+        Flight is not live if leader didn't start a job within timeout seconds,
+        or its job is expired or has steps with any of exclude statuses.
+        :return: (True, None) for the leader, (False, job_id) otherwise, job_id is None until leader starts job
+        """
+
+    @abstractmethod
+    def start_flight(self, key, job_id):
+        """
+        Attach leader's job to the flight, flight lives while the job is not expired.
+        """
+
+    @abstractmethod
+    def end_flight(self, key, job_id=None):
+        """
+        Remove flight of the job, job_id None removes a flight which job was not started.
+        """
+
+    @abstractmethod
+    def cleanup(self):
+        """
+        Remove expired jobs, returns number of removed jobs.
+        """
+
+    def __contains__(self, job_id):
+        return self.progress(job_id) is not None
+
+
+class MemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs = {}
+        self._expiry = []  # Heap of (expires_at, job_id)
+        self._flights = {}  # key -> (job_id, leader timeout)
+        self._lock = threading.RLock()
+
+    def create(self, job_id, job, ttl):
+        job = json.loads(json.dumps(job))
+        job.setdefault(PROGRESS, {})
+        job.setdefault(TIMESTAMP, time.time())
+        # Jobs restored from the cache keep their original timestamp, ttl counts from now
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._jobs[job_id] = (job, expires_at)
+            heapq.heappush(self._expiry, (expires_at, job_id))
+
+    def _job(self, job_id):
+        entry = self._jobs.get(job_id)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._job(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def get_field(self, job_id, name, default=None):
+        with self._lock:
+            job = self._job(job_id)
+            return json.loads(json.dumps(job.get(name, default))) if job is not None else default
+
+    def update(self, job_id, fields):
+        with self._lock:
+            job = self._job(job_id)
+            if job is not None:
+                job.update(json.loads(json.dumps(fields)))
+
+    def get_fields(self, job_id, prefix):
+        with self._lock:
+            job = self._job(job_id) or {}
+            return json.loads(json.dumps({name: value for name, value in job.items() if name.startswith(prefix)}))
+
+    def set_step(self, job_id, step, status, expected=None):
+        with self._lock:
+            job = self._job(job_id)
+            if job is None or (expected is not None and job[PROGRESS].get(step) != expected):
+                return False
+            job[PROGRESS][step] = status
+            return True
+
+    def progress(self, job_id):
+        with self._lock:
+            job = self._job(job_id)
+            return dict(job[PROGRESS]) if job is not None else None
+
+    def touch(self, job_id, name, interval):
+        now = time.time()
+        with self._lock:
+            job = self._job(job_id)
+            if job is None or job.get(name, 0) > now - interval:
+                return False
+            job[name] = now
+            return True
+
+    def active_jobs(self, statuses, exclude=()):
+        with self._lock:
+            return [job_id for job_id in self._jobs if self._job(job_id) is not None and
+                    any(status in statuses for status in self._jobs[job_id][0][PROGRESS].values()) and
+                    not any(status in exclude for status in self._jobs[job_id][0][PROGRESS].values())]
+
+    def join_flight(self, key, timeout, exclude=()):
+        now = time.time()
+        with self._lock:
+            job_id, expires_at = self._flights.get(key, (None, 0))
+            if job_id is None and expires_at > now:
+                return False, None
+            job = self._job(job_id) if job_id is not None else None
+            if job is not None and not any(status in exclude for status in job[PROGRESS].values()):
+                return False, job_id
+            self._flights[key] = (None, now + timeout)
+            return True, None
+
+    def start_flight(self, key, job_id):
+        with self._lock:
+            self._flights[key] = (job_id, 0)
+
+    def end_flight(self, key, job_id=None):
+        with self._lock:
+            if self._flights.get(key, (None,))[0] == job_id:
+                self._flights.pop(key, None)
+
+    def cleanup(self):
+        removed = 0
+        now = time.time()
+        with self._lock:
+            for key, (job_id, expires_at) in list(self._flights.items()):
+                if (job_id is None and expires_at <= now) or (job_id is not None and self._job(job_id) is None):
+                    del self._flights[key]
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, job_id = heapq.heappop(self._expiry)
+                # Skip stale heap entries of recreated jobs
+                if job_id in self._jobs and self._jobs[job_id][1] == expires_at:
+                    del self._jobs[job_id]
+                    removed += 1
+        return removed
+
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs '
+                       '(job_id TEXT PRIMARY KEY, timestamp REAL NOT NULL, expires_at REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS job_fields '
+                       '(job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE, '
+                       'name TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (job_id, name))')
+            db.execute('CREATE TABLE IF NOT EXISTS job_steps '
+                       '(job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE, '
+                       'step TEXT NOT NULL, position INTEGER NOT NULL, status TEXT NOT NULL, '
+                       'PRIMARY KEY (job_id, step))')
+            db.execute('CREATE INDEX IF NOT EXISTS job_steps_status ON job_steps (status)')
+            # Key is unique, so only one process becomes a leader of the flight
+            db.execute('CREATE TABLE IF NOT EXISTS flights '
+                       '(key TEXT PRIMARY KEY, job_id TEXT REFERENCES jobs (job_id) ON DELETE CASCADE, '
+                       'expires_at REAL NOT NULL)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA foreign_keys=ON')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def create(self, job_id, job, ttl):
+        job = dict(job)
+        progress = job.pop(PROGRESS, {})
+        timestamp = job.pop(TIMESTAMP, time.time())
+        db = self._connection()
+        with db:
+            # Recreated job replaces the old one with all its fields and steps
+            db.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+            db.execute('INSERT INTO jobs (job_id, timestamp, expires_at) VALUES (?, ?, ?)',
+                       (job_id, timestamp, time.time() + ttl))
+            db.executemany('INSERT INTO job_fields (job_id, name, value) VALUES (?, ?, ?)',
+                           [(job_id, name, json.dumps(value)) for name, value in job.items()])
+            db.executemany('INSERT INTO job_steps (job_id, step, position, status) VALUES (?, ?, ?, ?)',
+                           [(job_id, step, i, status) for i, (step, status) in enumerate(progress.items())])
+
+    def _timestamp(self, db, job_id):
+        row = db.execute('SELECT timestamp FROM jobs WHERE job_id = ? AND expires_at > ?',
+                         (job_id, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, job_id):
+        db = self._connection()
+        # Single read transaction gives consistent snapshot of fields and steps
+        with db:
+            db.execute('BEGIN')
+            timestamp = self._timestamp(db, job_id)
+            if timestamp is None:
+                return None
+            job = {name: json.loads(value) for name, value in
+                   db.execute('SELECT name, value FROM job_fields WHERE job_id = ?', (job_id,))}
+            job[PROGRESS] = self._progress(db, job_id)
+            job[TIMESTAMP] = timestamp
+            return job
+
+    def get_field(self, job_id, name, default=None):
+        row = self._connection().execute(
+            'SELECT f.value FROM job_fields f JOIN jobs j ON f.job_id = j.job_id '
+            'WHERE f.job_id = ? AND f.name = ? AND j.expires_at > ?', (job_id, name, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def update(self, job_id, fields):
+        db = self._connection()
+        with db:
+            if self._timestamp(db, job_id) is None:
+                return
+            db.executemany('INSERT OR REPLACE INTO job_fields (job_id, name, value) VALUES (?, ?, ?)',
+                           [(job_id, name, json.dumps(value)) for name, value in fields.items()])
+
+    def get_fields(self, job_id, prefix):
+        return {name: json.loads(value) for name, value in self._connection().execute(
+            'SELECT f.name, f.value FROM job_fields f JOIN jobs j ON f.job_id = j.job_id '
+            'WHERE f.job_id = ? AND substr(f.name, 1, ?) = ? AND j.expires_at > ?',
+            (job_id, len(prefix), prefix, time.time())
+        )}
+
+    def set_step(self, job_id, step, status, expected=None):
+        db = self._connection()
+        with db:
+            if expected is None:
+                cursor = db.execute('UPDATE job_steps SET status = ? WHERE job_id = ? AND step = ?',
+                                    (status, job_id, step))
+            else:
+                cursor = db.execute('UPDATE job_steps SET status = ? WHERE job_id = ? AND step = ? AND status = ?',
+                                    (status, job_id, step, expected))
+            return cursor.rowcount > 0
+
+    def _progress(self, db, job_id):
+        return dict(db.execute('SELECT step, status FROM job_steps WHERE job_id = ? ORDER BY position',
+                               (job_id,)).fetchall())
+
+    def progress(self, job_id):
+        db = self._connection()
+        with db:
+            db.execute('BEGIN')
+            if self._timestamp(db, job_id) is None:
+                return None
+            return self._progress(db, job_id)
+
+    def touch(self, job_id, name, interval):
+        now = time.time()
+        db = self._connection()
+        with db:
+            if self._timestamp(db, job_id) is None:
+                return False
+            return db.execute(
+                'INSERT INTO job_fields (job_id, name, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (job_id, name) DO UPDATE SET value = excluded.value WHERE CAST(value AS REAL) <= ?',
+                (job_id, name, json.dumps(now), now - interval)
+            ).rowcount > 0
+
+    def active_jobs(self, statuses, exclude=()):
+        statuses, exclude = list(statuses), list(exclude)
+        return [job_id for job_id, in self._connection().execute(
+            f'SELECT DISTINCT s.job_id FROM job_steps s JOIN jobs j ON s.job_id = j.job_id '
+            f'WHERE s.status IN ({",".join("?" * len(statuses))}) AND j.expires_at > ? '
+            f'AND s.job_id NOT IN (SELECT job_id FROM job_steps WHERE status IN ({",".join("?" * len(exclude))}))',
+            [*statuses, time.time(), *exclude]
+        )]
+
+    def join_flight(self, key, timeout, exclude=()):
+        now = time.time()
+        exclude = list(exclude)
+        db = self._connection()
+        with db:
+            # Write lock is taken before select, so that only one caller becomes a leader
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT job_id, expires_at FROM flights WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                job_id, expires_at = row
+                if job_id is None and expires_at > now:
+                    return False, None
+                if job_id is not None and self._timestamp(db, job_id) is not None and db.execute(
+                        f'SELECT COUNT(*) FROM job_steps WHERE job_id = ? '
+                        f'AND status IN ({",".join("?" * len(exclude))})', [job_id, *exclude]
+                ).fetchone()[0] == 0:
+                    return False, job_id
+            db.execute('INSERT OR REPLACE INTO flights (key, job_id, expires_at) VALUES (?, NULL, ?)',
+                       (key, now + timeout))
+            return True, None
+
+    def start_flight(self, key, job_id):
+        db = self._connection()
+        with db:
+            # Flight of the job is removed with the job
+            db.execute('INSERT OR REPLACE INTO flights (key, job_id, expires_at) VALUES (?, ?, 0)', (key, job_id))
+
+    def end_flight(self, key, job_id=None):
+        db = self._connection()
+        with db:
+            db.execute('DELETE FROM flights WHERE key = ? AND job_id IS ?', (key, job_id))
+
+    def cleanup(self):
+        now = time.time()
+        db = self._connection()
+        with db:
+            db.execute('DELETE FROM flights WHERE job_id IS NULL AND expires_at <= ?', (now,))
+            return db.execute('DELETE FROM jobs WHERE expires_at <= ?', (now,)).rowcount
+
+
+def create_job_store(backend, path):
+    if backend == 'sqlite':
+        return SQLiteJobStore(path)
+    if backend == 'memory':
+        return MemoryJobStore()
+    raise ValueError(f'Unknown job store backend: {backend}')
@@ -0,0 +1,274 @@
+"""
+Minimal metrics registry rendered in Prometheus text exposition format.
+
+Counters, gauges and histograms with labels. Counters and gauges can be computed on scrape
+by a function, i.e. sizes of queues or counters shared between processes. Values are kept in process memory,
+counters and histograms of all processes are summed on scrape when registry is shared, see SharedSamples.
+"""
+
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from fast local calls to long upstream jobs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        """
+        :param fn: called on scrape, returns value or list of (labels dict, value)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        List of (suffix, labels, value), labels are tuples of (name, value).
+        """
+        if self.fn is not None:
+            value = self.fn()
+            if not isinstance(value, list):
+                return [('', (), value)]
+            return [('', self._key(labels), v) for labels, v in value]
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+    def render(self, samples=None):
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in samples if samples is not None else self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                # Buckets are cumulative already
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', key + (('le', _format_value(float(bound))),), count))
+                samples.append(('_sum', key, total))
+                samples.append(('_count', key, counts[-1]))
+        return samples
+
+
+_SUFFIX_ORDER = {'': 0, '_bucket': 0, '_sum': 1, '_count': 2}
+
+
+def _sample_order(sample):
+    # Samples of a label set together, buckets by bound, then sum and count
+    suffix, labels, _ = sample
+    le = dict(labels).get('le')
+    return ([(name, str(value)) for name, value in labels if name != 'le'], _SUFFIX_ORDER[suffix],
+            float(le) if le is not None else 0.0)
+
+
+class SharedSamples:
+    """
+    Samples of counters and histograms of all processes in SQLite, i.e. web workers and worker.py.
+    Each process writes its own cumulative values, scrape of any process returns their sums,
+    so that totals don't depend on the scraped process. Values of processes not updated
+    for max_age seconds are removed, it is seen as a counter reset.
+    """
+
+    def __init__(self, path, max_age=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        # Restarted process with the same pid starts from zero, it must not overwrite previous values
+        self.process = f'{socket.gethostname()}:{os.getpid()}:{time.time():.0f}'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS samples '
+                       '(process TEXT NOT NULL, name TEXT NOT NULL, suffix TEXT NOT NULL, labels TEXT NOT NULL, '
+                       'value REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (process, name, suffix, labels))')
+            db.execute('CREATE INDEX IF NOT EXISTS samples_name ON samples (name)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def write(self, samples):
+        """
+        :param samples: list of (name, suffix, labels, value) of this process
+        """
+        now = time.time()
+        db = self._connection()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO samples (process, name, suffix, labels, value, updated) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           [(self.process, name, suffix, json.dumps(labels), value, now)
+                            for name, suffix, labels, value in samples])
+            db.execute('DELETE FROM samples WHERE updated < ?', (now - self.max_age,))
+
+    def read(self, name):
+        """
+        Samples of the metric summed over processes, list of (suffix, labels, value).
+        """
+        rows = self._connection().execute(
+            'SELECT suffix, labels, SUM(value) FROM samples WHERE name = ? GROUP BY suffix, labels', (name,))
+        samples = [(suffix, tuple(tuple(label) for label in json.loads(labels)),
+                    int(value) if value.is_integer() else value)
+                   for suffix, labels, value in rows]
+        return sorted(samples, key=_sample_order)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.shared = None
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), fn=None):
+        return self._register(Counter(name, documentation, labelnames, fn))
+
+    def gauge(self, name, documentation, labelnames=(), fn=None):
+        return self._register(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def share(self, shared, interval=5):
+        """
+        Sum counters and histograms of all processes through SharedSamples,
+        values of this process are written on scrape and every interval seconds.
+        """
+        self.shared = shared
+
+        def write():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_shared()
+                except Exception as e:
+                    print(f"❌ Error writing shared metrics: {e}")
+
+        threading.Thread(target=write, daemon=True).start()
+
+    def _shared_metrics(self):
+        with self._lock:
+            # Gauges are values of a single process, computed ones are shared already
+            return [m for m in self._metrics.values() if m.fn is None and not isinstance(m, Gauge)]
+
+    def write_shared(self):
+        self.shared.write([(metric.name, suffix, labels, value) for metric in self._shared_metrics()
+                           for suffix, labels, value in metric.samples()])
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        shared = set()
+        if self.shared is not None:
+            self.write_shared()
+            shared = set(self._shared_metrics())
+        for metric in metrics:
+            try:
+                lines.extend(metric.render(self.shared.read(metric.name) if metric in shared else None))
+            except Exception as e:
+                # Failed scrape time gauge shouldn't break the whole endpoint
+                print(f"❌ Error collecting metric {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        Serve metrics over HTTP in a background thread, for processes without web server.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
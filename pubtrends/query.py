@@ -0,0 +1,60 @@
+"""
+Canonical form of search queries for cache keys and deduplication of searches.
+
+Queries differing only in Unicode representation, case, whitespace or punctuation
+get the same canonical form. Search operators (parentheses, exclusions, wildcards) are kept. Optionally stop words are dropped and tokens are sorted,
+so that bag-of-words searches with different order of terms share results.
+"""
+
+import re
+import unicodedata
+
+# Common English stop words, ignored by full text search
+STOP_WORDS = frozenset('''
+a an and are as at be by for from has have in into is it its of on or than that the their these this those
+to was were what which with within without
+'''.split())
+
+# Query with these tokens is not reordered, order matters for boolean expressions
+OPERATORS = frozenset(['or', 'not', '('])
+
+_TRANSLATION = str.maketrans({
+    **{c: '-' for c in '‐‑‒–—―−'},
+    **{c: "'" for c in '‘’‚‛′'},
+    **{c: '"' for c in '“”„‟″'},
+})
+
+# Words, connectors inside words are kept: il-6, covid-19, 5.4, cd4+
+_WORD = r"\w+(?:[-/.'+]\w+)*\+*"
+# Search operators are kept: parentheses, exclusion of words and phrases -mouse, wildcards immun*
+_TOKEN = re.compile(rf'-?"[^"]*"|[()]|-?{_WORD}\*?')
+_PHRASE_WORD = re.compile(_WORD)
+
+
+def tokenize_query(query):
+    """
+    Canonical tokens of the query, quoted phrases are single tokens.
+    """
+    query = unicodedata.normalize('NFKC', query).translate(_TRANSLATION).casefold()
+    tokens = []
+    for token in _TOKEN.findall(query):
+        if token.lstrip('-').startswith('"'):
+            exclude = '-' if token.startswith('-') else ''
+            phrase = ' '.join(_PHRASE_WORD.findall(token[len(exclude) + 1:-1]))
+            if phrase:
+                tokens.append(f'{exclude}"{phrase}"')
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def canonicalize_query(query, reorder=False):
+    """
+    Canonical form of the query.
+    :param reorder: drop stop words and sort tokens, for order insensitive searches
+    """
+    tokens = tokenize_query(query)
+    if reorder and not OPERATORS.intersection(tokens):
+        # Query consisting only of stop words is kept as is
+        tokens = sorted(set(t for t in tokens if t not in STOP_WORDS)) or tokens
+    return ' '.join(tokens)
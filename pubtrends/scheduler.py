@@ -0,0 +1,156 @@
+"""
+Admission control of search jobs shared between processes via SQLite.
+
+At most max_running jobs are admitted at a time, others wait in a queue bounded by max_queued.
+Waiting jobs are admitted by priority (lower value first), then fairly between clients:
+the client with fewer admitted jobs goes first, so a burst of one client does not block others,
+then in order of arrival.
+"""
+
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+
+
+def fair_order(queued, running_by_client):
+    """
+    Order in which queued jobs are admitted.
+    :param queued: list of (job_id, client, priority, enqueued)
+    :param running_by_client: dict client -> number of admitted jobs
+    :return: list of (job_id, client, priority, enqueued)
+    """
+    running = dict(running_by_client)
+    groups = {}
+    for job in sorted(queued, key=lambda j: j[3]):
+        groups.setdefault((job[1], job[2]), []).append(job)
+    heap = [(priority, running.get(client, 0), jobs[0][3], client, 0) for (client, priority), jobs in groups.items()]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        priority, count, enqueued, client, i = heapq.heappop(heap)
+        if count != running.get(client, 0):
+            # Client got a job admitted from another priority group since the entry was pushed
+            heapq.heappush(heap, (priority, running.get(client, 0), enqueued, client, i))
+            continue
+        jobs = groups[(client, priority)]
+        order.append(jobs[i])
+        running[client] = count + 1
+        if i + 1 < len(jobs):
+            heapq.heappush(heap, (priority, count + 1, jobs[i + 1][3], client, i + 1))
+    return order
+
+
+class JobScheduler:
+    def __init__(self, path, max_running=8, max_queued=100):
+        self.path = path
+        self.max_running = max_running
+        self.max_queued = max_queued
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS admissions '
+                       '(job_id TEXT PRIMARY KEY, client TEXT NOT NULL, priority INTEGER NOT NULL, '
+                       'state TEXT NOT NULL, enqueued REAL NOT NULL, admitted REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS admissions_state ON admissions (state)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit mode, transactions are started explicitly
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def _transaction(self, fn):
+        db = self._connection()
+        # Write lock is taken before reads, so that capacity checks are consistent between processes
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(db)
+            db.execute('COMMIT')
+            return result
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def enqueue(self, job_id, client, priority=0):
+        """
+        Put job to the queue.
+        :return: False if the queue is full
+        """
+        def enqueue(db):
+            queued, = db.execute('SELECT COUNT(*) FROM admissions WHERE state = ?', (STATE_QUEUED,)).fetchone()
+            if queued >= self.max_queued:
+                return False
+            db.execute('INSERT OR REPLACE INTO admissions (job_id, client, priority, state, enqueued) '
+                       'VALUES (?, ?, ?, ?, ?)', (job_id, client, priority, STATE_QUEUED, time.time()))
+            return True
+
+        return self._transaction(enqueue)
+
+    def _order(self, db):
+        queued = db.execute('SELECT job_id, client, priority, enqueued FROM admissions WHERE state = ?',
+                            (STATE_QUEUED,)).fetchall()
+        running = dict(db.execute('SELECT client, COUNT(*) FROM admissions WHERE state = ? GROUP BY client',
+                                  (STATE_RUNNING,)).fetchall())
+        return fair_order(queued, running), sum(running.values())
+
+    def admit(self):
+        """
+        Admit queued jobs while there are free slots.
+        :return: list of (job_id, seconds in queue) of admitted jobs
+        """
+        def admit(db):
+            order, running = self._order(db)
+            now = time.time()
+            # More jobs may be running than allowed, i.e. after restart with lower max_running
+            free = max(0, self.max_running - running)
+            admitted = [(job_id, now - enqueued) for job_id, _, _, enqueued in order[:free]]
+            db.executemany('UPDATE admissions SET state = ?, admitted = ? WHERE job_id = ?',
+                           [(STATE_RUNNING, now, job_id) for job_id, _ in admitted])
+            return admitted
+
+        return self._transaction(admit)
+
+    def position(self, job_id):
+        """
+        1-based position of the job in the queue, None if job is admitted or unknown.
+        """
+        db = self._connection()
+        row = db.execute('SELECT state FROM admissions WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None or row[0] != STATE_QUEUED:
+            return None
+        order, _ = self._order(db)
+        return next((i + 1 for i, job in enumerate(order) if job[0] == job_id), None)
+
+    def running_jobs(self):
+        return {job_id for job_id, in self._connection().execute(
+            'SELECT job_id FROM admissions WHERE state = ?', (STATE_RUNNING,))}
+
+    def retain(self, job_ids, before):
+        """
+        Release slots and queue places of jobs not in job_ids, i.e. finished, failed or expired.
+        Only jobs enqueued before the given time are released, newer ones could be missing in job_ids.
+        """
+        job_ids = set(job_ids)
+
+        def retain(db):
+            finished = [(job_id,) for job_id, in db.execute('SELECT job_id FROM admissions WHERE enqueued < ?',
+                                                           (before,)) if job_id not in job_ids]
+            db.executemany('DELETE FROM admissions WHERE job_id = ?', finished)
+            return len(finished)
+
+        return self._transaction(retain)
+
+    def counts(self):
+        """
+        Number of jobs in each state.
+        """
+        counts = dict(self._connection().execute('SELECT state, COUNT(*) FROM admissions GROUP BY state'))
+        return {state: counts.get(state, 0) for state in (STATE_QUEUED, STATE_RUNNING)}
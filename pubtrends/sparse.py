@@ -0,0 +1,123 @@
+"""
+Serialization of CSR matrices, e.g. corpus_counts.
+
+JSON form keeps data / indices / indptr / shape / dtype, optionally compressed
+with delta (per row indices) + varint encoding. Binary form is written by pubtrends/binary.py.
+"""
+
+import base64
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def index_dtype(n):
+    """
+    Smallest index dtype for values up to n, int32 for all practical corpora.
+    Indices are bounded by the matrix dimensions, indptr by the number of nonzeros.
+    """
+    return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+
+def varint_encode(values):
+    """
+    Encode non-negative integers as LEB128 varints.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1 << (7 * k))
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for k in range(int(nbytes.max()) if len(values) else 0):
+        mask = nbytes > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (nbytes[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = (chunk | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def varint_decode(buf):
+    """
+    Decode LEB128 varints to uint64 array.
+    """
+    b = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    nbytes = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(nbytes.max()) if len(ends) else 0):
+        mask = nbytes > k
+        values[mask] |= (b[starts[mask] + k] & 0x7f).astype(np.uint64) << np.uint64(7 * k)
+    return values
+
+
+def _b64(buf):
+    return base64.b64encode(buf).decode('ascii')
+
+
+def csr_to_json(matrix, compress=False):
+    """
+    Convert CSR matrix to JSON-serializable dict.
+    :param compress: delta+varint encode indices, row lengths and integer data, base64 wrapped
+    """
+    matrix = csr_matrix(matrix)
+    matrix.sort_indices()
+    result = dict(format='csr', shape=list(matrix.shape), dtype=matrix.dtype.str)
+    if not compress:
+        result.update(
+            data=matrix.data.tolist(),
+            indices=matrix.indices.tolist(),
+            indptr=matrix.indptr.tolist(),
+        )
+        return result
+    row_lengths = np.diff(matrix.indptr)
+    row_starts = matrix.indptr[:-1][row_lengths > 0]
+    # Indices are sorted within each row, store first index of a row and non-negative deltas
+    deltas = np.diff(matrix.indices.astype(np.int64), prepend=0)
+    deltas[row_starts] = matrix.indices[row_starts]
+    result.update(
+        compression='delta-varint',
+        indices=_b64(varint_encode(deltas)),
+        indptr=_b64(varint_encode(row_lengths)),
+    )
+    if matrix.dtype.kind in 'iu' and (matrix.data >= 0).all():
+        result.update(data=_b64(varint_encode(matrix.data)), data_encoding='varint')
+    else:
+        result.update(data=_b64(matrix.data.tobytes()), data_encoding='raw')
+    return result
+
+
+def csr_from_json(fields):
+    """
+    Restore CSR matrix from dict, see csr_to_json.
+    Legacy format (data with nonzero() rows and columns) is supported.
+    """
+    if 'shape' not in fields:
+        # Legacy format, shape is inferred and trailing empty rows / columns are lost
+        return csr_matrix((fields['data'], (fields['indices'], fields['indptr'])))
+    shape = tuple(fields['shape'])
+    dtype = np.dtype(fields['dtype'])
+    if fields.get('compression') != 'delta-varint':
+        data = np.array(fields['data'], dtype=dtype)
+        indices_dtype = index_dtype(max(*shape, len(data)))
+        return csr_matrix((data,
+                           np.array(fields['indices'], dtype=indices_dtype),
+                           np.array(fields['indptr'], dtype=indices_dtype)), shape=shape)
+    row_lengths = varint_decode(base64.b64decode(fields['indptr'])).astype(np.int64)
+    indptr = np.concatenate([[0], np.cumsum(row_lengths)])
+    indices_dtype = index_dtype(max(*shape, int(indptr[-1])))
+    deltas = varint_decode(base64.b64decode(fields['indices'])).astype(np.int64)
+    # Restart cumulative sum at the beginning of each row
+    nonempty = row_lengths > 0
+    cumulative = np.cumsum(deltas)
+    row_starts = indptr[:-1][nonempty]
+    indices = cumulative - np.repeat(cumulative[row_starts] - deltas[row_starts], row_lengths[nonempty])
+    data = base64.b64decode(fields['data'])
+    if fields['data_encoding'] == 'varint':
+        data = varint_decode(data).astype(dtype)
+    else:
+        data = np.frombuffer(data, dtype=dtype).copy()
+    return csr_matrix((data, indices.astype(indices_dtype), indptr.astype(indices_dtype)), shape=shape)
+
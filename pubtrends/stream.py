@@ -0,0 +1,208 @@
+"""
+Streaming ingestion of PubTrends get_result_api responses.
+
+The response body is read in chunks and split into top-level fields without
+materializing the whole body; big fields are spilled to temporary files
+and decoded only when accessed, see LazyAnalysisData.
+"""
+
+import json
+import mmap
+import re
+import tempfile
+
+from pubtrends.binary import BINARY_MIME_TYPE, is_binary
+from pubtrends.csr_graph import CSRGraph
+from pubtrends.data import LazyAnalysisData, decode_json_field, FIELDS
+
+# Fields bigger than this are kept in temporary files until decoded
+SPILL_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+_STRUCTURAL = re.compile(rb'[\[\]{}",:]')
+# Body of a JSON string up to closing quote, escaped characters included
+_STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*')
+
+_QUOTE, _BACKSLASH, _COLON, _COMMA = b'"', b'\\', b':', b','
+
+
+class JsonObjectSplitter:
+    """
+    Incrementally split a top-level JSON object into raw key / value byte segments.
+    Calls on_key(key) when value starts, on_data(bytes) for value parts and on_end() when value is complete.
+    """
+
+    def __init__(self, on_key, on_data, on_end):
+        self.on_key = on_key
+        self.on_data = on_data
+        self.on_end = on_end
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.capture = None  # None, 'key' or 'value'
+        self.key = bytearray()
+
+    def feed(self, chunk):
+        i, n = 0, len(chunk)
+        start = 0  # Start of captured segment in this chunk
+        while i < n:
+            if self.escape:
+                self.escape = False
+                i += 1
+                continue
+            if self.in_string:
+                i = _STRING_BODY.match(chunk, i).end()
+                if i == n:
+                    break
+                if chunk[i:i + 1] == _BACKSLASH:
+                    # Escape sequence is split between chunks
+                    self.escape = True
+                    i += 1
+                    continue
+                self.in_string = False
+                if self.capture == 'key':
+                    self.key += chunk[start:i]
+                    self.capture = None
+                    self.on_key(json.loads(b'"' + bytes(self.key) + b'"'))
+                i += 1
+                continue
+            m = _STRUCTURAL.search(chunk, i)
+            if m is None:
+                break
+            j = m.start()
+            c = chunk[j:j + 1]
+            i = j + 1
+            if c == _QUOTE:
+                self.in_string = True
+                if self.depth == 1 and self.capture is None:
+                    self.capture = 'key'
+                    self.key = bytearray()
+                    start = i
+            elif c in (b'[', b'{'):
+                self.depth += 1
+            elif c == _COLON:
+                if self.depth == 1 and self.capture is None:
+                    self.capture = 'value'
+                    start = i
+            else:  # One of ',', ']' or '}'
+                if self.depth == 1 and self.capture == 'value':
+                    self.on_data(chunk[start:j])
+                    self.on_end()
+                    self.capture = None
+                if c != _COMMA:
+                    self.depth -= 1
+        # Flush partially captured segment
+        if self.capture == 'value' and start < n:
+            self.on_data(chunk[start:])
+        elif self.capture == 'key':
+            self.key += chunk[start:]
+
+
+class SpilledField:
+    """
+    Raw JSON value of a field stored in a temporary file, removed once the object is collected.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def load(self):
+        self.file.seek(0)
+        return json.loads(self.file.read())
+
+
+class _FieldsCollector:
+    def __init__(self, keep, spill_threshold):
+        self.keep = keep
+        self.spill_threshold = spill_threshold
+        self.fields = {}
+        self.key = None
+        self.buffer = None
+        self.file = None
+
+    def on_key(self, key):
+        self.key = key
+        self.buffer = bytearray() if self.keep is None or key in self.keep else None
+        self.file = None
+
+    def on_data(self, data):
+        if self.file is not None:
+            self.file.write(data)
+        elif self.buffer is not None:
+            self.buffer += data
+            if len(self.buffer) > self.spill_threshold:
+                self.file = tempfile.TemporaryFile()
+                self.file.write(self.buffer)
+                self.buffer = None
+
+    def on_end(self):
+        if self.file is not None:
+            self.fields[self.key] = SpilledField(self.file)
+        elif self.buffer is not None:
+            self.fields[self.key] = json.loads(self.buffer)
+        self.key = self.buffer = self.file = None
+
+
+def _decode_streamed_field(name, raw):
+    if isinstance(raw, SpilledField):
+        raw = raw.load()
+    return decode_json_field(name, raw)
+
+
+def _decode_streamed_adjacency(raw):
+    if isinstance(raw, SpilledField):
+        raw = raw.load()
+    return CSRGraph.from_node_link(raw)
+
+
+def read_json_fields(chunks, keep=None, spill_threshold=SPILL_THRESHOLD):
+    """
+    Read top-level JSON object from byte chunks.
+    :param keep: names of fields to keep, other fields are skipped without buffering
+    :return: dict of parsed values or SpilledField for big values
+    """
+    collector = _FieldsCollector(set(keep) if keep is not None else None, spill_threshold)
+    splitter = JsonObjectSplitter(collector.on_key, collector.on_data, collector.on_end)
+    for chunk in chunks:
+        splitter.feed(chunk)
+    if splitter.depth != 0 or splitter.in_string:
+        raise ValueError('Truncated JSON object')
+    return collector.fields
+
+
+def read_analysis_data(response, keep=None, spill_threshold=SPILL_THRESHOLD, observe=None):
+    """
+    Read LazyAnalysisData from streamed get_result_api response (requests with stream=True).
+    Binary responses are spooled to a temporary file and memory mapped,
+    JSON responses are split into fields, see read_json_fields.
+    :param keep: names of fields to keep, others are released
+    :param observe: called with format ('binary' or 'json'), field name and decode time in seconds
+    """
+    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+    content_type = response.headers.get('Content-Type', '')
+    first = next(chunks, b'')
+    if content_type.startswith(BINARY_MIME_TYPE) or is_binary(first):
+        file = tempfile.TemporaryFile()
+        file.write(first)
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        file.close()  # Mapping stays valid after file is closed
+        data = LazyAnalysisData.from_binary(buf,
+                                            observe=observe and (lambda name, seconds: observe('binary', name, seconds)))
+    else:
+        fields = read_json_fields(_prepend(first, chunks), keep=keep, spill_threshold=spill_threshold)
+        missing = [f for f in FIELDS if f not in fields and (keep is None or f in keep)]
+        if missing:
+            raise ValueError(f'Missing fields in response: {missing}')
+        data = LazyAnalysisData(fields, _decode_streamed_field, _decode_streamed_adjacency,
+                                observe and (lambda name, seconds: observe('json', name, seconds)))
+    if keep is not None:
+        data.release(*(f for f in FIELDS if f not in keep))
+    return data
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
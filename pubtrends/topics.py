@@ -1,7 +1,11 @@
+import hashlib
+import threading
+from collections import OrderedDict
 from itertools import chain
 
 import numpy as np
 from nltk import FreqDist
+from scipy.sparse import csr_matrix
 
 
 def get_topics_description(df, corpus, corpus_tokens, corpus_counts, n_words, ignore_comp=None):
@@ -27,7 +31,7 @@ def get_topics_description(df, corpus, corpus_tokens, corpus_counts, n_words, ig
                     ignore_comp: []}
 
     # Pass paper indices (for corpus_tokens and corpus_counts) instead of paper ids
-    comps_ids = {comp: list(np.flatnonzero(df['id'].isin(comp_pids))) for comp, comp_pids in comps.items()}
+    comps_ids = df.groupby('comp').indices
     result = _get_topics_description_cosine(comps_ids, corpus_tokens, corpus_counts, n_words, ignore_comp=ignore_comp)
     kwds = [(comp, ','.join([f'{t}:{v:.3f}' for t, v in vs])) for comp, vs in result.items()]
     print('Description\n' + '\n'.join(f'{comp}: {kwd}' for comp, kwd in kwds))
@@ -35,6 +39,67 @@ def get_topics_description(df, corpus, corpus_tokens, corpus_counts, n_words, ig
     return result
 
 
+def topics_description_fingerprint(df, corpus, corpus_tokens, corpus_counts, n_words, ignore_comp=None):
+    """
+    Digest of everything get_topics_description result depends on.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((n_words, ignore_comp, corpus_counts.shape, str(corpus_counts.dtype))).encode('utf-8'))
+    h.update('\0'.join(map(str, df['id'])).encode('utf-8'))
+    h.update(np.ascontiguousarray(df['comp'].values).tobytes())
+    for array in (corpus_counts.data, corpus_counts.indices, corpus_counts.indptr):
+        h.update(np.ascontiguousarray(array).tobytes())
+    h.update('\0'.join(corpus_tokens).encode('utf-8'))
+    # With less than 2 components description is computed from the corpus itself
+    if len(set(df['comp']) - {ignore_comp}) < 2:
+        for paper in corpus:
+            h.update('\1'.join('\0'.join(sentence) for sentence in paper).encode('utf-8'))
+            h.update(b'\2')
+    return h.hexdigest()
+
+
+class TopicsDescriptionCache:
+    """
+    Bounded LRU cache of get_topics_description results keyed by fingerprint of the inputs.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_topics_description(self, df, corpus, corpus_tokens, corpus_counts, n_words, ignore_comp=None):
+        """
+        Same as get_topics_description, callers get their own copy of the cached result.
+        """
+        key = topics_description_fingerprint(df, corpus, corpus_tokens, corpus_counts, n_words, ignore_comp)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                print(f'Topics description cache hit {key}')
+                return _copy_description(self._cache[key])
+            self.misses += 1
+        # Compute outside of lock, concurrent misses for the same key are harmless
+        result = get_topics_description(df, corpus, corpus_tokens, corpus_counts, n_words, ignore_comp)
+        with self._lock:
+            self._cache[key] = _copy_description(result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _copy_description(description):
+    # Words lists are the only mutable parts, (token, weight) pairs are tuples
+    return {comp: list(words) for comp, words in description.items()}
+
+
 def get_frequent_tokens(tokens, fraction=0.1, min_tokens=20):
     """
     Compute tokens weighted frequencies
@@ -54,31 +119,37 @@ def get_frequent_tokens(tokens, fraction=0.1, min_tokens=20):
 def _get_topics_description_cosine(comps, corpus_tokens, corpus_counts, n_words, ignore_comp=None):
     """
     Select words with the frequency vector that is the closest to the 'ideal' frequency vector
-    ([0, ..., 0, 1, 0, ..., 0]) in tokens of cosine distance
+    ([0, ..., 0, 1, 0, ..., 0]) in tokens of cosine distance.
+    Works in O(components x tokens) memory.
     """
     print('Compute average tokens counts per components')
     # Since some of the components may be skipped, use this dict for continuous indexes
     comp_idx = {c: i for i, c in enumerate(c for c in comps if c != ignore_comp)}
-    tokens_freqs_per_comp = np.zeros(shape=(len(comp_idx), corpus_counts.shape[1]), dtype=np.float32)
-    for comp, comp_ids in comps.items():
-        if comp != ignore_comp:  # Not ignored
-            tokens_freqs_per_comp[comp_idx[comp], :] = \
-                np.sum(corpus_counts[comp_ids, :], axis=0)
+    # Sparse components x papers indicator matrix, a single product sums token counts per component
+    rows = np.concatenate([np.full(len(comps[c]), i) for c, i in comp_idx.items()])
+    cols = np.concatenate([np.asarray(comps[c], dtype=np.int64) for c in comp_idx])
+    indicator = csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                           shape=(len(comp_idx), corpus_counts.shape[0]))
+    tokens_freqs_per_comp = (indicator @ corpus_counts).toarray().astype(np.float32, copy=False)
 
     # Calculate total number of occurrences for each word
     tokens_freqs_total = np.sum(tokens_freqs_per_comp, axis=0)
 
     # Normalize frequency vector for each word to have length of 1
-    tokens_freqs_norm = np.sqrt(np.diag(tokens_freqs_per_comp.T @ tokens_freqs_per_comp))
-    tokens_freqs_per_comp = tokens_freqs_per_comp / tokens_freqs_norm
+    tokens_freqs_norm = np.sqrt(np.einsum('ij,ij->j', tokens_freqs_per_comp, tokens_freqs_per_comp))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tokens_freqs_per_comp /= tokens_freqs_norm
 
     print('Take frequent tokens that have the most descriptive frequency vector for topics')
-    # Calculate cosine distance between the frequency vector and [0, ..., 0, 1, 0, ..., 0] for each cluster
-    cluster_mask = np.eye(len(comp_idx))
-    distance = tokens_freqs_per_comp.T @ cluster_mask
+    # Cosine distance between the normalized frequency vector and [0, ..., 0, 1, 0, ..., 0] for each cluster
+    # is the component of normalized vector itself.
     # Add some weight for more frequent tokens to get rid of extremely rare ones in the top
-    adjusted_distance = distance.T * np.log1p(tokens_freqs_total)
+    adjusted_distance = tokens_freqs_per_comp
+    adjusted_distance *= np.log1p(tokens_freqs_total)
+    # Tokens not present in any component are never selected
+    adjusted_distance[np.isnan(adjusted_distance)] = -np.inf
 
+    n_top = min(n_words, adjusted_distance.shape[1])
     result = {}
     for comp in comps.keys():
         if comp == ignore_comp:
@@ -86,7 +157,17 @@ def _get_topics_description_cosine(comps, corpus_tokens, corpus_counts, n_words,
             continue
 
         c = comp_idx[comp]  # Get the continuous index
-        cluster_tokens_idx = np.argsort(-adjusted_distance[c, :])[:n_words].tolist()
+        cluster_tokens_idx = _top_k(adjusted_distance[c, :], n_top)
         result[comp] = [(corpus_tokens[i], adjusted_distance[c, i]) for i in cluster_tokens_idx]
 
     return result
+
+
+def _top_k(values, k):
+    """
+    Indices of k largest values in descending order, without sorting the whole array.
+    """
+    if k <= 0:
+        return []
+    top = np.argpartition(-values, k - 1)[:k]
+    return top[np.argsort(-values[top])].tolist()
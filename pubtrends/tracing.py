@@ -0,0 +1,232 @@
+"""
+Per-job tracing: spans of pipeline stages and upstream calls, shared between processes via SQLite.
+
+Current job and parent span are kept in context variables, so spans of concurrent asyncio tasks
+are attributed to the right job and parent. Executor threads inherit context with ContextExecutor.
+Spans are written by a background thread, recording never blocks the event loop on SQLite.
+Traces are exported as waterfall rows or Chrome trace event format (chrome://tracing, Perfetto).
+"""
+
+import contextvars
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# (job_id, span_id) of the current span, span_id is None at the job root
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """
+    Thread pool running submitted calls in the context of the caller, i.e. current trace span.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class SpanStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS spans '
+                       '(span_id TEXT PRIMARY KEY, job_id TEXT NOT NULL, parent_id TEXT, name TEXT NOT NULL, '
+                       'start REAL NOT NULL, end REAL NOT NULL, process TEXT NOT NULL, attrs TEXT NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS spans_job_id ON spans (job_id, start)')
+            db.execute('CREATE INDEX IF NOT EXISTS spans_end ON spans (end)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def add(self, spans):
+        """
+        :param spans: list of dicts with span_id, job_id, parent_id, name, start, end, process and attrs
+        """
+        db = self._connection()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO spans '
+                           '(span_id, job_id, parent_id, name, start, end, process, attrs) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           [(s['span_id'], s['job_id'], s['parent_id'], s['name'], s['start'], s['end'],
+                             s['process'], json.dumps(s['attrs'])) for s in spans])
+
+    def spans(self, job_id):
+        """
+        Spans of the job ordered by start time.
+        """
+        return [dict(span_id=span_id, job_id=job_id, parent_id=parent_id, name=name, start=start, end=end,
+                     process=process, attrs=json.loads(attrs))
+                for span_id, parent_id, name, start, end, process, attrs in self._connection().execute(
+                    'SELECT span_id, parent_id, name, start, end, process, attrs FROM spans '
+                    'WHERE job_id = ? ORDER BY start', (job_id,))]
+
+    def cleanup(self, max_age):
+        """
+        Remove spans finished more than max_age seconds ago.
+        """
+        db = self._connection()
+        with db:
+            return db.execute('DELETE FROM spans WHERE end < ?', (time.time() - max_age,)).rowcount
+
+
+class Tracer:
+    def __init__(self, store, enabled=True, flush_interval=0.5):
+        self.store = store
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.process = f'{socket.gethostname()}:{os.getpid()}'
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def job(self, job_id):
+        """
+        Spans recorded within the block belong to the job.
+        """
+        token = _current.set((job_id, None))
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Record the block as a span of the current job, nested spans are its children.
+        Nothing is recorded outside of a job.
+        """
+        current = _current.get()
+        if current is None or not self.enabled:
+            yield
+            return
+        job_id, parent_id = current
+        span_id = os.urandom(8).hex()
+        token = _current.set((job_id, span_id))
+        start = time.time()
+        try:
+            yield
+        except BaseException as e:
+            attrs['error'] = repr(e)
+            raise
+        finally:
+            _current.reset(token)
+            self._add(span_id, job_id, parent_id, name, start, time.time(), attrs)
+
+    def record(self, name, seconds, job_id=None, end=None, **attrs):
+        """
+        Record already finished span, i.e. measured upstream call.
+        Span is a child of the current span, or a root span of the given job.
+        """
+        current = _current.get()
+        if not self.enabled or (job_id is None and current is None):
+            return
+        parent_id = None
+        if job_id is None:
+            job_id, parent_id = current
+        end = end if end is not None else time.time()
+        self._add(os.urandom(8).hex(), job_id, parent_id, name, end - seconds, end, attrs)
+
+    def _add(self, span_id, job_id, parent_id, name, start, end, attrs):
+        self._queue.put(dict(span_id=span_id, job_id=job_id, parent_id=parent_id, name=name, start=start, end=end,
+                             process=self.process, attrs=attrs))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write, daemon=True)
+                    self._writer.start()
+
+    def _write(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Error writing trace spans: {e}")
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if spans:
+            self.store.add(spans)
+
+    def spans(self, job_id):
+        self.flush()
+        return self.store.spans(job_id)
+
+
+def _tree_order(spans):
+    """
+    Spans in depth first order with children sorted by start time, returns list of (depth, span).
+    Spans with unknown parent, i.e. parent is still running, are roots.
+    """
+    ids = {s['span_id'] for s in spans}
+    children = {}
+    for s in spans:
+        parent_id = s['parent_id'] if s['parent_id'] in ids else None
+        children.setdefault(parent_id, []).append(s)
+    ordered = []
+    stack = [(0, s) for s in reversed(sorted(children.get(None, []), key=lambda s: s['start']))]
+    while stack:
+        depth, span = stack.pop()
+        ordered.append((depth, span))
+        stack.extend((depth + 1, s) for s in reversed(sorted(children.get(span['span_id'], []),
+                                                             key=lambda s: s['start'])))
+    return ordered
+
+
+def waterfall(spans):
+    """
+    Rows for waterfall view: span with depth, offset and width in percents of the trace duration.
+    """
+    if not spans:
+        return []
+    t0 = min(s['start'] for s in spans)
+    total = max(max(s['end'] for s in spans) - t0, 1e-6)
+    return [dict(span, depth=depth, offset=(span['start'] - t0) / total * 100,
+                 width=max((span['end'] - span['start']) / total * 100, 0.1),
+                 duration=span['end'] - span['start'], since_start=span['start'] - t0)
+            for depth, span in _tree_order(spans)]
+
+
+def to_chrome_trace(spans):
+    """
+    Trace in Chrome trace event format. Events of a thread must nest, so that concurrent spans
+    are spread over lanes (shown as threads), children are kept in their parent lane if possible.
+    """
+    lanes = []  # Stacks of open span ends
+    lane_of = {}
+    events = []
+    for span in sorted(spans, key=lambda s: (s['start'], -s['end'])):
+        first = lane_of.get(span['parent_id'], 0)
+        for lane in range(first, len(lanes) + 1):
+            if lane == len(lanes):
+                lanes.append([])
+            stack = lanes[lane]
+            while stack and stack[-1] <= span['start']:
+                stack.pop()
+            if not stack or span['end'] <= stack[-1]:
+                stack.append(span['end'])
+                lane_of[span['span_id']] = lane
+                break
+        events.append(dict(name=span['name'], cat='job', ph='X', pid=1, tid=lane_of[span['span_id']],
+                           ts=int(span['start'] * 1e6), dur=int((span['end'] - span['start']) * 1e6),
+                           args=dict(span['attrs'], process=span['process'])))
+    return dict(traceEvents=events, displayTimeUnit='ms')
@@ -0,0 +1,145 @@
+"""
+SQLite-backed work queue shared between web worker processes.
+
+Tasks are claimed atomically by a single consumer, claims expire after a lease timeout,
+so tasks of a crashed process are picked up by others, until max_attempts is reached. Local stand-in for a message broker.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+TASK_QUEUED = 'queued'
+TASK_RUNNING = 'running'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+
+
+class WorkQueue:
+    def __init__(self, path, lease_timeout=3600, max_attempts=2):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS tasks '
+                       '(id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, job_id TEXT NOT NULL, '
+                       'payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                       'claimed_by TEXT, claimed_at REAL, created REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)')
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id, kind)')
+            # Finished tasks are removed by age on every request, see cleanup
+            db.execute('CREATE INDEX IF NOT EXISTS tasks_created ON tasks (status, created)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit mode, transactions are started explicitly
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def enqueue(self, kind, job_id, payload=None):
+        """
+        Enqueue task unless the job already has a queued or running task of this kind.
+        :return: id of the new task, None if open task exists
+        """
+        db = self._connection()
+        # Write lock is taken before select, so that concurrent callers can't both enqueue
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            task_id = None
+            if db.execute('SELECT 1 FROM tasks WHERE kind = ? AND job_id = ? AND status IN (?, ?) LIMIT 1',
+                          (kind, job_id, TASK_QUEUED, TASK_RUNNING)).fetchone() is None:
+                task_id = db.execute(
+                    'INSERT INTO tasks (kind, job_id, payload, status, created) VALUES (?, ?, ?, ?, ?)',
+                    (kind, job_id, json.dumps(payload or {}), TASK_QUEUED, time.time())
+                ).lastrowid
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return task_id
+
+    def claim(self, worker_id):
+        """
+        Claim the oldest queued task or a task with expired lease.
+        :return: (id, kind, job_id, payload) or None if queue is empty
+        """
+        db = self._connection()
+        now = time.time()
+        # Write lock is taken before select, so that task can't be claimed twice
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT id, kind, job_id, payload FROM tasks WHERE status = ? '
+                'OR (status = ? AND claimed_at < ? AND attempts < ?) ORDER BY id LIMIT 1',
+                (TASK_QUEUED, TASK_RUNNING, now - self.lease_timeout, self.max_attempts)
+            ).fetchone()
+            if row is not None:
+                db.execute('UPDATE tasks SET status = ?, claimed_by = ?, claimed_at = ?, attempts = attempts + 1 '
+                           'WHERE id = ?', (TASK_RUNNING, worker_id, now, row[0]))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        task_id, kind, job_id, payload = row
+        return task_id, kind, job_id, json.loads(payload)
+
+    def fail_expired(self):
+        """
+        Mark tasks with expired lease and no attempts left as failed, they are never claimed again.
+        :return: list of (id, kind, job_id) of failed tasks
+        """
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            expired = db.execute(
+                'SELECT id, kind, job_id FROM tasks WHERE status = ? AND claimed_at < ? AND attempts >= ?',
+                (TASK_RUNNING, time.time() - self.lease_timeout, self.max_attempts)
+            ).fetchall()
+            db.executemany('UPDATE tasks SET status = ? WHERE id = ?', [(TASK_FAILED, row[0]) for row in expired])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return expired
+
+    def release(self, is_orphaned):
+        """
+        Return running tasks of consumers known to be gone to the queue without waiting for lease expiry.
+        :param is_orphaned: called with claimed_by of running tasks
+        :return: number of released tasks
+        """
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            orphaned = [(TASK_QUEUED, task_id) for task_id, claimed_by in db.execute(
+                'SELECT id, claimed_by FROM tasks WHERE status = ? AND attempts < ?',
+                (TASK_RUNNING, self.max_attempts)) if is_orphaned(claimed_by)]
+            db.executemany('UPDATE tasks SET status = ? WHERE id = ?', orphaned)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return len(orphaned)
+
+    def finish(self, task_id, status=TASK_DONE):
+        self._connection().execute('UPDATE tasks SET status = ? WHERE id = ?', (status, task_id))
+
+    def cleanup(self, max_age):
+        """
+        Remove finished tasks older than max_age seconds.
+        """
+        return self._connection().execute(
+            'DELETE FROM tasks WHERE status IN (?, ?) AND created < ?', (TASK_DONE, TASK_FAILED, time.time() - max_age)
+        ).rowcount
+
+    def size(self):
+        return self._connection().execute('SELECT COUNT(*) FROM tasks WHERE status = ?', (TASK_QUEUED,)).fetchone()[0]
@@ -0,0 +1,68 @@
+import hashlib
+import json
+from urllib.parse import quote
+
+from bokeh.embed import components
+
+from config import *
+from graph import plot_entities_graph, build_entities_graph, prune_entities_graph
+from sum_categories import prepare_entities_table
+
+ENTITIES_CATEGORIES = [
+    (GOOGLE_SUMMARIZE_CATEGORY_GENES, "genes_summaries"),
+    (GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES, "substances_summaries"),
+    (GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS, "conditions_summaries"),
+    (GOOGLE_SUMMARIZE_CATEGORY_PROTEINS, "proteins_summaries"),
+]
+
+
+def entities_graph_pruning():
+    return dict(
+        top_k=ENTITIES_GRAPH_TOP_K or None,
+        min_weight=ENTITIES_GRAPH_MIN_WEIGHT or None,
+        alpha=float(ENTITIES_GRAPH_DISPARITY_ALPHA) if ENTITIES_GRAPH_DISPARITY_ALPHA else None,
+    )
+
+
+def pubtrends_result_url(job):
+    return f"{PUBTRENDS_API}/result?query={quote(job['search_query'])}" \
+           f"&source=Pubmed&limit=1000&sort=Most+Cited&noreviews=on&min_year=&max_year=" \
+           f"&jobid={job.get(PUBTRENDS_JOB_ID) or job['job_id']}"
+
+
+def materialize_results(job):
+    """
+    Build results page artifacts once: entities tables, graphs components and topics summaries.
+    Stored in the job under RESULTS_PAGE as JSON serializable dict with template context and etag.
+    """
+    job_id = job['job_id']
+    query = job['search_query']
+    pubtrends_url = pubtrends_result_url(job)
+    summaries_storage = job[SUMMARIZE_STEP + "_RESULT"]
+    summaries = {}
+
+    for key, render_key in ENTITIES_CATEGORIES:
+        if key in summaries_storage:
+            summary = summaries_storage[key]
+            if summary is None:
+                continue
+            connections_by_pid, summarized_data = summary
+            summaries[render_key] = prepare_entities_table(connections_by_pid, summarized_data)
+
+            g = prune_entities_graph(build_entities_graph(connections_by_pid, summarized_data),
+                                     **entities_graph_pruning())
+            summaries[f"{render_key}_graph"] = components(plot_entities_graph(g, category=key))
+
+    if SUMMARY_TOPICS in summaries_storage:
+        # SUMMARY_TOPICS is already a list of tuples, None for topics which failed to summarize
+        summary = summaries_storage[SUMMARY_TOPICS]
+        if summary is not None:
+            summaries["topics_summaries"] = [topic for topic in summary if topic is not None]
+
+    context = dict(search_query=query, pubtrends_result=pubtrends_url, job_id=job_id, **summaries)
+    # Round trip through JSON, so that page restored from cache is identical to the fresh one
+    serialized = json.dumps(context, sort_keys=True)
+    return dict(
+        context=json.loads(serialized),
+        etag=hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]
+    )
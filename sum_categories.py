@@ -1,40 +1,48 @@
+import asyncio
 import json
 
 import numpy as np
 import pandas as pd
-import requests
-from tornado import concurrent
 
 from config import GOOGLE_SUMMARIZE_CATEGORY_GENES, GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES, \
     GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS, GOOGLE_SUMMARIZE_CATEGORY_PROTEINS, GOOGLE_SUMMARIZE_CATEGORIES_ENDPOINT
-
-
-def summarize_categories(ex, summaries_storage):
-    highly_connected_df, abstracts_json = preprocess_summarize_categories(ex)
-    futures = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            # System prompt enum (must match server-side allowed value), here are represented all types
-            for si_mode in [GOOGLE_SUMMARIZE_CATEGORY_GENES,
-                            GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES,
-                            GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS,
-                            GOOGLE_SUMMARIZE_CATEGORY_PROTEINS]:
-                # Submit all batches to the executor
-                futures.append(executor.submit(
-                    summarize_category_and_save,
-                    abstracts_json, highly_connected_df, si_mode, summaries_storage
-                ))
-    # Process results as they complete
-    for _ in concurrent.futures.as_completed(futures):
-        pass
-
-
-
-def summarize_category_and_save(abstracts_json, highly_connected_df, si_mode, summaries_storage):
-    summarized_data = summarize_entities(si_mode, abstracts_json)
+from tracing import tracer
+from upstream import async_http_client
+
+
+async def summarize_categories(ex, summaries_storage, publish=None):
+    """
+    :param publish: coroutine function called with part name and entities table of each category once it is ready
+    """
+    loop = asyncio.get_running_loop()
+    # Data preparation is CPU bound, it is executed outside of the event loop
+    with tracer.span('prepare categories abstracts'):
+        highly_connected_df, abstracts_json = await loop.run_in_executor(None, preprocess_summarize_categories, ex)
+    # System prompt enum (must match server-side allowed value), here are represented all types
+    await asyncio.gather(*(
+        summarize_category_and_save(abstracts_json, highly_connected_df, si_mode, summaries_storage, publish)
+        for si_mode in [GOOGLE_SUMMARIZE_CATEGORY_GENES,
+                        GOOGLE_SUMMARIZE_CATEGORY_SUBSTANCES,
+                        GOOGLE_SUMMARIZE_CATEGORY_CONDITIONS,
+                        GOOGLE_SUMMARIZE_CATEGORY_PROTEINS]
+    ))
+
+
+async def summarize_category_and_save(abstracts_json, highly_connected_df, si_mode, summaries_storage, publish=None):
+    with tracer.span('extract entities', si_mode=si_mode):
+        try:
+            summarized_data = await summarize_entities(si_mode, abstracts_json)
+        except Exception as e:
+            # Failed category is left out, others are still summarized
+            print(f"❌ Error summarizing category {si_mode}: {e}")
+            return
     if summarized_data is None:
         return
-    connections_by_pid = dict(zip(highly_connected_df['id'], highly_connected_df['connections']))
+    # Plain python values, summaries are stored as JSON
+    connections_by_pid = dict(zip(highly_connected_df['id'].tolist(), highly_connected_df['connections'].tolist()))
     summaries_storage[si_mode] = (connections_by_pid, summarized_data)
+    if publish is not None:
+        await publish(si_mode, prepare_entities_table(connections_by_pid, summarized_data))
 
 
 def preprocess_summarize_categories(ex):
@@ -43,7 +51,7 @@ def preprocess_summarize_categories(ex):
         filtered_df = ex.df[ex.df.comp == c]
         highly_connected_df = filter_by_connectivity(
             filtered_df,
-            ex.papers_graph,
+            ex.papers_adjacency,
             percentile=80,
             max_count=5
         )
@@ -56,12 +64,13 @@ def preprocess_summarize_categories(ex):
     return highly_connected_df, abstracts_json
 
 
-def summarize_entities(si_mode, abstracts_json):
+async def summarize_entities(si_mode, abstracts_json):
     print(f"Summarizing category {si_mode}...")
     # Make the POST request with abstracts and si_mode
-    response = requests.post(
+    response = await async_http_client.post(
         f"{GOOGLE_SUMMARIZE_CATEGORIES_ENDPOINT}?si_mode={si_mode}",
-        json=abstracts_json,
+        endpoint='summarize_categories',
+        json_body=abstracts_json,
         headers={"Content-Type": "application/json"}
     )
     # Handle response
@@ -73,8 +82,8 @@ def summarize_entities(si_mode, abstracts_json):
 
 
 def filter_by_connectivity(df, graph, percentile=75, max_count=None):
-    # Step 1: Compute connectivity (without modifying df)
-    connectivity = df['id'].apply(lambda pid: len(list(graph.neighbors(pid))))
+    # Step 1: Compute connectivity (without modifying df), graph is CSRGraph
+    connectivity = pd.Series(graph.degree(df['id']), index=df.index)
 
     # Step 2: Compute the percentile threshold
     threshold = np.percentile(connectivity, percentile)
@@ -93,6 +102,17 @@ def filter_by_connectivity(df, graph, percentile=75, max_count=None):
     return filtered_df
 
 
+def prepare_entities_table(connections_by_pid, summarized_data):
+    """
+    Rows of entities table, entities importance is the total number of connections of papers they are cited in.
+    """
+    for entity in summarized_data:
+        entity["total_connections"] = sum(
+            connections_by_pid.get(pid, 0) for pid in entity.get("cited_in", [])
+        )
+    return prepare_entities_summary(summarized_data)
+
+
 def prepare_entities_summary(entities):
     entities_summary = []
     for idx, entity in enumerate(sorted(entities, key=lambda g: g['total_connections'], reverse=True), start=1):
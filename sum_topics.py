@@ -1,57 +1,85 @@
+import asyncio
 import html
 import re
 
 import numpy as np
-import requests
-from tornado import concurrent
+import pandas as pd
 
 from config import GOOGLE_MODEL_SUMMARIZE_TOPIC_TITLE_ENDPOINT, GOOGLE_MODEL_SUMMARIZE_TOPIC_ENDPOINT, \
-    SUMMARY_TOPICS
-from pubtrends.topics import get_topics_description
+    SUMMARY_TOPICS, TOPICS_DESCRIPTION_CACHE_SIZE
+from pubtrends.topics import TopicsDescriptionCache
+from tracing import tracer
+from upstream import async_http_client
 
+# Retries and reruns of the same analysis reuse computed keywords
+topics_description_cache = TopicsDescriptionCache(max_size=TOPICS_DESCRIPTION_CACHE_SIZE)
 
-def summarize_topics(data, summaries_storage):
-    connectivity_percentile_thr, preferred_count_per_topic, pubmed_cluster_names, topics_keywords = \
-        preprocess_summarize_topics(data)
+
+# Maximum number of topics summarized concurrently for a single job
+MAX_CONCURRENT_TOPICS = 10
+
+
+async def summarize_topics(data, summaries_storage, publish=None):
+    """
+    :param publish: coroutine function called with part name and value for topics keywords and each topic summary
+    """
+    loop = asyncio.get_running_loop()
+    # Keywords extraction is CPU bound, it is executed outside of the event loop
+    with tracer.span('topics keywords'):
+        connectivity_percentile_thr, preferred_count_per_topic, pubmed_cluster_names, topics_keywords = \
+            await loop.run_in_executor(None, preprocess_summarize_topics, data)
     summaries = [None] * len(pubmed_cluster_names)
     summaries_storage[SUMMARY_TOPICS] = summaries
-    futures = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for i, topic_name in enumerate(pubmed_cluster_names):
-            # Submit all batches to the executor
-            futures.append(executor.submit(
-                summarize_topic_and_save,
-                data, connectivity_percentile_thr, preferred_count_per_topic, topic_name, topics_keywords,
-                summaries, i
-            ))
-    # Process results as they complete
-    for _ in concurrent.futures.as_completed(futures):
-        pass
-
-
-def summarize_topic_and_save(
-        data, connectivity_percentile_thr, preferred_count_per_topic, topic_name, topics_keywords, summaries, i):
+    if publish is not None:
+        # Keywords are shown while topics are summarized
+        await publish('topics_keywords', {int(topic_name) + 1: [k for k, v in topics_keywords[topic_name]]
+                                          for topic_name in pubmed_cluster_names})
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TOPICS)
+
+    async def summarize_with_limit(i, topic_name):
+        async with semaphore:
+            with tracer.span('topic', topic=int(topic_name) + 1):
+                try:
+                    await summarize_topic_and_save(
+                        data, connectivity_percentile_thr, preferred_count_per_topic, topic_name, topics_keywords,
+                        summaries, i, publish
+                    )
+                except Exception as e:
+                    # Failed topic is left out, others are still summarized
+                    print(f"❌ Error summarizing topic {int(topic_name) + 1}: {e}")
+
+    await asyncio.gather(*(summarize_with_limit(i, topic_name) for i, topic_name in enumerate(pubmed_cluster_names)))
+
+
+async def summarize_topic_and_save(
+        data, connectivity_percentile_thr, preferred_count_per_topic, topic_name, topics_keywords, summaries, i,
+        publish=None):
     keyword_based_title, name, summary = \
-        summarize_topic(connectivity_percentile_thr, data,
-                        preferred_count_per_topic, topic_name, topics_keywords)
+        await summarize_topic(connectivity_percentile_thr, data,
+                              preferred_count_per_topic, topic_name, topics_keywords)
     summaries[i] = (name, keyword_based_title, convert_to_html(summary))
+    if publish is not None:
+        await publish(f'topic:{name}', summaries[i])
     print(f"✅{name} Topic Summaries Extracted")
 
 
-def summarize_topic(connectivity_percentile_thr, data, preferred_count_per_topic, topic_name, topics_keywords):
+async def summarize_topic(connectivity_percentile_thr, data, preferred_count_per_topic, topic_name, topics_keywords):
     print(f"Processing topic {topic_name}")
-    topic_data = prepare_abstracts_for_topic(
-        data, topic_name,
-        connectivity_percentile_thr=connectivity_percentile_thr,
-        preferred_count_per_topic=preferred_count_per_topic
-    )
-    summary = prompt_summarize_abstracts(topic_data)
+    with tracer.span('prepare topic abstracts'):
+        topic_data = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: prepare_abstracts_for_topic(
+                data, topic_name,
+                connectivity_percentile_thr=connectivity_percentile_thr,
+                preferred_count_per_topic=preferred_count_per_topic
+            )
+        )
+    summary = await prompt_summarize_abstracts(topic_data)
     if summary:
         topic_summary_data = {
             "summary": summary,
             "topics_keywords": [k for k, v in topics_keywords[topic_name]],
         }
-        keyword_based_title = prompt_assign_title_to_summary(topic_summary_data)
+        keyword_based_title = await prompt_assign_title_to_summary(topic_summary_data)
     else:
         keyword_based_title = ""
     # Render per topic
@@ -64,7 +92,7 @@ def preprocess_summarize_topics(data):
     preferred_count_per_topic = 50
     connectivity_percentile_thr = 50
     pubmed_cluster_names = sorted(data.df.comp.unique())
-    topics_keywords = get_topics_description(
+    topics_keywords = topics_description_cache.get_topics_description(
         data.df,
         data.corpus, data.corpus_tokens, data.corpus_counts,
         n_words=topic_description_words
@@ -77,7 +105,7 @@ def prepare_abstracts_for_topic(data, topic_name, *, preferred_count_per_topic,
 
     highly_connected_df = filter_by_connectivity(
         filtered_df,
-        data.papers_graph,
+        data.papers_adjacency,
         percentile=connectivity_percentile_thr,
         preferred_count=preferred_count_per_topic
     )
@@ -94,8 +122,8 @@ def prepare_abstracts_for_topic(data, topic_name, *, preferred_count_per_topic,
 
 
 def filter_by_connectivity(df, graph, percentile=75, preferred_count=None):
-    # Step 1: Compute connectivity (without modifying df)
-    connectivity = df['id'].apply(lambda pid: len(list(graph.neighbors(pid))))
+    # Step 1: Compute connectivity (without modifying df), graph is CSRGraph
+    connectivity = pd.Series(graph.degree(df['id']), index=df.index)
 
     # Step 2: Compute the percentile threshold
     if len(df) <= preferred_count:
@@ -124,10 +152,11 @@ def filter_by_connectivity(df, graph, percentile=75, preferred_count=None):
     return filtered_df
 
 
-def prompt_summarize_abstracts(topic_data):
-    response = requests.post(
+async def prompt_summarize_abstracts(topic_data):
+    response = await async_http_client.post(
         f"{GOOGLE_MODEL_SUMMARIZE_TOPIC_TITLE_ENDPOINT}",
-        json=topic_data,  # XXX Pass Python object here, not dump
+        endpoint='summarize_topic',
+        json_body=topic_data,  # XXX Pass Python object here, not dump
         # json=json.dumps(topic_data, ensure_ascii=False, indent=2),
         headers={"Content-Type": "application/json"}
     )
@@ -146,10 +175,11 @@ def prompt_summarize_abstracts(topic_data):
     return ""
 
 
-def prompt_assign_title_to_summary(topic_summary_data):
-    response = requests.post(
+async def prompt_assign_title_to_summary(topic_summary_data):
+    response = await async_http_client.post(
         f"{GOOGLE_MODEL_SUMMARIZE_TOPIC_ENDPOINT}",
-        json=topic_summary_data,
+        endpoint='summarize_topic_title',
+        json_body=topic_summary_data,
         headers={"Content-Type": "application/json"}
     )
 
@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from pubtrends.jobs import MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def job_store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite'))
+
+
+def test_create_and_get(job_store):
+    job_store.create('job', dict(search_query='q', progress={'a': 'pending'}), ttl=60)
+    job = job_store.get('job')
+    assert job['search_query'] == 'q'
+    assert job['progress'] == {'a': 'pending'}
+
+
+def test_job_expires_after_ttl(job_store):
+    job_store.create('job', dict(search_query='q'), ttl=0.1)
+    time.sleep(0.2)
+    assert job_store.get('job') is None
+
+
+def test_job_restored_from_old_cache_entry_is_not_expired(job_store):
+    cached = dict(search_query='q', progress={'a': 'complete'}, timestamp=time.time() - 7 * 24 * 3600)
+    job_store.create('job', cached, ttl=24 * 3600)
+    job = job_store.get('job')
+    assert job is not None
+    assert job['timestamp'] == cached['timestamp']
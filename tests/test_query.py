@@ -0,0 +1,34 @@
+import pytest
+
+from pubtrends.query import canonicalize_query
+
+
+@pytest.mark.parametrize('first, second', [
+    ('IL-6 signalling', 'il‑6   Signalling'),
+    ('“stem cells”', '"Stem  Cells"'),
+    ('cancer, therapy.', 'cancer therapy'),
+])
+def test_equivalent_queries_share_key(first, second):
+    assert canonicalize_query(first) == canonicalize_query(second)
+
+
+@pytest.mark.parametrize('first, second', [
+    ('(a OR b) AND c', 'a OR (b AND c)'),
+    ('cancer -mouse', 'cancer mouse'),
+    ('cancer -"mouse model"', 'cancer "mouse model"'),
+    ('immun*', 'immun'),
+    ('cancer-mouse', 'cancer -mouse'),
+])
+@pytest.mark.parametrize('reorder', [False, True])
+def test_operators_are_kept(first, second, reorder):
+    assert canonicalize_query(first, reorder) != canonicalize_query(second, reorder)
+
+
+def test_reorder():
+    assert canonicalize_query('therapy of the cancer', reorder=True) == canonicalize_query('cancer therapy', reorder=True)
+    assert canonicalize_query('cancer -mouse', reorder=True) == canonicalize_query('-mouse cancer', reorder=True)
+
+
+def test_reorder_keeps_boolean_expressions():
+    assert canonicalize_query('(a OR b) c', reorder=True) == '( a or b ) c'
+    assert canonicalize_query('b OR a', reorder=True) == 'b or a'
@@ -0,0 +1,63 @@
+import pytest
+
+from pubtrends.scheduler import JobScheduler, fair_order
+
+
+def ids(order):
+    return [job[0] for job in order]
+
+
+def test_fair_order_by_priority_then_arrival():
+    queued = [('late', 'a', 0, 3.0), ('background', 'b', 10, 1.0), ('early', 'c', 0, 2.0)]
+    assert ids(fair_order(queued, {})) == ['early', 'late', 'background']
+
+
+def test_fair_order_interleaves_clients():
+    queued = [(f'a{i}', 'a', 0, float(i)) for i in range(3)] + [('b0', 'b', 0, 10.0), ('b1', 'b', 0, 11.0)]
+    assert ids(fair_order(queued, {})) == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_fair_order_accounts_running_jobs():
+    queued = [('a0', 'a', 0, 1.0), ('b0', 'b', 0, 2.0)]
+    assert ids(fair_order(queued, {'a': 2})) == ['b0', 'a0']
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return JobScheduler(str(tmp_path / 'scheduler.sqlite'), max_running=2, max_queued=3)
+
+
+def test_admit_up_to_max_running(scheduler):
+    for i in range(3):
+        assert scheduler.enqueue(f'j{i}', 'client')
+    assert [job_id for job_id, _ in scheduler.admit()] == ['j0', 'j1']
+    assert scheduler.admit() == []
+    assert scheduler.position('j2') == 1
+    assert scheduler.counts() == {'queued': 1, 'running': 2}
+
+
+def test_enqueue_rejected_when_queue_is_full(scheduler):
+    assert all(scheduler.enqueue(f'j{i}', 'client') for i in range(3))
+    assert not scheduler.enqueue('j3', 'client')
+
+
+def test_admit_nothing_when_over_capacity(tmp_path):
+    path = str(tmp_path / 'scheduler.sqlite')
+    previous = JobScheduler(path, max_running=4, max_queued=10)
+    for i in range(4):
+        previous.enqueue(f'running{i}', 'client')
+    previous.admit()
+    # Restarted with lower limit
+    scheduler = JobScheduler(path, max_running=2, max_queued=10)
+    for i in range(3):
+        scheduler.enqueue(f'queued{i}', 'client')
+    assert scheduler.admit() == []
+    assert scheduler.counts() == {'queued': 3, 'running': 4}
+
+
+def test_retain_releases_finished_jobs(scheduler):
+    for i in range(3):
+        scheduler.enqueue(f'j{i}', 'client')
+    scheduler.admit()
+    assert scheduler.retain(['j1', 'j2'], before=float('inf')) == 1
+    assert [job_id for job_id, _ in scheduler.admit()] == ['j2']
@@ -0,0 +1,125 @@
+import json
+import mmap
+import tempfile
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from pubtrends.binary import _Writer, _decode_csr, _encode_csr
+from pubtrends.sparse import csr_from_json, csr_to_json
+from pubtrends.stream import JsonObjectSplitter, SpilledField, read_json_fields
+
+DOCUMENT = {
+    'query': 'say "hi" \\ there',
+    'escaped': 'tab\t newline\n unicode é quote\\" end',
+    'nested': {'a': [1, 2, {'b': 'x,y:z'}], 'c': '}]'},
+    'numbers': [1.5, -2, 3e10],
+    'empty': '',
+    'null': None,
+}
+
+
+def split(raw, size):
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def parse_values(fields):
+    return {k: v.load() if isinstance(v, SpilledField) else v for k, v in fields.items()}
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 10 ** 6])
+def test_chunk_boundaries(size):
+    raw = json.dumps(DOCUMENT).encode('utf-8')
+    assert read_json_fields(split(raw, size)) == DOCUMENT
+
+
+def test_escape_split_between_chunks():
+    raw = json.dumps({'k': 'a\\"b', 'l': 1}).encode('utf-8')
+    for i in range(len(raw)):
+        # Every split point, including right after a backslash
+        assert read_json_fields([raw[:i], raw[i:]]) == {'k': 'a\\"b', 'l': 1}
+
+
+def test_escaped_quote_in_key():
+    raw = json.dumps({'a"b': 1, 'c\\': 2}).encode('utf-8')
+    assert read_json_fields(split(raw, 1)) == {'a"b': 1, 'c\\': 2}
+
+
+def test_keep_skips_other_fields():
+    raw = json.dumps(DOCUMENT).encode('utf-8')
+    assert read_json_fields(split(raw, 3), keep=['nested', 'null']) == {'nested': DOCUMENT['nested'], 'null': None}
+
+
+def test_big_fields_are_spilled():
+    raw = json.dumps(DOCUMENT).encode('utf-8')
+    fields = read_json_fields(split(raw, 4), spill_threshold=8)
+    assert isinstance(fields['escaped'], SpilledField)
+    assert parse_values(fields) == DOCUMENT
+
+
+@pytest.mark.parametrize('cut', [1, 10, -2])
+def test_truncated_input(cut):
+    raw = json.dumps(DOCUMENT).encode('utf-8')
+    with pytest.raises(ValueError):
+        read_json_fields(split(raw[:cut], 4))
+
+
+def test_truncated_inside_string():
+    raw = b'{"a": "unterminated'
+    with pytest.raises(ValueError):
+        read_json_fields([raw])
+
+
+def test_splitter_events():
+    events = []
+    splitter = JsonObjectSplitter(lambda key: events.append(('key', key)), lambda data: events.append(('data', data)),
+                                  lambda: events.append(('end',)))
+    for chunk in split(b'{"a": [1, 2], "b": "x"}', 2):
+        splitter.feed(chunk)
+    keys = [e[1] for e in events if e[0] == 'key']
+    values = b''.join(e[1] for e in events if e[0] == 'data')
+    assert keys == ['a', 'b']
+    assert values.replace(b' ', b'') == b'[1,2]"x"'
+    assert len([e for e in events if e[0] == 'end']) == 2
+
+
+def corpus_counts():
+    # Empty first, middle and last rows, trailing zero columns, deltas over varint byte boundaries
+    rows = [[], [0, 127, 128, 16_383, 16_384, 2_097_152], [], [5], [3, 2_097_151], []]
+    row, col = zip(*((i, j) for i, indices in enumerate(rows) for j in indices))
+    data = np.arange(1, len(row) + 1, dtype=np.int64) * 1_000
+    return csr_matrix((data, (row, col)), shape=(len(rows), 3_000_000))
+
+
+def assert_same_csr(actual, expected):
+    assert actual.shape == expected.shape
+    assert actual.dtype == expected.dtype
+    assert np.array_equal(actual.indptr, expected.indptr)
+    assert np.array_equal(actual.indices, expected.indices)
+    assert np.array_equal(actual.data, expected.data)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_csr_json_roundtrip(compress):
+    matrix = corpus_counts()
+    assert_same_csr(csr_from_json(json.loads(json.dumps(csr_to_json(matrix, compress=compress)))), matrix)
+
+
+def test_csr_json_roundtrip_empty():
+    matrix = csr_matrix((3, 5), dtype=np.int64)
+    assert_same_csr(csr_from_json(csr_to_json(matrix, compress=True)), matrix)
+
+
+def test_csr_binary_roundtrip_is_mapped():
+    matrix = corpus_counts()
+    writer = _Writer()
+    entry = _encode_csr(writer, matrix)
+    with tempfile.TemporaryFile() as f:
+        f.write(b''.join(bytes(blob) for blob in writer.blobs))
+        f.flush()
+        payload = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    decoded = _decode_csr(payload, entry)
+    assert_same_csr(decoded, matrix)
+    assert not decoded.data.flags.writeable
+    assert np.array_equal((decoded @ np.ones(matrix.shape[1], dtype=np.int64)), matrix.sum(axis=1).A1)
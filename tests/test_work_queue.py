@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from pubtrends.work_queue import TASK_DONE, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.sqlite'))
+
+
+def test_enqueue_once_per_open_task(queue):
+    task_id = queue.enqueue('summarize', 'job', {'a': 1})
+    assert task_id is not None
+    assert queue.enqueue('summarize', 'job') is None
+    assert queue.enqueue('semantic_search', 'job') is not None
+    assert queue.claim('worker') == (task_id, 'summarize', 'job', {'a': 1})
+    assert queue.enqueue('summarize', 'job') is None
+    queue.finish(task_id, TASK_DONE)
+    assert queue.enqueue('summarize', 'job') is not None
+
+
+def test_concurrent_enqueue_creates_single_task(queue):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def enqueue():
+        barrier.wait()
+        results.append(queue.enqueue('summarize', 'job'))
+
+    threads = [threading.Thread(target=enqueue) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([task_id for task_id in results if task_id is not None]) == 1
+    assert queue.size() == 1
+
+
+def test_cleanup_removes_only_old_finished_tasks(queue):
+    finished = queue.enqueue('summarize', 'done')
+    queue.finish(finished, TASK_DONE)
+    queue.enqueue('summarize', 'queued')
+    assert queue.cleanup(max_age=60) == 0
+    assert queue.cleanup(max_age=-1) == 1
+    assert queue.size() == 1
@@ -0,0 +1,8 @@
+"""
+Traces of search jobs, see pubtrends/tracing.py.
+"""
+from config import TRACES_DB, TRACING
+from pubtrends.tracing import SpanStore, Tracer
+
+# Spans of all processes are collected in a single SQLite file
+tracer = Tracer(SpanStore(TRACES_DB), enabled=TRACING)
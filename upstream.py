@@ -0,0 +1,19 @@
+from config import HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_MAX_BODY_SIZE
+from metrics import observe_upstream_call
+from pubtrends.http import HttpClient, AsyncHttpClient
+from tracing import tracer
+
+
+def on_upstream_call(endpoint, status, seconds):
+    observe_upstream_call(endpoint, status, seconds)
+    tracer.record(endpoint, seconds, status=status)
+
+
+# Shared by all upstream calls: PubTrends API, semantic search and LLM endpoints
+http_client = HttpClient(pool_size=HTTP_POOL_SIZE,
+                         connect_timeout=HTTP_CONNECT_TIMEOUT,
+                         read_timeout=HTTP_READ_TIMEOUT,
+                         retries=HTTP_RETRIES,
+                         on_record=on_upstream_call)
+# Used by pipeline stages running in the asyncio event loop
+async_http_client = AsyncHttpClient(http_client, max_body_size=HTTP_MAX_BODY_SIZE)
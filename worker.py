@@ -0,0 +1,29 @@
+"""
+Standalone pipeline engine, run alongside web workers started with PIPELINE_IN_WEB=0:
+    python worker.py
+"""
+import time
+
+from async_tasks import start_workers
+from config import *
+from job_driver import JobDriver
+from metrics import registry, register_gauges
+from pubtrends.jobs import create_job_store
+from pubtrends.scheduler import JobScheduler
+from tracing import tracer
+
+if __name__ == '__main__':
+    job_store = create_job_store(JOB_STORE, JOBS_DB)
+    engine = start_workers(job_store)
+    scheduler = JobScheduler(SCHEDULER_DB, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS)
+    driver = JobDriver(job_store, scheduler)
+    driver.start()
+    register_gauges(job_store, engine.queue, scheduler, engine, driver)
+    if WORKER_METRICS_PORT:
+        registry.serve(WORKER_METRICS_PORT)
+    print(f"Worker {engine.worker_id} started")
+    while True:
+        time.sleep(60)
+        job_store.cleanup()
+        tracer.store.cleanup(JOB_TTL)
+        engine.queue.cleanup(JOB_TTL)